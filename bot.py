@@ -1,20 +1,44 @@
+import io
 import os
+import sys
+import re
+import csv
+import gzip
+import shutil
+import secrets
+import hashlib
+import heapq
+import threading
+import zlib
+import struct
 import sqlite3
+import tempfile
 import logging
-import requests
+import time
+import asyncio
+import calendar
 import json
-from datetime import datetime, timedelta
+from collections import Counter, OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from dotenv import load_dotenv
 from telegram import (
     Update, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
-    KeyboardButton
+    KeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent
 )
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, ConversationHandler, filters
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler,
+    CallbackQueryHandler, InlineQueryHandler, TypeHandler, ContextTypes, ConversationHandler, filters
 )
 
 # Загрузка переменных окружения
@@ -30,8 +54,9 @@ logger = logging.getLogger(__name__)
 # Состояния для ConversationHandler
 (
     TEXT, DUE_DATE, PRIORITY, CUSTOM_DATE, 
-    EDIT_CHOICE, EDIT_TEXT, EDIT_DATE, EDIT_PRIORITY, EDIT_CUSTOM_DATE
-) = range(9)
+    EDIT_CHOICE, EDIT_TEXT, EDIT_DATE, EDIT_PRIORITY, EDIT_CUSTOM_DATE,
+    RECURRENCE
+) = range(10)
 
 # Приоритеты
 PRIORITIES = {
@@ -42,151 +67,3260 @@ PRIORITIES = {
 
 # Конфигурация NewsAPI
 NEWS_API_KEY = os.getenv('NEWS_API_KEY', '7c90fc1f9c9f46c2898f4f21684b5c57')
-NEWS_API_URL = f"https://newsapi.org/v2/top-headlines?country=us&category=business&apiKey={NEWS_API_KEY}"
+NEWS_API_URL = "https://newsapi.org/v2/top-headlines"
+
+# ЧАСОВЫЕ ПОЯСА
+# Сроки хранятся как UTC epoch (INTEGER), переводятся в пояс пользователя при показе
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'UTC')
+TIMEZONE_CACHE_SIZE = 10000
+# Переходы часовых поясов происходят на границах 15 минут UTC
+OFFSET_BUCKET_SECONDS = 900
+EPOCH = datetime(1970, 1, 1)
+
+@lru_cache(maxsize=None)
+def get_zone(tz_name):
+    """Кэшированный объект ZoneInfo"""
+    return ZoneInfo(tz_name)
+
+@lru_cache(maxsize=65536)
+def _zone_offset(tz_name, bucket):
+    """Смещение пояса (в секундах) для 15-минутного интервала"""
+    moment = datetime.fromtimestamp(bucket * OFFSET_BUCKET_SECONDS, get_zone(tz_name))
+    return int(moment.utcoffset().total_seconds())
+
+def to_local(timestamp, tz_name):
+    """UTC epoch -> наивное локальное время пользователя"""
+    offset = _zone_offset(tz_name, timestamp // OFFSET_BUCKET_SECONDS)
+    return EPOCH + timedelta(seconds=timestamp + offset)
+
+def to_epoch(local_dt, tz_name):
+    """Наивное локальное время пользователя -> UTC epoch"""
+    return int(local_dt.replace(tzinfo=get_zone(tz_name)).timestamp())
+
+def user_now(tz_name):
+    """Текущее наивное локальное время в поясе пользователя"""
+    return datetime.now(get_zone(tz_name)).replace(tzinfo=None)
+
+def format_due_date(timestamp, tz_name):
+    """Форматирование срока в поясе пользователя"""
+    return to_local(timestamp, tz_name).strftime("%d.%m.%Y %H:%M")
+
+# РАЗБОР СРОКОВ НА ЕСТЕСТВЕННОМ ЯЗЫКЕ
+# Время по умолчанию, если во фразе указан только день
+DEFAULT_DUE_TIME = (23, 59)
+
+_STRICT_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+_DUE_TOKEN_RE = re.compile(
+    r"(?P<iso>\d{4}-\d{1,2}-\d{1,2})"
+    r"|(?P<dotted>\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?)"
+    r"|(?P<clock>\d{1,2}:\d{2})"
+    r"|(?P<number>\d+)"
+    r"|(?P<word>[a-zа-яё]+)"
+    r"|(?P<gap>[\s,]+)"
+    r"|(?P<other>.)"
+)
+
+def _build_due_word_table():
+    """Таблица слов грамматики сроков: слово -> (вид токена, значение)"""
+    table = {}
+    
+    def add(kind, value, *words):
+        for word in words:
+            table[word] = (kind, value)
+    
+    add('day', 0, 'сегодня', 'today', 'tonight')
+    add('day', 1, 'завтра', 'tomorrow')
+    add('day', 2, 'послезавтра')
+    add('weekday', 0, 'понедельник', 'пн', 'monday', 'mon')
+    add('weekday', 1, 'вторник', 'вт', 'tuesday', 'tue', 'tues')
+    add('weekday', 2, 'среда', 'среду', 'ср', 'wednesday', 'wed')
+    add('weekday', 3, 'четверг', 'чт', 'thursday', 'thu', 'thurs')
+    add('weekday', 4, 'пятница', 'пятницу', 'пт', 'friday', 'fri')
+    add('weekday', 5, 'суббота', 'субботу', 'сб', 'saturday', 'sat')
+    add('weekday', 6, 'воскресенье', 'вс', 'sunday', 'sun')
+    add('month', 1, 'января', 'январь', 'january', 'jan')
+    add('month', 2, 'февраля', 'февраль', 'february', 'feb')
+    add('month', 3, 'марта', 'март', 'march', 'mar')
+    add('month', 4, 'апреля', 'апрель', 'april', 'apr')
+    add('month', 5, 'мая', 'май', 'may')
+    add('month', 6, 'июня', 'июнь', 'june', 'jun')
+    add('month', 7, 'июля', 'июль', 'july', 'jul')
+    add('month', 8, 'августа', 'август', 'august', 'aug')
+    add('month', 9, 'сентября', 'сентябрь', 'september', 'sep', 'sept')
+    add('month', 10, 'октября', 'октябрь', 'october', 'oct')
+    add('month', 11, 'ноября', 'ноябрь', 'november', 'nov')
+    add('month', 12, 'декабря', 'декабрь', 'december', 'dec')
+    add('unit', 'minutes', 'минута', 'минуту', 'минуты', 'минут', 'мин', 'minute', 'minutes', 'min', 'mins')
+    add('unit', 'hours', 'час', 'часа', 'часов', 'ч', 'hour', 'hours', 'h')
+    add('unit', 'days', 'день', 'дней', 'сутки', 'day', 'days', 'd')
+    add('unit', 'weeks', 'неделя', 'неделю', 'недели', 'недель', 'week', 'weeks', 'w')
+    add('unit', 'months', 'месяц', 'месяца', 'месяцев', 'month', 'months')
+    # "через 3 дня" - это срок, а "в 3 дня" - 15:00
+    add('days_or_pm', None, 'дня')
+    add('half_hour', None, 'полчаса')
+    add('relative', None, 'через', 'in')
+    add('meridiem', 'am', 'am', 'утра', 'утром', 'ночи')
+    add('meridiem', 'pm', 'pm', 'вечера', 'вечером')
+    add('fixed_time', 12, 'полдень', 'noon')
+    add('fixed_time', 0, 'полночь', 'midnight')
+    add('number', 1, 'a', 'an', 'one', 'один', 'одну', 'одни')
+    # После "в"/"at" число с "ч" - время суток: "в 9 ч" - это 09:00
+    add('at', None, 'в', 'во', 'at')
+    add('skip', None, 'на', 'к', 'до', 'и', 'on', 'by', 'the', 'and', 'this',
+        'next', 'следующий', 'следующую', 'следующее', 'следующей')
+    return table
+
+_DUE_WORDS = _build_due_word_table()
+
+def _tokenize_due_date(text):
+    """Разбиение фразы на токены грамматики; None, если встречено неизвестное слово"""
+    tokens = []
+    for match in _DUE_TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'gap':
+            continue
+        if kind == 'word':
+            if value not in _DUE_WORDS:
+                return None
+            tokens.append(_DUE_WORDS[value])
+        elif kind == 'iso':
+            year, month, day = (int(part) for part in value.split('-'))
+            tokens.append(('date', (day, month, year)))
+        elif kind == 'dotted':
+            parts = [int(part) for part in re.split(r"[./]", value)]
+            if len(parts) == 3 and parts[2] < 100:
+                parts[2] += 2000
+            tokens.append(('date', tuple(parts) if len(parts) == 3 else (parts[0], parts[1], None)))
+        elif kind == 'clock':
+            hour, minute = (int(part) for part in value.split(':'))
+            tokens.append(('clock', (hour, minute)))
+        elif kind == 'number':
+            tokens.append(('number', int(value)))
+        else:
+            return None
+    return tokens
+
+def _resolve_date(day, month, year, today):
+    """Дата из дня и месяца; без года - ближайшая в будущем"""
+    if year is not None:
+        return datetime(year, month, day).date()
+    candidate = datetime(today.year, month, day).date()
+    if candidate < today:
+        candidate = datetime(today.year + 1, month, day).date()
+    return candidate
+
+def _add_months(day, months):
+    """Сдвиг даты на months месяцев с обрезкой до конца месяца"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+def _apply_meridiem(hour, meridiem):
+    """Перевод 12-часового времени в 24-часовое"""
+    if not 1 <= hour <= 12:
+        raise ValueError(f"Некорректный час: {hour}")
+    if meridiem == 'am':
+        return 0 if hour == 12 else hour
+    return hour if hour == 12 else hour + 12
+
+def _shift(unit, amount, day_shift, month_shift, time_shift):
+    """Накопление относительного сдвига по единице измерения"""
+    if unit == 'minutes':
+        time_shift += timedelta(minutes=amount)
+    elif unit == 'hours':
+        time_shift += timedelta(hours=amount)
+    elif unit == 'days':
+        day_shift += amount
+    elif unit == 'weeks':
+        day_shift += 7 * amount
+    else:
+        month_shift += amount
+    return day_shift, month_shift, time_shift
+
+def parse_due_date(text, now):
+    """Разбор срока из фразы на русском или английском.
+    
+    Понимает "2024-12-31 23:59", "31.12 18:00", "завтра в 9", "через 3 дня",
+    "next friday 18:00", "in 2 hours" и т.п. Возвращает наивное локальное
+    время пользователя; для нераспознанной фразы бросает ValueError.
+    """
+    text = text.strip().lower()
+    
+    # Быстрый путь для строгого формата
+    if _STRICT_DATE_RE.fullmatch(text):
+        return datetime.strptime(text, "%Y-%m-%d %H:%M")
+    
+    tokens = _tokenize_due_date(text)
+    if not tokens:
+        raise ValueError(f"Не удалось разобрать срок: {text}")
+    
+    today = now.date()
+    day = None
+    clock = None
+    relative = False
+    day_shift = 0
+    month_shift = 0
+    time_shift = timedelta()
+    
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        next_kind, next_value = tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+        after_at = i > 0 and tokens[i - 1][0] == 'at'
+        i += 1
+        # "в 9 ч", "завтра 9h" - время суток; сдвиг только после "через"/"in"
+        hour_clock = (kind == 'number' and next_kind == 'unit' and next_value == 'hours'
+                      and (after_at or not relative))
+        
+        if kind in ('skip', 'at'):
+            continue
+        if kind == 'relative':
+            relative = True
+        elif kind == 'date':
+            day = _resolve_date(*value, today)
+        elif kind == 'day':
+            day = today + timedelta(days=value)
+        elif kind == 'weekday':
+            day = today + timedelta(days=(value - today.weekday()) % 7 or 7)
+        elif kind == 'fixed_time':
+            clock = (value, 0)
+        elif kind == 'half_hour':
+            time_shift += timedelta(minutes=30)
+        elif kind == 'month' and next_kind == 'number':
+            day = _resolve_date(next_value, value, None, today)
+            i += 1
+        elif kind == 'unit' and relative:
+            # "через час", "in a week" без числа
+            day_shift, month_shift, time_shift = _shift(value, 1, day_shift, month_shift, time_shift)
+        elif kind == 'number' and next_kind == 'month':
+            day = _resolve_date(value, next_value, None, today)
+            i += 1
+        elif kind == 'number' and not hour_clock and (
+                next_kind == 'unit' or (next_kind == 'days_or_pm' and relative)):
+            unit = next_value if next_kind == 'unit' else 'days'
+            day_shift, month_shift, time_shift = _shift(unit, value, day_shift, month_shift, time_shift)
+            i += 1
+        elif kind in ('number', 'clock'):
+            hour, minute = (value, 0) if kind == 'number' else value
+            if hour_clock:
+                i += 1
+                next_kind, next_value = tokens[i] if i < len(tokens) else (None, None)
+            if next_kind == 'meridiem':
+                hour = _apply_meridiem(hour, next_value)
+                i += 1
+            elif next_kind == 'days_or_pm':
+                hour = _apply_meridiem(hour, 'pm')
+                i += 1
+            if not (0 <= hour <= 23 and 0 <= minute <= 59):
+                raise ValueError(f"Некорректное время: {hour}:{minute}")
+            clock = (hour, minute)
+        else:
+            raise ValueError(f"Не удалось разобрать срок: {text}")
+    
+    if day is None and clock is None:
+        # Только сдвиг ("через 3 дня 5 часов", "in 2 hours") - от текущего момента
+        if not (day_shift or month_shift or time_shift):
+            raise ValueError(f"Не удалось разобрать срок: {text}")
+        base = now.replace(second=0, microsecond=0)
+        target_day = _add_months(today, month_shift) + timedelta(days=day_shift)
+        return base.replace(year=target_day.year, month=target_day.month, day=target_day.day) + time_shift
+    
+    if day_shift or month_shift:
+        day = _add_months(day or today, month_shift) + timedelta(days=day_shift)
+    
+    if clock is None and time_shift:
+        # "завтра через 2 часа" - сдвиг от текущего времени, а не от 23:59
+        clock = (now.hour, now.minute)
+    hour, minute = clock or DEFAULT_DUE_TIME
+    target_day = day or today
+    result = datetime(target_day.year, target_day.month, target_day.day, hour, minute)
+    if day is None and result <= now:
+        # Указано только время, и оно уже прошло - значит, завтра
+        result += timedelta(days=1)
+    return result + time_shift
+
+# ПОВТОРЯЮЩИЕСЯ ЗАДАЧИ
+WEEKDAY_NAMES = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6}
+WEEKDAY_TITLES = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+RECURRENCE_LOOKAHEAD_DAYS = 366 * 5
+
+# Выбор повторения на клавиатуре -> правило
+RECURRENCE_PRESETS = {
+    "rec_daily": lambda now: "daily",
+    "rec_weekdays": lambda now: "weekly:mon,tue,wed,thu,fri",
+    "rec_weekly": lambda now: f"weekly:{now.weekday()}",
+    "rec_monthly": lambda now: f"monthly:{now.day}",
+}
+
+def _parse_cron_field(field, low, high):
+    """Разбор одного поля cron-выражения в отсортированный кортеж значений"""
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f"Некорректный шаг: {step_str}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Значение вне диапазона: {part}")
+        values.update(range(start, end + 1, step))
+    return tuple(sorted(values))
+
+class RecurrenceRule:
+    """Правило повторения задачи.
+
+    Поддерживаемые форматы:
+    daily, weekly:mon,wed (или weekly:0,2), monthly:15, cron:M H DOM MON DOW
+    """
+
+    def __init__(self, rule):
+        self.rule = rule.strip().lower()
+        self.weekdays = None
+        self.month_day = None
+        self.minutes = self.hours = self.days = self.months = None
+        self.dom_restricted = self.dow_restricted = False
+
+        kind, _, args = self.rule.partition(':')
+        self.kind = kind
+        if kind == 'daily' and not args:
+            return
+        if kind == 'weekly' and args:
+            days = set()
+            for name in args.split(','):
+                name = name.strip()
+                day = WEEKDAY_NAMES[name] if name in WEEKDAY_NAMES else int(name)
+                if not 0 <= day <= 6:
+                    raise ValueError(f"Некорректный день недели: {name}")
+                days.add(day)
+            self.weekdays = frozenset(days)
+            return
+        if kind == 'monthly' and args:
+            self.month_day = int(args)
+            if not 1 <= self.month_day <= 31:
+                raise ValueError(f"Некорректный день месяца: {args}")
+            return
+        if kind == 'cron' and args:
+            fields = args.split()
+            if len(fields) != 5:
+                raise ValueError("cron-выражение должно содержать 5 полей")
+            self.minutes = _parse_cron_field(fields[0], 0, 59)
+            self.hours = _parse_cron_field(fields[1], 0, 23)
+            self.days = frozenset(_parse_cron_field(fields[2], 1, 31))
+            self.months = frozenset(_parse_cron_field(fields[3], 1, 12))
+            # В cron воскресенье - это 0 или 7, в Python - 6
+            self.weekdays = frozenset((day - 1) % 7 for day in _parse_cron_field(fields[4], 0, 7))
+            self.dom_restricted = fields[2] != '*'
+            self.dow_restricted = fields[4] != '*'
+            return
+        raise ValueError(f"Неизвестное правило повторения: {rule}")
+
+    def _matches_day(self, day):
+        """Подходит ли календарный день под правило"""
+        if self.kind == 'daily':
+            return True
+        if self.kind == 'weekly':
+            return day.weekday() in self.weekdays
+        if self.kind == 'monthly':
+            last_day = calendar.monthrange(day.year, day.month)[1]
+            return day.day == min(self.month_day, last_day)
+        if day.month not in self.months:
+            return False
+        dom_match = day.day in self.days
+        dow_match = day.weekday() in self.weekdays
+        # Как в cron: если ограничены оба поля, достаточно совпадения любого
+        if self.dom_restricted and self.dow_restricted:
+            return dom_match or dow_match
+        return dom_match and dow_match
+
+    def next_after(self, after, anchor=None):
+        """Ближайшее вхождение строго после after.
+
+        Для daily/weekly/monthly время суток берется из anchor
+        (обычно предыдущий срок задачи).
+        """
+        anchor = anchor or after
+        day = after.date()
+        for _ in range(RECURRENCE_LOOKAHEAD_DAYS):
+            if self._matches_day(day):
+                if self.kind == 'cron':
+                    for hour in self.hours:
+                        for minute in self.minutes:
+                            candidate = datetime(day.year, day.month, day.day, hour, minute)
+                            if candidate > after:
+                                return candidate
+                else:
+                    candidate = datetime.combine(day, anchor.time())
+                    if candidate > after:
+                        return candidate
+            day += timedelta(days=1)
+        return None
+
+    def describe(self):
+        """Человекочитаемое описание правила"""
+        if self.kind == 'daily':
+            return "каждый день"
+        if self.kind == 'weekly':
+            return "по дням: " + ", ".join(WEEKDAY_TITLES[day] for day in sorted(self.weekdays))
+        if self.kind == 'monthly':
+            return f"каждый месяц {self.month_day}-го числа"
+        return f"по расписанию {self.rule[5:]}"
+
+@lru_cache(maxsize=1024)
+def parse_recurrence(rule):
+    """Разбор правила повторения (результат кэшируется)"""
+    return RecurrenceRule(rule)
+
+def next_occurrence(rule, due_date=None, tz_name=DEFAULT_TIMEZONE, now=None):
+    """Вычисление следующего срока повторяющейся задачи (UTC epoch).
+    
+    Правило применяется к локальному времени пользователя, чтобы
+    "каждый день в 9:00" оставалось 9:00 и после перехода на летнее время.
+    """
+    now = now or user_now(tz_name)
+    if due_date is not None:
+        anchor = to_local(due_date, tz_name)
+        after = max(anchor, now)
+    else:
+        # Первый срок: сегодняшнее вхождение годится, если оно еще впереди
+        anchor = now.replace(hour=23, minute=59, second=59, microsecond=0)
+        after = now
+    next_due = parse_recurrence(rule).next_after(after, anchor)
+    return to_epoch(next_due, tz_name) if next_due else None
+
+# РЕЗЕРВНЫЕ КОПИИ
+# Снимки инкрементальные на уровне страниц SQLite: полный снимок (.db.gz), за
+# ним дельты (.delta.gz) только со страницами, изменившимися с прошлого снимка.
+# Копия через backup API по-прежнему читает всю базу (иначе не получить
+# согласованный срез), но на диск пишутся только изменения. Каждые
+# BACKUP_FULL_EVERY дельт снимается новый полный снимок, чтобы цепочка для
+# восстановления оставалась короткой.
+BACKUP_DIR = os.getenv('BACKUP_DIR', '/tmp/tasks_backups')
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '3600'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '24'))
+BACKUP_FULL_EVERY = int(os.getenv('BACKUP_FULL_EVERY', '12'))
+# Копирование идет маленькими шагами с паузой, чтобы не забирать весь диск у бота
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_SLEEP = 0.005
+SNAPSHOT_SUFFIX = ".db.gz"
+DELTA_SUFFIX = ".delta.gz"
+# Заголовок дельты: сигнатура, размер страницы, число страниц в базе
+DELTA_HEADER = struct.Struct(">4sII")
+DELTA_MAGIC = b"TSKD"
+DELTA_PAGE = struct.Struct(">I")
+
+def snapshot_prefix(db_path):
+    """Префикс имен снимков файла БД: tasks.db -> tasks-"""
+    return os.path.splitext(os.path.basename(db_path))[0] + "-"
+
+def list_snapshots(backup_dir, prefix):
+    """Полные снимки и дельты файла БД в каталоге, от старых к новым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith(prefix) and name.endswith((SNAPSHOT_SUFFIX, DELTA_SUFFIX))
+    )
+    return [os.path.join(backup_dir, name) for name in names]
+
+def is_full_snapshot(path):
+    return path.endswith(SNAPSHOT_SUFFIX)
+
+def page_digests(path, page_size):
+    """Короткие хэши всех страниц файла БД"""
+    digests = []
+    with open(path, 'rb') as source:
+        for page in iter(lambda: source.read(page_size), b""):
+            digests.append(hashlib.blake2b(page, digest_size=8).digest())
+    return digests
+
+def write_delta(copy_path, page_size, pages, path):
+    """Запись в дельту страниц pages (номера с нуля) из копии БД"""
+    page_count = os.path.getsize(copy_path) // page_size
+    with open(copy_path, 'rb') as source, gzip.open(path, 'wb', compresslevel=6) as packed:
+        packed.write(DELTA_HEADER.pack(DELTA_MAGIC, page_size, page_count))
+        for page_no in pages:
+            source.seek(page_no * page_size)
+            packed.write(DELTA_PAGE.pack(page_no))
+            packed.write(source.read(page_size))
+
+def apply_delta(delta_path, db_file):
+    """Наложение дельты на открытый файл БД (режим r+b)"""
+    with gzip.open(delta_path, 'rb') as packed:
+        magic, page_size, page_count = DELTA_HEADER.unpack(packed.read(DELTA_HEADER.size))
+        if magic != DELTA_MAGIC:
+            raise ValueError(f"Неизвестный формат дельты: {delta_path}")
+        while True:
+            record = packed.read(DELTA_PAGE.size)
+            if not record:
+                break
+            page = packed.read(page_size)
+            if len(record) != DELTA_PAGE.size or len(page) != page_size:
+                raise ValueError(f"Дельта обрезана: {delta_path}")
+            db_file.seek(DELTA_PAGE.unpack(record)[0] * page_size)
+            db_file.write(page)
+    db_file.truncate(page_count * page_size)
+
+def _remove_sidecars(db_path):
+    """Удаление -wal/-shm, оставшихся от прежнего файла БД"""
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+def restore_latest_snapshot(db_path, backup_dir):
+    """Восстановление БД по последней целой цепочке "полный снимок + дельты".
+    
+    Если последняя дельта повреждена, пробуется состояние на шаг раньше.
+    Возвращает True, если база восстановлена.
+    """
+    snapshots = list_snapshots(backup_dir, snapshot_prefix(db_path))
+    restore_path = db_path + ".restore"
+    for end in range(len(snapshots) - 1, -1, -1):
+        start = next((index for index in range(end, -1, -1) if is_full_snapshot(snapshots[index])), None)
+        if start is None:
+            continue
+        try:
+            with gzip.open(snapshots[start], 'rb') as source, open(restore_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            with open(restore_path, 'r+b') as target:
+                for delta in snapshots[start + 1:end + 1]:
+                    apply_delta(delta, target)
+            
+            conn = sqlite3.connect(restore_path)
+            check = conn.execute("PRAGMA quick_check").fetchone()[0]
+            conn.close()
+            if check != 'ok':
+                logger.warning(f"Снимок {snapshots[end]} поврежден: {check}")
+                continue
+            
+            # Чужой WAL рядом с восстановленным файлом SQLite применил бы к нему
+            _remove_sidecars(db_path)
+            os.replace(restore_path, db_path)
+            logger.info(f"База данных восстановлена из снимка {snapshots[end]} "
+                        f"(дельт: {end - start})")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка восстановления из снимка {snapshots[end]}: {e}")
+        finally:
+            if os.path.exists(restore_path):
+                os.remove(restore_path)
+            _remove_sidecars(restore_path)
+    return False
+
+class SnapshotManager:
+    """Фоновые сжатые инкрементальные снимки БД через онлайн backup API SQLite"""
+    
+    def __init__(self, db_path, backup_dir=BACKUP_DIR, interval=BACKUP_INTERVAL, keep=BACKUP_KEEP,
+                 full_every=BACKUP_FULL_EVERY):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.full_every = full_every
+        # Хэши страниц последнего записанного снимка; после перезапуска
+        # их нет, и первый снимок всегда полный
+        self._page_digests = None
+        self._deltas = 0
+        self._task = None
+    
+    def take_snapshot(self, force=False):
+        """Снимок БД по шагам в BACKUP_PAGES_PER_STEP страниц.
+        
+        Пишет дельту с изменившимися страницами или полный снимок (force, нет
+        базы для сравнения, цепочка достигла full_every). Возвращает путь к
+        снимку или None, если база не менялась с прошлого снимка.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        started = time.perf_counter()
+        stamp = f"{snapshot_prefix(self.db_path)}{datetime.now(timezone.utc):%Y%m%d-%H%M%S-%f}"
+        fd, copy_path = tempfile.mkstemp(dir=self.backup_dir, suffix=".tmp")
+        os.close(fd)
+        
+        try:
+            source = sqlite3.connect(self.db_path)
+            target = sqlite3.connect(copy_path)
+            try:
+                page_size = source.execute("PRAGMA page_size").fetchone()[0]
+                # Открытая транзакция чтения фиксирует снимок WAL: запись из других
+                # соединений не перезапускает копирование и не блокируется им
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                source.backup(
+                    target,
+                    pages=BACKUP_PAGES_PER_STEP,
+                    progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_SLEEP)
+                )
+                source.rollback()
+            finally:
+                target.close()
+                source.close()
+            
+            digests = page_digests(copy_path, page_size)
+            full = force or self._page_digests is None or self._deltas >= self.full_every
+            if full:
+                path = os.path.join(self.backup_dir, stamp + SNAPSHOT_SUFFIX)
+                with open(copy_path, 'rb') as raw, gzip.open(path + ".part", 'wb', compresslevel=6) as packed:
+                    shutil.copyfileobj(raw, packed)
+            else:
+                changed = [
+                    page_no for page_no, digest in enumerate(digests)
+                    if page_no >= len(self._page_digests) or self._page_digests[page_no] != digest
+                ]
+                if not changed and len(digests) == len(self._page_digests):
+                    return None
+                path = os.path.join(self.backup_dir, stamp + DELTA_SUFFIX)
+                write_delta(copy_path, page_size, changed, path + ".part")
+            os.replace(path + ".part", path)
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        
+        self._page_digests = digests
+        self._deltas = 0 if full else self._deltas + 1
+        self.apply_retention()
+        kind = "полный" if full else f"дельта, страниц: {len(changed)}"
+        logger.info(f"Снимок БД {os.path.basename(path)} ({kind}) создан за {time.perf_counter() - started:.2f} с")
+        return path
+    
+    def apply_retention(self):
+        """Удаление старых снимков сверх лимита keep.
+        
+        Полный снимок, от которого зависят оставшиеся дельты, не удаляется.
+        """
+        snapshots = list_snapshots(self.backup_dir, snapshot_prefix(self.db_path))
+        cut = max(len(snapshots) - self.keep, 0)
+        while cut > 0 and not is_full_snapshot(snapshots[cut]):
+            cut -= 1
+        for snapshot in snapshots[:cut]:
+            try:
+                os.remove(snapshot)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старый снимок {snapshot}: {e}")
+    
+    def start(self, application):
+        """Запуск периодического снятия снимков"""
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Резервное копирование запущено: каждые {self.interval} с в {self.backup_dir}")
+    
+    async def stop(self):
+        """Остановка цикла и финальный снимок"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.to_thread(self.take_snapshot)
+        except Exception as e:
+            logger.error(f"Ошибка финального снимка БД: {e}")
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.take_snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка снятия снимка БД: {e}")
+
+def build_snapshot_managers(manager):
+    """Менеджеры снимков для всех открытых шардов, включая лишние после уменьшения DB_SHARDS"""
+    return [SnapshotManager(shard.db_path) for shard in manager.shards]
+
+# Колонки, которые возвращают запросы списков (порядок важен для распаковки)
+TASK_COLUMNS = "id, user_id, text, due_date, priority, status, created_at"
+VERSIONED_TASK_COLUMNS = TASK_COLUMNS + ", version"
+
+# Колонки, которые можно менять через update_task
+UPDATABLE_TASK_COLUMNS = frozenset({"text", "due_date", "priority", "status", "recurrence", "notified"})
+
+# Колонки файлов импорта/экспорта
+EXPORT_COLUMNS = ["id", "text", "due_date", "priority", "status", "created_at", "recurrence"]
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+
+# Колонки, добавленные после первой версии схемы
+TASK_MIGRATIONS = [
+    ("recurrence", "TEXT"),
+    ("notified", "INTEGER DEFAULT 0"),
+    ("version", "INTEGER NOT NULL DEFAULT 0"),
+    ("escalation", "INTEGER NOT NULL DEFAULT 0"),
+    ("nudge_at", "INTEGER"),
+]
+
+# Таблицы с данными пользователя (кроме tasks) и колонка с его id: переезжают
+# вместе с пользователем при перебалансировке шардов
+USER_TABLES = [
+    ("user_settings", "user_id"),
+    ("news_subscriptions", "user_id"),
+    ("news_watermarks", "user_id"),
+    ("chat_boards", "chat_id"),
+    ("task_stats_daily", "user_id"),
+    ("task_backlog", "user_id"),
+    ("digest_slots", "user_id"),
+]
+
+# Счетчики, которые при переносе складываются с уже накопленными в целевом шарде
+USER_TABLE_MERGES = {
+    "task_stats_daily": '''
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            created = created + excluded.created,
+            completed = completed + excluded.completed,
+            completed_on_time = completed_on_time + excluded.completed_on_time
+    ''',
+    "task_backlog": '''
+        ON CONFLICT(user_id, priority) DO UPDATE SET active = active + excluded.active
+    ''',
+}
+
+# ШАРДИРОВАНИЕ
+# Пользователи распределяются по DB_SHARDS файлам по хэшу user_id. Шард 0 -
+# это исходный файл БД: в нем же хранятся справочник перенесенных пользователей
+# и число шардов, по которому сейчас разложены данные. После изменения
+# DB_SHARDS запросы идут по старой раскладке, пока бот в фоне не перенесет
+# всех пользователей (или пока не отработает `python bot.py rebalance` при
+# остановленном боте).
+# Обработчики обновлений выполняются по очереди в цикле событий, так что
+# параллельно в разные шарды пишут только разные потоки (фоновые задачи,
+# перебалансировка). Обработчикам шарды дают файлы и индексы меньшего размера.
+DB_SHARDS = int(os.getenv('DB_SHARDS', '1'))
+
+def shard_paths(db_path, shard_count):
+    """Пути файлов шардов; нулевой шард - исходный файл БД"""
+    root, ext = os.path.splitext(db_path)
+    return [db_path] + [f"{root}.shard{index}{ext}" for index in range(1, shard_count)]
+
+def user_shard_index(user_id, shard_count):
+    """Номер шарда пользователя по стабильному хэшу user_id"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+class TaskShard:
+    """Файл БД шарда: одно постоянное соединение под собственной блокировкой"""
+    
+    def __init__(self, index, db_path):
+        self.index = index
+        self.db_path = db_path
+        self.conn = None
+        self.lock = threading.Lock()
+    
+    def open(self):
+        if not os.path.exists(self.db_path):
+            restore_latest_snapshot(self.db_path, BACKUP_DIR)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+    
+    @contextmanager
+    def session(self):
+        """Монопольный доступ к соединению шарда; при ошибке транзакция откатывается"""
+        with self.lock:
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.rollback()
+                raise
+
+def read_user_tasks(db_path, user_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Потоковое чтение задач пользователя из файла шарда.
+    
+    Читает через отдельное соединение, чтобы долгий экспорт не держал
+    блокировку шарда (в режиме WAL чтение не мешает записи). Годится и для
+    вызова из процесса пула.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, text, due_date, priority, status, created_at, recurrence
+            FROM tasks WHERE user_id = ?
+            ORDER BY id
+        ''', (user_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
 
 class TaskManager:
-    def __init__(self, db_path='/tmp/tasks.db'):
+    def __init__(self, db_path='/tmp/tasks.db', shard_count=1, lazy=False, timezone_cache_size=TIMEZONE_CACHE_SIZE):
         self.db_path = db_path
-        self.init_database()
+        self.shard_count = shard_count
+        self.timezone_cache_size = timezone_cache_size
+        self.shards = [TaskShard(index, path) for index, path in enumerate(shard_paths(db_path, shard_count))]
+        # Число шардов, по которому разложены данные; отличается от shard_count,
+        # пока после изменения DB_SHARDS не закончена перебалансировка
+        self.layout = shard_count
+        self._directory = {}
+        self._timezones = OrderedDict()
+        self._warmup = None
+        # Пользователи, которые во время перебалансировки писали не в свой шард
+        # новой раскладки (None - перебалансировка не идет)
+        self._strays = None
+        # Длительность последнего прохода перебалансировки под всеми блокировками, с
+        self.last_final_pass = None
+        if not lazy:
+            self.init_database()
+    
+    def warm_up(self):
+        """Инициализация БД в фоновом потоке, пока строится Application"""
+        self._warmup = threading.Thread(target=self.init_database, name="db-warmup", daemon=True)
+        self._warmup.start()
+    
+    def wait_ready(self):
+        """Ожидание окончания инициализации, запущенной warm_up"""
+        if self._warmup is not None:
+            self._warmup.join()
+            self._warmup = None
     
     def init_database(self):
         """Инициализация базы данных SQLite"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            had_tasks = [self._open_shard(shard) for shard in self.shards]
+            
+            with self.shards[0].session() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_id, shard FROM shard_directory")
+                self._directory = dict(cursor.fetchall())
+                self.layout = self._load_layout(cursor, had_tasks)
+                conn.commit()
             
+            # DB_SHARDS уменьшили: лишние шарды открыты, пока из них не перенесут данные
+            for index, path in enumerate(shard_paths(self.db_path, self.layout)):
+                if index >= len(self.shards):
+                    shard = TaskShard(index, path)
+                    self._open_shard(shard)
+                    self.shards.append(shard)
+            
+            if self.layout != self.shard_count:
+                logger.warning(f"Данные разложены по {self.layout} шардам, а DB_SHARDS={self.shard_count}: "
+                               f"до окончания перебалансировки используется старая раскладка")
+            logger.info(f"База данных инициализирована успешно (шардов: {len(self.shards)})")
+        except Exception as e:
+            logger.error(f"Ошибка инициализации БД: {e}")
+    
+    def _open_shard(self, shard):
+        """Открытие и инициализация файла шарда; True, если в нем уже были задачи"""
+        shard.open()
+        with shard.session() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks'")
+            had_tasks = cursor.fetchone() is not None
+            self._init_shard(shard, cursor)
+            conn.commit()
+        return had_tasks
+    
+    def _load_layout(self, cursor, had_tasks):
+        """Число шардов, по которому разложены данные (хранится в шарде 0)"""
+        cursor.execute("SELECT shard_count FROM shard_layout")
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        # Раскладка еще не записывалась: данные лежат в шардах, где уже были
+        # задачи (до шардирования - только в шарде 0); новая база - сразу по DB_SHARDS
+        layout = next((index for index, had in enumerate(had_tasks) if not had), len(had_tasks)) or self.shard_count
+        cursor.execute("INSERT INTO shard_layout (id, shard_count) VALUES (0, ?)", (layout,))
+        return layout
+    
+    def _init_shard(self, shard, cursor):
+        """Создание схемы и миграции в файле шарда"""
+        # WAL: читатели (в том числе резервное копирование) не блокируют писателей
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                due_date INTEGER,
+                priority INTEGER DEFAULT 2,
+                status TEXT DEFAULT 'active',
+                created_at TEXT NOT NULL,
+                recurrence TEXT,
+                notified INTEGER DEFAULT 0
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                timezone TEXT NOT NULL
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS news_subscriptions (
+                user_id INTEGER NOT NULL,
+                feed TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (user_id, feed)
+            )
+        ''')
+        
+        self._init_stats(cursor)
+        self._init_digest_slots(cursor)
+        
+        # Закрепленные доски задач групповых чатов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_boards (
+                chat_id INTEGER PRIMARY KEY,
+                message_id INTEGER NOT NULL
+            )
+        ''')
+        
+        # До какого момента пользователь видел ленту (см. NewsFeedCache)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS news_watermarks (
+                user_id INTEGER NOT NULL,
+                feed TEXT NOT NULL,
+                seen_until INTEGER NOT NULL,
+                PRIMARY KEY (user_id, feed)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_news_watermarks_age
+            ON news_watermarks (seen_until)
+        ''')
+        
+        self._migrate_columns(cursor)
+        self._migrate_due_dates(cursor)
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_deadline
+            ON tasks (status, notified, due_date)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_user
+            ON tasks (user_id, status)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_nudge
+            ON tasks (status, nudge_at)
+        ''')
+        # Инлайн-поиск активных задач по началу текста: статус в индексе, чтобы
+        # диапазон по тексту не читал выполненные задачи
+        cursor.execute("DROP INDEX IF EXISTS idx_tasks_text")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tasks_status_text
+            ON tasks (user_id, status, text)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_news_subscriptions_feed
+            ON news_subscriptions (feed, user_id)
+        ''')
+        
+        if shard.index == 0:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS shard_directory (
+                    user_id INTEGER PRIMARY KEY,
+                    shard INTEGER NOT NULL
+                )
+            ''')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    due_date TEXT,
-                    priority INTEGER DEFAULT 2,
-                    status TEXT DEFAULT 'active',
-                    created_at TEXT NOT NULL
+                CREATE TABLE IF NOT EXISTS shard_layout (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    shard_count INTEGER NOT NULL
                 )
             ''')
+            # Отпечатки статей, уже появлявшихся в ленте
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS news_seen (
+                    feed TEXT NOT NULL,
+                    fingerprint INTEGER NOT NULL,
+                    first_seen INTEGER NOT NULL,
+                    last_seen INTEGER NOT NULL,
+                    PRIMARY KEY (feed, fingerprint)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_news_seen_age
+                ON news_seen (last_seen)
+            ''')
+            self._init_shared_lists(cursor)
+    
+    def _init_shared_lists(self, cursor):
+        """Общие списки видны пользователям из разных шардов, поэтому живут в шарде 0"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shared_lists (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner_id INTEGER NOT NULL,
+                invite_code TEXT NOT NULL UNIQUE,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS list_members (
+                list_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                name TEXT,
+                username TEXT,
+                joined_at TEXT NOT NULL,
+                PRIMARY KEY (list_id, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS list_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                list_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT DEFAULT 'active',
+                created_by INTEGER NOT NULL,
+                assignee_id INTEGER,
+                created_at TEXT NOT NULL,
+                completed_at TEXT
+            )
+        ''')
+        # Списки пользователя, поиск по @username внутри списка, задачи списка
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_list_members_user
+            ON list_members (user_id, list_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_list_members_username
+            ON list_members (list_id, username COLLATE NOCASE)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_list_tasks_list
+            ON list_tasks (list_id, status)
+        ''')
+    
+    def _init_stats(self, cursor):
+        """Агрегаты для /stats: по дням (в поясе пользователя) и активные по приоритетам.
+        
+        Обновляются в тех же транзакциях, что и задачи. При первом создании
+        заполняются из существующих задач (время выполнения старых задач
+        неизвестно, поэтому в истории учитывается только их создание).
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_stats_daily'")
+        backfill = cursor.fetchone() is None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_stats_daily (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                created INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                completed_on_time INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_backlog (
+                user_id INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                active INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, priority)
+            ) WITHOUT ROWID
+        ''')
+        
+        if backfill:
+            cursor.execute('''
+                INSERT INTO task_stats_daily (user_id, day, created)
+                SELECT user_id, substr(created_at, 1, 10), COUNT(*) FROM tasks
+                GROUP BY user_id, substr(created_at, 1, 10)
+            ''')
+            cursor.execute('''
+                INSERT INTO task_backlog (user_id, priority, active)
+                SELECT user_id, priority, COUNT(*) FROM tasks
+                WHERE status = 'active'
+                GROUP BY user_id, priority
+            ''')
+            logger.info("Статистика задач заполнена по существующим задачам")
+    
+    def _init_digest_slots(self, cursor):
+        """Корзина и часовой пояс сводки для каждого пользователя с задачами.
+        
+        По индексу (bucket, timezone) выборка сводки читает только пользователей
+        текущей минуты, а не весь шард. Заполняется при создании по задачам.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'digest_slots'")
+        backfill = cursor.fetchone() is None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS digest_slots (
+                user_id INTEGER PRIMARY KEY,
+                timezone TEXT NOT NULL,
+                bucket INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_digest_slots_bucket
+            ON digest_slots (bucket, timezone)
+        ''')
+        
+        if backfill:
+            cursor.execute('''
+                INSERT INTO digest_slots (user_id, timezone, bucket)
+                SELECT t.user_id, COALESCE(s.timezone, ?), ABS(t.user_id) % ?
+                FROM (SELECT DISTINCT user_id FROM tasks) t
+                LEFT JOIN user_settings s ON s.user_id = t.user_id
+            ''', (DEFAULT_TIMEZONE, DIGEST_BUCKETS))
+    
+    @staticmethod
+    def _touch_digest_slot(cursor, user_id, tz_name):
+        cursor.execute('''
+            INSERT OR IGNORE INTO digest_slots (user_id, timezone, bucket) VALUES (?, ?, ?)
+        ''', (user_id, tz_name, digest_bucket(user_id)))
+    
+    @staticmethod
+    def _bump_stats(cursor, user_id, day, created=0, completed=0, on_time=0):
+        cursor.execute('''
+            INSERT INTO task_stats_daily (user_id, day, created, completed, completed_on_time)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, day) DO UPDATE SET
+                created = created + excluded.created,
+                completed = completed + excluded.completed,
+                completed_on_time = completed_on_time + excluded.completed_on_time
+        ''', (user_id, day, created, completed, on_time))
+    
+    @staticmethod
+    def _bump_backlog(cursor, user_id, priority, delta):
+        cursor.execute('''
+            INSERT INTO task_backlog (user_id, priority, active) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, priority) DO UPDATE SET active = MAX(active + excluded.active, 0)
+        ''', (user_id, priority, delta))
+    
+    def _record_completion(self, cursor, user_id, priority, due_date, tz_name):
+        """Учет выполнения задачи в агрегатах (внутри транзакции вызывающего)"""
+        now = time.time()
+        on_time = 1 if due_date is None or now <= due_date else 0
+        self._bump_stats(cursor, user_id, to_local(now, tz_name).date().isoformat(), completed=1, on_time=on_time)
+        self._bump_backlog(cursor, user_id, priority, -1)
+    
+    def get_stats(self, user_id, days):
+        """Агрегаты за последние days дней и активные задачи по приоритетам"""
+        tz_name = self.get_user_timezone(user_id)
+        since = (to_local(time.time(), tz_name).date() - timedelta(days=days - 1)).isoformat()
+        try:
+            with self._user_session(user_id) as conn:
+                daily = conn.execute('''
+                    SELECT day, created, completed, completed_on_time FROM task_stats_daily
+                    WHERE user_id = ? AND day >= ?
+                    ORDER BY day
+                ''', (user_id, since)).fetchall()
+                backlog = dict(conn.execute(
+                    "SELECT priority, active FROM task_backlog WHERE user_id = ?", (user_id,)
+                ))
+            return daily, backlog
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики пользователя {user_id}: {e}")
+            return [], {}
+    
+    def _migrate_columns(self, cursor):
+        """Добавление колонок, появившихся после создания таблицы"""
+        cursor.execute("PRAGMA table_info(tasks)")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, definition in TASK_MIGRATIONS:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+                logger.info(f"В таблицу tasks добавлена колонка {column}")
+    
+    def _migrate_due_dates(self, cursor):
+        """Перевод сроков из ISO-строк (локальное время сервера) в UTC epoch"""
+        cursor.execute("PRAGMA table_info(tasks)")
+        if {row[1]: row[2] for row in cursor.fetchall()}['due_date'].upper() == 'INTEGER':
+            return
+        
+        cursor.execute("SELECT id, due_date FROM tasks WHERE due_date IS NOT NULL")
+        rows = cursor.fetchall()
+        
+        # Колонке нужен тип INTEGER, иначе SQLite сохранит числа как текст
+        cursor.execute("DROP INDEX IF EXISTS idx_tasks_deadline")
+        cursor.execute("ALTER TABLE tasks RENAME COLUMN due_date TO due_date_text")
+        cursor.execute("ALTER TABLE tasks ADD COLUMN due_date INTEGER")
+        cursor.executemany(
+            "UPDATE tasks SET due_date = ? WHERE id = ?",
+            [(int(datetime.fromisoformat(due_date).timestamp()), task_id) for task_id, due_date in rows]
+        )
+        cursor.execute("ALTER TABLE tasks DROP COLUMN due_date_text")
+        logger.info(f"Сроки {len(rows)} задач переведены в UTC epoch")
+    
+    def _shard_for(self, user_id):
+        """Шард, в котором хранятся данные пользователя"""
+        index = self._directory.get(user_id)
+        if index is None:
+            index = user_shard_index(user_id, self.layout)
+        return self.shards[index]
+    
+    def _expected_index(self, user_id):
+        """Шард пользователя по новой раскладке (shard_count) с учетом справочника"""
+        return self._directory.get(user_id, user_shard_index(user_id, self.shard_count))
+    
+    def _note_stray(self, user_id, shard):
+        """Учет пользователя для последнего прохода перебалансировки (вызывается под блокировкой shard)"""
+        if self._strays is not None and shard.index != self._expected_index(user_id):
+            self._strays.add(user_id)
+    
+    @contextmanager
+    def _user_session(self, user_id):
+        """Сессия шарда пользователя.
+        
+        Шард перепроверяется под блокировкой: пока обработчик ее ждал,
+        перебалансировка могла перенести пользователя или сменить раскладку -
+        тогда берется блокировка нового шарда.
+        """
+        while True:
+            shard = self._shard_for(user_id)
+            with shard.session() as conn:
+                if self._shard_for(user_id) is not shard:
+                    continue
+                self._note_stray(user_id, shard)
+                yield conn
+                return
+    
+    def _apply_by_shard(self, items, apply, user_of=lambda item: item):
+        """Вызов apply(conn, элементы шарда) для пачки items, разложенной по шардам пользователей.
+        
+        Как и в _user_session, шард перепроверяется под блокировкой; элементы
+        перенесенных за это время пользователей обрабатываются в следующем круге.
+        """
+        pending = list(items)
+        while pending:
+            by_shard = {}
+            for item in pending:
+                by_shard.setdefault(self._shard_for(user_of(item)), []).append(item)
+            pending = []
+            for shard, shard_items in by_shard.items():
+                with shard.session() as conn:
+                    current = []
+                    for item in shard_items:
+                        if self._shard_for(user_of(item)) is shard:
+                            self._note_stray(user_of(item), shard)
+                            current.append(item)
+                        else:
+                            pending.append(item)
+                    if current:
+                        apply(conn, current)
+    
+    @contextmanager
+    def _sessions(self, shards):
+        """Доступ к нескольким шардам сразу; блокировки берутся по порядку номеров"""
+        with ExitStack() as stack:
+            yield {
+                shard.index: stack.enter_context(shard.session())
+                for shard in sorted(set(shards), key=lambda shard: shard.index)
+            }
+    
+    def add_task(self, user_id, text, due_date=None, priority=2, recurrence=None):
+        """Добавление новой задачи в базу данных"""
+        try:
+            tz_name = self.get_user_timezone(user_id)
+            day = user_now(tz_name).date().isoformat()
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                created_at = datetime.now().isoformat()
+                
+                cursor.execute('''
+                    INSERT INTO tasks (user_id, text, due_date, priority, created_at, recurrence)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, text, due_date, priority, created_at, recurrence))
+                
+                task_id = cursor.lastrowid
+                self._bump_stats(cursor, user_id, day, created=1)
+                self._bump_backlog(cursor, user_id, priority, 1)
+                self._touch_digest_slot(cursor, user_id, tz_name)
+                
+                conn.commit()
+            logger.info(f"Задача #{task_id} создана для пользователя {user_id}")
+            return task_id
+        except Exception as e:
+            logger.error(f"Ошибка добавления задачи: {e}")
+            return None
+    
+    def get_user_tasks(self, user_id, status='active', with_version=False):
+        """Получение задач пользователя с сортировкой по приоритету и дате"""
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f'''
+                    SELECT {VERSIONED_TASK_COLUMNS if with_version else TASK_COLUMNS} FROM tasks 
+                    WHERE user_id = ? AND status = ?
+                    ORDER BY priority DESC, due_date ASC
+                ''', (user_id, status))
+                
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения задач: {e}")
+            return []
+    
+    def search_tasks(self, user_id, prefixes, limit):
+        """Активные задачи, текст которых начинается с одного из prefixes.
+        
+        Каждый префикс - диапазон по индексу (user_id, status, text), так что
+        читается не больше limit строк на префикс. Результат отсортирован по тексту.
+        """
+        try:
+            rows = []
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                for prefix in prefixes:
+                    cursor.execute(f'''
+                        SELECT {TASK_COLUMNS} FROM tasks
+                        WHERE user_id = ? AND status = 'active' AND text >= ? AND text < ?
+                        ORDER BY text
+                        LIMIT ?
+                    ''', (user_id, prefix, prefix + '\U0010ffff', limit))
+                    rows.extend(cursor.fetchall())
+            rows.sort(key=lambda task: (task[2], task[0]))
+            return rows[:limit]
+        except Exception as e:
+            logger.error(f"Ошибка поиска задач: {e}")
+            return []
+    
+    def get_task(self, task_id, user_id, with_version=False):
+        """Получение конкретной задачи по ID (with_version - с версией для update_task)"""
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f'''
+                    SELECT {VERSIONED_TASK_COLUMNS if with_version else TASK_COLUMNS}
+                    FROM tasks WHERE id = ? AND user_id = ?
+                ''', (task_id, user_id))
+                
+                return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка получения задачи #{task_id}: {e}")
+            return None
+    
+    def update_task(self, task_id, user_id, expected_version=None, **kwargs):
+        """Обновление задачи с проверкой версии (compare-and-set).
+        
+        Меняются только колонки из UPDATABLE_TASK_COLUMNS, каждая правка
+        увеличивает version. Если передан expected_version, а задачу уже
+        изменили с другого устройства, правка не применяется. Возвращает
+        обновленную строку (VERSIONED_TASK_COLUMNS) или None, если задача не
+        найдена или версия устарела. Недопустимые колонки - ошибка в коде
+        вызывающего, поэтому поднимают ValueError, а не возвращают None.
+        
+        Правка текста, срока или повторения - один UPDATE ... RETURNING.
+        RETURNING в SQLite отдает только новые значения, поэтому при смене
+        статуса или приоритета старые значения для агрегатов /stats читаются
+        отдельным SELECT в той же транзакции.
+        """
+        if not kwargs:
+            return None
+        unknown = set(kwargs) - UPDATABLE_TASK_COLUMNS
+        if unknown:
+            raise ValueError(f"недопустимые колонки: {', '.join(sorted(unknown))}")
+        
+        try:
+            if 'due_date' in kwargs and 'notified' not in kwargs:
+                # Новый срок - новое напоминание, эскалация начинается заново
+                kwargs['notified'] = 0
+                kwargs['nudge_at'] = None
+                kwargs['escalation'] = 0
             
-            conn.commit()
-            conn.close()
-            logger.info("База данных инициализирована успешно")
+            tz_name = self.get_user_timezone(user_id)
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                old = None
+                if 'status' in kwargs or 'priority' in kwargs:
+                    cursor.execute(
+                        "SELECT status, priority, due_date, version FROM tasks WHERE id = ? AND user_id = ?",
+                        (task_id, user_id)
+                    )
+                    old = cursor.fetchone()
+                    if old is None:
+                        return None
+                    if expected_version is None:
+                        # Агрегаты посчитаны по прочитанной строке - она и должна обновиться
+                        expected_version = old[3]
+                
+                set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
+                values = list(kwargs.values()) + [task_id, user_id]
+                version_clause = ""
+                if expected_version is not None:
+                    version_clause = " AND version = ?"
+                    values.append(expected_version)
+                
+                cursor.execute(f'''
+                    UPDATE tasks SET {set_clause}, version = version + 1
+                    WHERE id = ? AND user_id = ?{version_clause}
+                    RETURNING {VERSIONED_TASK_COLUMNS}
+                ''', values)
+                
+                row = cursor.fetchone()
+                if row and old:
+                    self._record_update(cursor, user_id, old[:3], kwargs, tz_name)
+                conn.commit()
+            
+            if row:
+                logger.info(f"Задача #{task_id} обновлена (версия {row[-1]})")
+            elif expected_version is not None:
+                logger.warning(f"Задача #{task_id} не обновлена: ее нет или версия уже не {expected_version}")
+            return row
         except Exception as e:
-            logger.error(f"Ошибка инициализации БД: {e}")
+            logger.error(f"Ошибка обновления задачи #{task_id}: {e}")
+            return None
+    
+    def snooze_task(self, task_id, user_id, delay, attempts=3):
+        """Перенос срока активной задачи на delay секунд.
+        
+        Просроченная задача откладывается от текущего момента, будущая - от
+        своего срока. Новый срок считается по прочитанной версии и пишется
+        через compare-and-set; если задачу успели изменить, попытка
+        повторяется с новой версией. Возвращает новый срок или None.
+        """
+        for _ in range(attempts):
+            task = self.get_task(task_id, user_id, with_version=True)
+            if not task or task[5] != 'active':
+                return None
+            due_date = max(task[3] or 0, int(time.time())) + delay
+            if self.update_task(task_id, user_id, expected_version=task[7], due_date=due_date):
+                return due_date
+        return None
+    
+    def _record_update(self, cursor, user_id, old, changes, tz_name):
+        """Учет изменения статуса и приоритета задачи в агрегатах"""
+        old_status, old_priority, due_date = old
+        status = changes.get('status', old_status)
+        priority = changes.get('priority', old_priority)
+        
+        if old_status == 'active' and status == 'completed':
+            self._record_completion(cursor, user_id, old_priority, due_date, tz_name)
+        elif old_status == 'active' and status != 'active':
+            self._bump_backlog(cursor, user_id, old_priority, -1)
+        elif old_status != 'active' and status == 'active':
+            self._bump_backlog(cursor, user_id, priority, 1)
+        elif status == 'active' and priority != old_priority:
+            self._bump_backlog(cursor, user_id, old_priority, -1)
+            self._bump_backlog(cursor, user_id, priority, 1)
+    
+    def complete_task(self, task_id, user_id):
+        """Отметка задачи выполненной.
+        
+        Для повторяющейся задачи в той же транзакции создается следующее
+        вхождение. Возвращает (успех, срок следующего вхождения).
+        """
+        try:
+            tz_name = self.get_user_timezone(user_id)
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT text, due_date, priority, recurrence FROM tasks
+                    WHERE id = ? AND user_id = ? AND status = 'active'
+                ''', (task_id, user_id))
+                row = cursor.fetchone()
+                if not row:
+                    return False, None
+                
+                text, due_date, priority, recurrence = row
+                cursor.execute('''
+                    UPDATE tasks SET status = 'completed', version = version + 1
+                    WHERE id = ? AND user_id = ?
+                ''', (task_id, user_id))
+                self._record_completion(cursor, user_id, priority, due_date, tz_name)
+                
+                next_due = None
+                if recurrence:
+                    next_due = next_occurrence(recurrence, due_date, tz_name)
+                    if next_due:
+                        cursor.execute('''
+                            INSERT INTO tasks (user_id, text, due_date, priority, created_at, recurrence)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', (user_id, text, next_due, priority, datetime.now().isoformat(), recurrence))
+                        # Следующее повторение - та же задача, в "создано" не считается
+                        self._bump_backlog(cursor, user_id, priority, 1)
+                
+                conn.commit()
+            logger.info(f"Задача #{task_id} выполнена")
+            return True, next_due
+        except Exception as e:
+            logger.error(f"Ошибка завершения задачи #{task_id}: {e}")
+            return False, None
+    
+    def get_due_tasks(self, now, limit=100):
+        """Задачи с наступившим сроком, о которых еще не напоминали (по всем шардам)"""
+        try:
+            per_shard = []
+            for shard in self.shards:
+                with shard.session() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute('''
+                        SELECT id, user_id, text, due_date FROM tasks
+                        WHERE status = 'active' AND notified = 0
+                          AND due_date IS NOT NULL AND due_date <= ?
+                        ORDER BY due_date ASC
+                        LIMIT ?
+                    ''', (now, limit))
+                    
+                    per_shard.append(cursor.fetchall())
+            return list(islice(heapq.merge(*per_shard, key=lambda task: task[3]), limit))
+        except Exception as e:
+            logger.error(f"Ошибка получения задач с наступившим сроком: {e}")
+            return []
+    
+    def get_next_deadline(self):
+        """Ближайший срок напоминания или повторного напоминания о просрочке"""
+        try:
+            deadlines = []
+            for shard in self.shards:
+                with shard.session() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute('''
+                        SELECT MIN(due_date) FROM tasks
+                        WHERE status = 'active' AND notified = 0 AND due_date IS NOT NULL
+                    ''')
+                    deadlines.append(cursor.fetchone()[0])
+                    
+                    cursor.execute('''
+                        SELECT MIN(nudge_at) FROM tasks
+                        WHERE status = 'active' AND nudge_at IS NOT NULL
+                    ''')
+                    deadlines.append(cursor.fetchone()[0])
+            return min((deadline for deadline in deadlines if deadline is not None), default=None)
+        except Exception as e:
+            logger.error(f"Ошибка получения ближайшего срока: {e}")
+            return None
+    
+    def mark_notified(self, tasks, nudge_at=None):
+        """Пометка задач как уведомленных; tasks - пары (task_id, user_id).
+        
+        nudge_at - время первого повторного напоминания, если задачу так и не
+        выполнят (None - без эскалации).
+        """
+        def apply(conn, shard_tasks):
+            cursor = conn.cursor()
+            
+            cursor.executemany(
+                "UPDATE tasks SET notified = 1, escalation = 0, nudge_at = ? WHERE id = ? AND user_id = ?",
+                shard_tasks
+            )
+            
+            conn.commit()
+        
+        try:
+            self._apply_by_shard(
+                [(nudge_at, task_id, user_id) for task_id, user_id in tasks], apply, user_of=lambda row: row[2]
+            )
+        except Exception as e:
+            logger.error(f"Ошибка пометки уведомленных задач: {e}")
+    
+    def get_overdue_tasks(self, now, limit=100):
+        """Просроченные задачи, которым пора повторно напомнить (по всем шардам).
+        
+        Возвращает (id, user_id, text, due_date, priority, escalation, nudge_at)
+        в порядке nudge_at, не больше limit строк.
+        """
+        try:
+            per_shard = []
+            for shard in self.shards:
+                with shard.session() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute('''
+                        SELECT id, user_id, text, due_date, priority, escalation, nudge_at FROM tasks
+                        WHERE status = 'active' AND nudge_at <= ?
+                        ORDER BY nudge_at ASC
+                        LIMIT ?
+                    ''', (now, limit))
+                    
+                    per_shard.append(cursor.fetchall())
+            return list(islice(heapq.merge(*per_shard, key=lambda task: task[6]), limit))
+        except Exception as e:
+            logger.error(f"Ошибка получения просроченных задач: {e}")
+            return []
+    
+    def escalate_tasks(self, tasks, now, intervals, max_priority=3):
+        """Эскалация просроченных задач после повторного напоминания.
+        
+        tasks - пары (task_id, user_id). Приоритет поднимается на ступень (не
+        выше max_priority), следующее напоминание назначается через
+        intervals[escalation]; когда интервалы закончились, напоминания
+        прекращаются. Задачи, которые успели выполнить или перенести, не
+        трогаются.
+        """
+        def apply(conn, shard_tasks):
+            cursor = conn.cursor()
+            
+            for task_id, user_id in shard_tasks:
+                cursor.execute('''
+                    SELECT priority, escalation FROM tasks
+                    WHERE id = ? AND user_id = ? AND status = 'active' AND nudge_at <= ?
+                ''', (task_id, user_id, now))
+                row = cursor.fetchone()
+                if row is None:
+                    continue
+                
+                priority, escalation = row
+                escalation += 1
+                nudge_at = now + intervals[escalation] if escalation < len(intervals) else None
+                new_priority = min(priority + 1, max(priority, max_priority))
+                cursor.execute('''
+                    UPDATE tasks SET priority = ?, escalation = ?, nudge_at = ?, version = version + 1
+                    WHERE id = ? AND user_id = ?
+                ''', (new_priority, escalation, nudge_at, task_id, user_id))
+                if new_priority != priority:
+                    self._bump_backlog(cursor, user_id, priority, -1)
+                    self._bump_backlog(cursor, user_id, new_priority, 1)
+            
+            conn.commit()
+        
+        try:
+            self._apply_by_shard(tasks, apply, user_of=lambda task: task[1])
+        except Exception as e:
+            logger.error(f"Ошибка эскалации просроченных задач: {e}")
+    
+    def get_digest_rows(self, timezones, bucket, horizon):
+        """Задачи для ежедневной сводки одним запросом на шард БД.
+        
+        Возвращает по строке на пользователя корзины bucket: (user_id,
+        часовой пояс, JSON-массив задач [id, text, due_date, priority]).
+        В выборку попадают задачи со сроком раньше horizon и задачи
+        с высоким приоритетом. Пользователи корзины ищутся по индексу
+        digest_slots, их задачи - по idx_tasks_user (CROSS JOIN закрепляет
+        этот порядок обхода).
+        """
+        rows = []
+        placeholders = ", ".join("?" for _ in timezones)
+        for shard in self.shards:
+            try:
+                with shard.session() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute(f'''
+                        SELECT d.user_id, d.timezone,
+                               json_group_array(json_array(t.id, t.text, t.due_date, t.priority))
+                        FROM digest_slots d
+                        CROSS JOIN tasks t ON t.user_id = d.user_id AND t.status = 'active'
+                        WHERE d.bucket = ?
+                          AND d.timezone IN ({placeholders})
+                          AND ((t.due_date IS NOT NULL AND t.due_date < ?) OR t.priority = 3)
+                        GROUP BY d.user_id
+                    ''', (bucket, *timezones, horizon))
+                    
+                    rows.extend(cursor.fetchall())
+            except Exception as e:
+                logger.error(f"Ошибка выборки задач для сводки в шарде {shard.index}: {e}")
+        return rows
+    
+    def get_known_timezones(self):
+        """Все часовые пояса, выбранные пользователями, плюс пояс по умолчанию"""
+        timezones = {DEFAULT_TIMEZONE}
+        for shard in self.shards:
+            try:
+                with shard.session() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT DISTINCT timezone FROM user_settings")
+                    timezones.update(row[0] for row in cursor.fetchall())
+            except Exception as e:
+                logger.error(f"Ошибка получения списка часовых поясов: {e}")
+        return timezones
+    
+    def user_db_path(self, user_id):
+        """Путь к файлу шарда пользователя (для чтения из другого процесса)"""
+        return self._shard_for(user_id).db_path
+    
+    def iter_user_tasks(self, user_id, chunk_size=EXPORT_CHUNK_SIZE):
+        """Потоковое чтение всех задач пользователя порциями по chunk_size"""
+        return read_user_tasks(self.user_db_path(user_id), user_id, chunk_size)
+    
+    def import_tasks(self, user_id, records, batch_size=IMPORT_BATCH_SIZE):
+        """Пакетная вставка задач; каждая пачка - отдельная транзакция.
+        
+        records - итератор кортежей (text, due_date, priority, status,
+        created_at, recurrence, notified). Возвращает число вставленных задач.
+        """
+        imported = 0
+        try:
+            batch = []
+            for record in records:
+                batch.append((user_id, *record))
+                if len(batch) >= batch_size:
+                    imported += self._insert_import_batch(batch)
+                    batch = []
+            if batch:
+                imported += self._insert_import_batch(batch)
+            
+            logger.info(f"Импортировано {imported} задач для пользователя {user_id}")
+        except Exception as e:
+            logger.error(f"Ошибка импорта задач: {e}")
+        return imported
+    
+    def _insert_import_batch(self, batch):
+        created = Counter(row[5][:10] for row in batch)
+        active = Counter(row[3] for row in batch if row[4] == 'active')
+        tz_name = self.get_user_timezone(batch[0][0])
+        with self._user_session(batch[0][0]) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO tasks (user_id, text, due_date, priority, status, created_at, recurrence, notified)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            user_id = batch[0][0]
+            for day, count in created.items():
+                self._bump_stats(cursor, user_id, day, created=count)
+            for priority, count in active.items():
+                self._bump_backlog(cursor, user_id, priority, count)
+            self._touch_digest_slot(cursor, user_id, tz_name)
+            conn.commit()
+        return len(batch)
+    
+    def get_user_timezone(self, user_id):
+        """Часовой пояс пользователя (с ограниченным кэшем в памяти)"""
+        tz_name = self._timezones.get(user_id)
+        if tz_name is not None:
+            self._timezones.move_to_end(user_id)
+            return tz_name
+        
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT timezone FROM user_settings WHERE user_id = ?
+                ''', (user_id,))
+                
+                row = cursor.fetchone()
+            tz_name = row[0] if row else DEFAULT_TIMEZONE
+        except Exception as e:
+            logger.error(f"Ошибка получения часового пояса пользователя {user_id}: {e}")
+            return DEFAULT_TIMEZONE
+        
+        self._remember_timezone(user_id, tz_name)
+        return tz_name
+    
+    def set_user_timezone(self, user_id, tz_name):
+        """Сохранение часового пояса пользователя"""
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO user_settings (user_id, timezone) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET timezone = excluded.timezone
+                ''', (user_id, tz_name))
+                cursor.execute('''
+                    INSERT INTO digest_slots (user_id, timezone, bucket) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET timezone = excluded.timezone
+                ''', (user_id, tz_name, digest_bucket(user_id)))
+                
+                conn.commit()
+            self._remember_timezone(user_id, tz_name)
+            logger.info(f"Пользователь {user_id} установил часовой пояс {tz_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения часового пояса: {e}")
+            return False
+    
+    def _remember_timezone(self, user_id, tz_name):
+        self._timezones[user_id] = tz_name
+        self._timezones.move_to_end(user_id)
+        if len(self._timezones) > self.timezone_cache_size:
+            self._timezones.popitem(last=False)
+    
+    def delete_task(self, task_id, user_id):
+        """Удаление задачи"""
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    DELETE FROM tasks WHERE id = ? AND user_id = ?
+                    RETURNING status, priority
+                ''', (task_id, user_id))
+                
+                deleted = cursor.fetchone()
+                success = deleted is not None
+                if success and deleted[0] == 'active':
+                    self._bump_backlog(cursor, user_id, deleted[1], -1)
+                conn.commit()
+            
+            if success:
+                logger.info(f"Задача #{task_id} удалена")
+            return success
+        except Exception as e:
+            logger.error(f"Ошибка удаления задачи #{task_id}: {e}")
+            return False
+    
+    def create_shared_list(self, owner_id, owner_name, owner_username, name):
+        """Создание общего списка; возвращает (id списка, код приглашения)"""
+        try:
+            invite_code = secrets.token_hex(4)
+            now = datetime.now().isoformat()
+            with self.shards[0].session() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO shared_lists (name, owner_id, invite_code, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (name, owner_id, invite_code, now))
+                list_id = cursor.lastrowid
+                cursor.execute('''
+                    INSERT INTO list_members (list_id, user_id, name, username, joined_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (list_id, owner_id, owner_name, owner_username, now))
+                conn.commit()
+            logger.info(f"Пользователь {owner_id} создал общий список #{list_id}")
+            return list_id, invite_code
+        except Exception as e:
+            logger.error(f"Ошибка создания общего списка: {e}")
+            return None, None
+    
+    def join_shared_list(self, user_id, name, username, invite_code):
+        """Вступление в список по коду; возвращает (id, название) или None"""
+        try:
+            with self.shards[0].session() as conn:
+                row = conn.execute(
+                    "SELECT id, name FROM shared_lists WHERE invite_code = ?", (invite_code,)
+                ).fetchone()
+                if not row:
+                    return None
+                conn.execute('''
+                    INSERT INTO list_members (list_id, user_id, name, username, joined_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(list_id, user_id) DO UPDATE SET name = excluded.name, username = excluded.username
+                ''', (row[0], user_id, name, username, datetime.now().isoformat()))
+                conn.commit()
+            return row
+        except Exception as e:
+            logger.error(f"Ошибка вступления в общий список: {e}")
+            return None
+    
+    def leave_shared_list(self, user_id, list_id):
+        """Выход из списка; список без участников удаляется вместе с задачами"""
+        try:
+            with self.shards[0].session() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "DELETE FROM list_members WHERE list_id = ? AND user_id = ?", (list_id, user_id)
+                )
+                if cursor.rowcount == 0:
+                    return False
+                cursor.execute(
+                    "UPDATE list_tasks SET assignee_id = NULL WHERE list_id = ? AND assignee_id = ?",
+                    (list_id, user_id)
+                )
+                if not cursor.execute("SELECT 1 FROM list_members WHERE list_id = ? LIMIT 1", (list_id,)).fetchone():
+                    cursor.execute("DELETE FROM list_tasks WHERE list_id = ?", (list_id,))
+                    cursor.execute("DELETE FROM shared_lists WHERE id = ?", (list_id,))
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка выхода из общего списка #{list_id}: {e}")
+            return False
+    
+    def get_user_lists(self, user_id):
+        """Списки пользователя: (id, название, код, участников, активных задач)"""
+        try:
+            with self.shards[0].session() as conn:
+                return conn.execute('''
+                    SELECT l.id, l.name, l.invite_code,
+                           (SELECT COUNT(*) FROM list_members m2 WHERE m2.list_id = l.id),
+                           (SELECT COUNT(*) FROM list_tasks t WHERE t.list_id = l.id AND t.status = 'active')
+                    FROM list_members m
+                    JOIN shared_lists l ON l.id = m.list_id
+                    WHERE m.user_id = ?
+                    ORDER BY l.id
+                ''', (user_id,)).fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения общих списков: {e}")
+            return []
+    
+    def get_list_tasks(self, list_id, user_id):
+        """Активные задачи списка (id, текст, имя исполнителя); None - пользователь не участник"""
+        try:
+            with self.shards[0].session() as conn:
+                row = conn.execute('''
+                    SELECT l.name FROM list_members m JOIN shared_lists l ON l.id = m.list_id
+                    WHERE m.list_id = ? AND m.user_id = ?
+                ''', (list_id, user_id)).fetchone()
+                if not row:
+                    return None
+                tasks = conn.execute('''
+                    SELECT t.id, t.text, a.name
+                    FROM list_tasks t
+                    LEFT JOIN list_members a ON a.list_id = t.list_id AND a.user_id = t.assignee_id
+                    WHERE t.list_id = ? AND t.status = 'active'
+                    ORDER BY t.id
+                ''', (list_id,)).fetchall()
+            return row[0], tasks
+        except Exception as e:
+            logger.error(f"Ошибка получения задач списка #{list_id}: {e}")
+            return None
+    
+    def add_list_task(self, list_id, user_id, text):
+        """Добавление задачи в общий список (только участником)"""
+        try:
+            with self.shards[0].session() as conn:
+                cursor = conn.execute('''
+                    INSERT INTO list_tasks (list_id, text, created_by, created_at)
+                    SELECT ?, ?, ?, ?
+                    WHERE EXISTS (SELECT 1 FROM list_members WHERE list_id = ? AND user_id = ?)
+                ''', (list_id, text, user_id, datetime.now().isoformat(), list_id, user_id))
+                conn.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+        except Exception as e:
+            logger.error(f"Ошибка добавления задачи в список #{list_id}: {e}")
+            return None
+    
+    def assign_list_task(self, task_id, user_id, assignee_username=None):
+        """Назначение задачи списка участнику (по умолчанию - себе).
+        
+        Возвращает (id списка, текст задачи, имя исполнителя) или None.
+        """
+        try:
+            with self.shards[0].session() as conn:
+                task = conn.execute('''
+                    SELECT t.list_id, t.text FROM list_tasks t
+                    JOIN list_members me ON me.list_id = t.list_id AND me.user_id = ?
+                    WHERE t.id = ? AND t.status = 'active'
+                ''', (user_id, task_id)).fetchone()
+                if not task:
+                    return None
+                if assignee_username:
+                    assignee = conn.execute('''
+                        SELECT user_id, name FROM list_members
+                        WHERE list_id = ? AND username = ? COLLATE NOCASE
+                    ''', (task[0], assignee_username)).fetchone()
+                else:
+                    assignee = conn.execute(
+                        "SELECT user_id, name FROM list_members WHERE list_id = ? AND user_id = ?",
+                        (task[0], user_id)
+                    ).fetchone()
+                if not assignee:
+                    return None
+                conn.execute("UPDATE list_tasks SET assignee_id = ? WHERE id = ?", (assignee[0], task_id))
+                conn.commit()
+            return task[0], task[1], assignee[1]
+        except Exception as e:
+            logger.error(f"Ошибка назначения задачи списка #{task_id}: {e}")
+            return None
+    
+    def complete_list_task(self, task_id, user_id):
+        """Выполнение задачи общего списка; возвращает (id списка, текст) или None"""
+        try:
+            with self.shards[0].session() as conn:
+                row = conn.execute('''
+                    UPDATE list_tasks SET status = 'completed', completed_at = ?
+                    WHERE id = ? AND status = 'active'
+                      AND list_id IN (SELECT list_id FROM list_members WHERE user_id = ?)
+                    RETURNING list_id, text
+                ''', (datetime.now().isoformat(), task_id, user_id)).fetchone()
+                conn.commit()
+            return row
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задачи списка #{task_id}: {e}")
+            return None
+    
+    def get_list_members(self, list_ids):
+        """Названия и участники нескольких списков одним запросом: {id: (название, [user_id])}"""
+        members = {}
+        if not list_ids:
+            return members
+        placeholders = ", ".join("?" for _ in list_ids)
+        try:
+            with self.shards[0].session() as conn:
+                rows = conn.execute(f'''
+                    SELECT m.list_id, l.name, m.user_id
+                    FROM list_members m JOIN shared_lists l ON l.id = m.list_id
+                    WHERE m.list_id IN ({placeholders})
+                ''', list(list_ids)).fetchall()
+            for list_id, name, user_id in rows:
+                members.setdefault(list_id, (name, []))[1].append(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения участников списков: {e}")
+        return members
+    
+    def get_chat_board(self, chat_id):
+        """id закрепленного сообщения доски чата или None"""
+        try:
+            with self._user_session(chat_id) as conn:
+                row = conn.execute(
+                    "SELECT message_id FROM chat_boards WHERE chat_id = ?", (chat_id,)
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения доски чата {chat_id}: {e}")
+            return None
+    
+    def delete_chat_board(self, chat_id):
+        """Отказ чата от доски"""
+        try:
+            with self._user_session(chat_id) as conn:
+                conn.execute("DELETE FROM chat_boards WHERE chat_id = ?", (chat_id,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка удаления доски чата {chat_id}: {e}")
+    
+    def set_chat_board(self, chat_id, message_id):
+        """Сохранение сообщения доски чата"""
+        try:
+            with self._user_session(chat_id) as conn:
+                conn.execute('''
+                    INSERT INTO chat_boards (chat_id, message_id) VALUES (?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET message_id = excluded.message_id
+                ''', (chat_id, message_id))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения доски чата {chat_id}: {e}")
+    
+    def subscribe_news(self, user_id, feed):
+        """Подписка пользователя на ленту новостей"""
+        try:
+            with self._user_session(user_id) as conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO news_subscriptions (user_id, feed, created_at)
+                    VALUES (?, ?, ?)
+                ''', (user_id, feed, datetime.now().isoformat()))
+                conn.commit()
+            logger.info(f"Пользователь {user_id} подписался на ленту {feed}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка подписки на ленту {feed}: {e}")
+            return False
+    
+    def unsubscribe_news(self, user_id, feed):
+        """Отписка пользователя от ленты новостей"""
+        try:
+            with self._user_session(user_id) as conn:
+                cursor = conn.execute(
+                    "DELETE FROM news_subscriptions WHERE user_id = ? AND feed = ?", (user_id, feed)
+                )
+                conn.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка отписки от ленты {feed}: {e}")
+            return False
+    
+    def get_news_subscriptions(self, user_id):
+        """Ленты, на которые подписан пользователь"""
+        try:
+            with self._user_session(user_id) as conn:
+                rows = conn.execute(
+                    "SELECT feed FROM news_subscriptions WHERE user_id = ? ORDER BY created_at", (user_id,)
+                ).fetchall()
+            return [row[0] for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка получения подписок пользователя {user_id}: {e}")
+            return []
+    
+    def get_subscribed_feeds(self):
+        """Все ленты, у которых есть хотя бы один подписчик"""
+        feeds = set()
+        for shard in self.shards:
+            try:
+                with shard.session() as conn:
+                    feeds.update(row[0] for row in conn.execute(
+                        "SELECT DISTINCT feed FROM news_subscriptions"
+                    ))
+            except Exception as e:
+                logger.error(f"Ошибка получения лент в шарде {shard.index}: {e}")
+        return feeds
+    
+    def iter_feed_subscribers(self, feed, chunk_size=EXPORT_CHUNK_SIZE):
+        """Подписчики ленты пачками; блокировка шарда держится только на время чтения пачки"""
+        for shard in self.shards:
+            last_user_id = -2 ** 63
+            while True:
+                with shard.session() as conn:
+                    rows = conn.execute('''
+                        SELECT user_id FROM news_subscriptions
+                        WHERE feed = ? AND user_id > ?
+                        ORDER BY user_id
+                        LIMIT ?
+                    ''', (feed, last_user_id, chunk_size)).fetchall()
+                if not rows:
+                    break
+                last_user_id = rows[-1][0]
+                yield [row[0] for row in rows]
+    
+    def record_feed_articles(self, feed, fingerprints, stamp):
+        """Учет статей ленты в индексе отпечатков.
+        
+        fingerprints - по кортежу отпечатков на статью. Статья считается уже
+        виденной, если совпал любой из ее отпечатков. Возвращает для каждой
+        статьи момент ее первого появления (для новых - stamp).
+        """
+        known_prints = {fingerprint for prints in fingerprints for fingerprint in prints}
+        placeholders = ", ".join("?" for _ in known_prints)
+        with self.shards[0].session() as conn:
+            known = dict(conn.execute(f'''
+                SELECT fingerprint, first_seen FROM news_seen
+                WHERE feed = ? AND fingerprint IN ({placeholders})
+            ''', (feed, *known_prints)))
+            
+            first_seen = []
+            new_rows = []
+            for prints in fingerprints:
+                seen = min((known[fingerprint] for fingerprint in prints if fingerprint in known), default=stamp)
+                first_seen.append(seen)
+                for fingerprint in prints:
+                    if fingerprint not in known:
+                        known[fingerprint] = seen
+                        new_rows.append((feed, fingerprint, seen, stamp))
+            
+            conn.execute(f'''
+                UPDATE news_seen SET last_seen = ?
+                WHERE feed = ? AND fingerprint IN ({placeholders})
+            ''', (stamp, feed, *known_prints))
+            conn.executemany('''
+                INSERT OR IGNORE INTO news_seen (feed, fingerprint, first_seen, last_seen)
+                VALUES (?, ?, ?, ?)
+            ''', new_rows)
+            conn.commit()
+        return first_seen
+    
+    def get_news_watermark(self, user_id, feed):
+        """До какого момента пользователь видел ленту (None - не открывал)"""
+        try:
+            with self._user_session(user_id) as conn:
+                row = conn.execute(
+                    "SELECT seen_until FROM news_watermarks WHERE user_id = ? AND feed = ?", (user_id, feed)
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка чтения отметки ленты {feed}: {e}")
+            return None
+    
+    def get_news_watermarks(self, feed, user_ids):
+        """Отметки ленты для пачки пользователей: один запрос на шард"""
+        watermarks = {}
+        
+        def apply(conn, shard_users):
+            placeholders = ", ".join("?" for _ in shard_users)
+            watermarks.update(conn.execute(f'''
+                SELECT user_id, seen_until FROM news_watermarks
+                WHERE feed = ? AND user_id IN ({placeholders})
+            ''', (feed, *shard_users)))
+        
+        self._apply_by_shard(user_ids, apply)
+        return watermarks
+    
+    def set_news_watermarks(self, feed, user_ids, stamp):
+        """Отметка, что пользователи видели ленту до момента stamp"""
+        def apply(conn, rows):
+            conn.executemany('''
+                INSERT INTO news_watermarks (user_id, feed, seen_until) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, feed) DO UPDATE SET seen_until = excluded.seen_until
+            ''', rows)
+            conn.commit()
+        
+        try:
+            self._apply_by_shard([(user_id, feed, stamp) for user_id in user_ids], apply, user_of=lambda row: row[0])
+        except Exception as e:
+            logger.error(f"Ошибка сохранения отметок ленты {feed}: {e}")
+    
+    def evict_news_index(self, before):
+        """Удаление отпечатков и отметок, не обновлявшихся с момента before"""
+        removed = 0
+        for shard in self.shards:
+            try:
+                with shard.session() as conn:
+                    if shard.index == 0:
+                        removed += conn.execute("DELETE FROM news_seen WHERE last_seen < ?", (before,)).rowcount
+                    removed += conn.execute("DELETE FROM news_watermarks WHERE seen_until < ?", (before,)).rowcount
+                    conn.commit()
+            except Exception as e:
+                logger.error(f"Ошибка очистки индекса новостей в шарде {shard.index}: {e}")
+        if removed:
+            logger.info(f"Из индекса новостей удалено устаревших записей: {removed}")
+        return removed
+    
+    def move_user(self, user_id, target_index):
+        """Перенос задач и всех строк USER_TABLES пользователя в другой шард.
+        
+        Возвращает число перенесенных задач.
+        """
+        target = self.shards[target_index]
+        while True:
+            source = self._shard_for(user_id)
+            if source is target:
+                return 0
+            with self._sessions([source, target, self.shards[0]]) as conns:
+                # Пока ждали блокировки, пользователя могла перенести перебалансировка
+                if self._shard_for(user_id) is source:
+                    return self._move_user(conns, user_id, source, target)
+    
+    def _move_user(self, conns, user_id, source, target):
+        """Перенос пользователя при уже взятых блокировках шардов conns.
+        
+        Данные сливаются с тем, что уже есть в целевом шарде: строки там не
+        удаляются и не заменяются, потому что они не старше исходных, а
+        счетчики /stats (USER_TABLE_MERGES) складываются. Задача,
+        уже скопированная прерванным переносом (тот же created_at и текст), не
+        дублируется. Затем обновляется справочник и только потом данные
+        удаляются из исходного шарда. Номера задач назначаются заново.
+        """
+        source_conn, target_conn = conns[source.index], conns[target.index]
+        
+        tasks = source_conn.execute('''
+            SELECT user_id, text, due_date, priority, status, created_at, recurrence, notified,
+                   escalation, nudge_at
+            FROM tasks WHERE user_id = ? ORDER BY id
+        ''', (user_id,)).fetchall()
+        user_rows = {
+            table: source_conn.execute(f"SELECT * FROM {table} WHERE {column} = ?", (user_id,)).fetchall()
+            for table, column in USER_TABLES
+        }
+        
+        target_conn.executemany('''
+            INSERT INTO tasks (user_id, text, due_date, priority, status, created_at, recurrence, notified,
+                               escalation, nudge_at)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM tasks WHERE user_id = ? AND text = ? AND created_at = ?)
+        ''', [task + (task[0], task[1], task[5]) for task in tasks])
+        for table, rows in user_rows.items():
+            if rows:
+                placeholders = ", ".join("?" for _ in rows[0])
+                if table in USER_TABLE_MERGES:
+                    target_conn.executemany(
+                        f"INSERT INTO {table} VALUES ({placeholders}) {USER_TABLE_MERGES[table]}", rows
+                    )
+                else:
+                    target_conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES ({placeholders})", rows)
+        target_conn.commit()
+        
+        directory_conn = conns[0]
+        if target.index == user_shard_index(user_id, self.layout):
+            directory_conn.execute("DELETE FROM shard_directory WHERE user_id = ?", (user_id,))
+            self._directory.pop(user_id, None)
+        else:
+            directory_conn.execute(
+                "INSERT OR REPLACE INTO shard_directory (user_id, shard) VALUES (?, ?)",
+                (user_id, target.index)
+            )
+            self._directory[user_id] = target.index
+        directory_conn.commit()
+        
+        source_conn.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
+        for table, column in USER_TABLES:
+            source_conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (user_id,))
+        source_conn.commit()
+        
+        logger.info(f"Пользователь {user_id} перенесен в шард {target.index} ({len(tasks)} задач)")
+        return len(tasks)
+    
+    def _misplaced_users(self, shard, conn):
+        """Пользователи с данными в shard и шард, где они должны лежать"""
+        user_ids = [row[0] for row in conn.execute(
+            "SELECT user_id FROM tasks" + "".join(
+                f" UNION SELECT {column} FROM {table}" for table, column in USER_TABLES
+            )
+        )]
+        for user_id in user_ids:
+            expected = self._expected_index(user_id)
+            if expected != shard.index:
+                yield user_id, expected
+    
+    def rebalance(self, stop=None):
+        """Перенос всех пользователей, лежащих не в своем шарде.
+        
+        Нужен после изменения DB_SHARDS: пользователи переезжают в шард по
+        хэшу, кроме закрепленных в справочнике через move_user. Пока идет
+        перенос, запросы идут по старой раскладке и справочнику. Последний
+        проход выполняется под блокировками всех шардов и только после него
+        включается новая раскладка; в нем переносятся лишь пользователи, которые
+        писали не в свой шард во время переноса (_strays), так что цикл
+        событий ждет блокировки недолго. Если выставлен stop, перенос
+        прерывается и продолжится при следующем запуске.
+        """
+        self._strays = set()
+        try:
+            return self._rebalance(stop)
+        finally:
+            self._strays = None
+    
+    def _rebalance(self, stop):
+        moved = 0
+        for shard in list(self.shards):
+            with shard.session() as conn:
+                misplaced = list(self._misplaced_users(shard, conn))
+            for user_id, expected in misplaced:
+                if stop is not None and stop.is_set():
+                    logger.info(f"Перебалансировка прервана, перенесено пользователей: {moved}")
+                    return moved
+                # Источник - шард, где лежат данные, а не тот, куда сейчас ведет
+                # маршрутизация: так сливаются и данные, разошедшиеся по двум шардам
+                target = self.shards[expected]
+                with self._sessions([shard, target, self.shards[0]]) as conns:
+                    self._move_user(conns, user_id, shard, target)
+                moved += 1
+        
+        with self._sessions(self.shards) as conns:
+            started = time.perf_counter()
+            strays = 0
+            for user_id in self._strays:
+                source, target = self._shard_for(user_id), self.shards[self._expected_index(user_id)]
+                if source is not target:
+                    self._move_user(conns, user_id, source, target)
+                    strays += 1
+            self._switch_layout(conns[0])
+            surplus = self.shards[self.shard_count:]
+            self.shards = self.shards[:self.shard_count]
+            self.last_final_pass = time.perf_counter() - started
+        moved += strays
+        logger.info(f"Последний проход перебалансировки: {strays} пользователей за {self.last_final_pass * 1000:.1f} мс")
+        
+        for shard in surplus:
+            with shard.session() as conn:
+                conn.close()
+        logger.info(f"Перебалансировка завершена, перенесено пользователей: {moved}")
+        return moved
+    
+    def _switch_layout(self, directory_conn):
+        """Переход на раскладку по shard_count; записи справочника, совпавшие с хэшем, удаляются"""
+        directory_conn.execute("UPDATE shard_layout SET shard_count = ?", (self.shard_count,))
+        self.layout = self.shard_count
+        for user_id, index in list(self._directory.items()):
+            if index == user_shard_index(user_id, self.layout):
+                directory_conn.execute("DELETE FROM shard_directory WHERE user_id = ?", (user_id,))
+                del self._directory[user_id]
+        directory_conn.commit()
+    
+    def shard_stats(self):
+        """Число пользователей и задач в каждом шарде"""
+        stats = []
+        for shard in self.shards:
+            with shard.session() as conn:
+                users, tasks = conn.execute(
+                    "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM tasks"
+                ).fetchone()
+            stats.append((shard.index, shard.db_path, users, tasks))
+        return stats
+
+# Глобальный экземпляр менеджера задач. БД открывается не при импорте, а в
+# main() после проверки BOT_TOKEN - параллельно со сборкой Application.
+task_manager = TaskManager(shard_count=DB_SHARDS, lazy=True)
+
+class ShardRebalancer:
+    """Перенос пользователей в фоновом потоке после изменения DB_SHARDS"""
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self._stop = threading.Event()
+        self._task = None
+    
+    def start(self, application):
+        """Запуск перебалансировки, если раскладка данных не совпадает с DB_SHARDS"""
+        if self.manager.layout == self.manager.shard_count:
+            return
+        self._stop.clear()
+        self._task = asyncio.create_task(asyncio.to_thread(self.manager.rebalance, self._stop))
+        logger.info(f"Перебалансировка шардов запущена: {self.manager.layout} -> {self.manager.shard_count}")
+    
+    async def stop(self):
+        """Прерывание перебалансировки (продолжится при следующем запуске)"""
+        if self._task:
+            self._stop.set()
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Ошибка перебалансировки шардов: {e}")
+            self._task = None
+
+shard_rebalancer = ShardRebalancer(task_manager)
+
+# ПЛАНИРОВЩИК ДЕДЛАЙНОВ
+# Если задачу не выполнили после напоминания, о ней напоминают снова через
+# интервалы из ESCALATION_INTERVALS (от срока напоминания), каждый раз поднимая
+# приоритет. Когда интервалы закончились, напоминания прекращаются.
+ESCALATION_INTERVALS = (3600, 3 * 3600, 12 * 3600, 24 * 3600, 3 * 24 * 3600)
+
+def format_overdue(seconds):
+    """Насколько просрочена задача: "3 ч", "2 дн" """
+    if seconds < 3600:
+        return f"{max(seconds // 60, 1)} мин"
+    if seconds < 24 * 3600:
+        return f"{seconds // 3600} ч"
+    return f"{seconds // (24 * 3600)} дн"
+
+class DeadlineScheduler:
+    """Единый планировщик сроков задач.
+    
+    Спит до ближайшего срока или повторного напоминания (индексированные
+    MIN-запросы) и за тик обрабатывает не более batch_size задач: сначала
+    наступившие сроки, затем эскалацию просроченных.
+    """
+    
+    def __init__(self, manager, batch_size=100, max_sleep=300):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self._wakeup = None
+        self._task = None
+    
+    def start(self, application):
+        """Запуск цикла планировщика"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(application.bot))
+        logger.info("Планировщик дедлайнов запущен")
+    
+    async def stop(self):
+        """Остановка цикла планировщика"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def wake(self):
+        """Пересчитать время пробуждения (например, после добавления задачи)"""
+        if self._wakeup:
+            self._wakeup.set()
+    
+    async def _run(self, bot):
+        while True:
+            try:
+                processed = await self.tick(bot)
+                delay = 0 if processed >= self.batch_size else await self._seconds_until_next()
+            except Exception as e:
+                logger.error(f"Ошибка планировщика дедлайнов: {e}")
+                delay = self.max_sleep
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _seconds_until_next(self):
+        deadline = await asyncio.to_thread(self.manager.get_next_deadline)
+        if deadline is None:
+            return self.max_sleep
+        delay = deadline - time.time()
+        return min(max(delay, 0), self.max_sleep)
+    
+    async def tick(self, bot):
+        """Обработка одной пачки задач с наступившим сроком и просроченных.
+        
+        Запросы к шардам идут в потоке, чтобы не останавливать цикл событий.
+        """
+        now = int(time.time())
+        due_tasks = await asyncio.to_thread(self.manager.get_due_tasks, now, self.batch_size)
+        for task_id, user_id, text, due_date in due_tasks:
+            try:
+                await bot.send_message(
+                    user_id, f"⏰ Наступил срок задачи #{task_id}: {text}",
+                    reply_markup=get_snooze_keyboard(task_id)
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось отправить напоминание о задаче #{task_id}: {e}")
+        if due_tasks:
+            await asyncio.to_thread(
+                self.manager.mark_notified,
+                [(task[0], task[1]) for task in due_tasks], nudge_at=now + ESCALATION_INTERVALS[0]
+            )
+        
+        budget = self.batch_size - len(due_tasks)
+        overdue_tasks = await asyncio.to_thread(self.manager.get_overdue_tasks, now, budget) if budget > 0 else []
+        for task_id, user_id, text, due_date, priority, escalation, nudge_at in overdue_tasks:
+            message = f"⚠️ Задача #{task_id} просрочена на {format_overdue(now - (due_date or now))}: {text}"
+            if priority < 3:
+                priority_text = {3: "🔴 Высокий", 2: "🟡 Средний", 1: "🔵 Низкий"}[priority + 1]
+                message += f"\n🎯 Приоритет повышен: {priority_text}"
+            try:
+                await bot.send_message(user_id, message, reply_markup=get_snooze_keyboard(task_id))
+            except Exception as e:
+                logger.warning(f"Не удалось отправить повторное напоминание о задаче #{task_id}: {e}")
+        if overdue_tasks:
+            await asyncio.to_thread(
+                self.manager.escalate_tasks, [(task[0], task[1]) for task in overdue_tasks], now, ESCALATION_INTERVALS
+            )
+            for owner_id in {task[1] for task in overdue_tasks}:
+                board_updater.touch(owner_id)
+        return len(due_tasks) + len(overdue_tasks)
+
+deadline_scheduler = DeadlineScheduler(task_manager)
+# Заполняется в post_init: после init_database в task_manager.shards есть и
+# лишние шарды, оставшиеся от прежней раскладки
+snapshot_managers = []
+
+# ЕЖЕДНЕВНАЯ СВОДКА
+# Сводка приходит в DIGEST_HOUR по местному времени пользователя. Пользователи
+# разбиты на DIGEST_BUCKETS минутных корзин по user_id, чтобы 100k сводок
+# растянулись на час и не упирались в лимиты Telegram (~30 сообщений/с).
+# Сводки корзины равномерно распределяются по DIGEST_SEND_WINDOW секундам,
+# чтобы рассылка успевала до следующей минуты.
+DIGEST_HOUR = int(os.getenv('DIGEST_HOUR', '9'))
+DIGEST_BUCKETS = 60
+DIGEST_RATE_PER_SECOND = 25
+DIGEST_MAX_RATE_PER_SECOND = 30
+DIGEST_SEND_WINDOW = 58
+DIGEST_TIMEZONES_TTL = 600
+
+# Сводки, ленты и уведомления общих списков делят один темп отправки, чтобы
+# вместе не превышать лимит Telegram на бота
+BULK_SEND_RATE = DIGEST_MAX_RATE_PER_SECOND
+
+class SendPacer:
+    """Общий темп массовых рассылок: слоты отправки выдаются по очереди всем рассыльщикам"""
+    
+    def __init__(self, rate=BULK_SEND_RATE):
+        self.interval = 1 / rate
+        self._next = 0.0
+    
+    async def wait(self):
+        """Ожидание своего слота отправки"""
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+bulk_send_pacer = SendPacer()
+
+def digest_bucket(user_id):
+    """Минутная корзина сводки пользователя"""
+    return abs(user_id) % DIGEST_BUCKETS
+
+def digest_send_interval(count):
+    """Пауза между сводками, чтобы count сообщений уложились в DIGEST_SEND_WINDOW"""
+    if not count:
+        return 0
+    return max(min(1 / DIGEST_RATE_PER_SECOND, DIGEST_SEND_WINDOW / count), 1 / DIGEST_MAX_RATE_PER_SECOND)
+
+def build_digest_text(tasks, tz_name, now):
+    """Текст сводки: просроченные, на сегодня и с высоким приоритетом"""
+    today = to_local(now, tz_name).date()
+    overdue, due_today, high_priority = [], [], []
+    
+    for task_id, text, due_date, priority in sorted(tasks, key=lambda task: (task[2] is None, task[2] or 0)):
+        if due_date is not None and due_date < now:
+            overdue.append((task_id, text, due_date))
+        elif due_date is not None and to_local(due_date, tz_name).date() == today:
+            due_today.append((task_id, text, due_date))
+        elif priority == 3:
+            high_priority.append((task_id, text, due_date))
+    
+    if not (overdue or due_today or high_priority):
+        return None
+    
+    response = "🗞 Ежедневная сводка\n\n"
+    for title, section in (
+        ("⏰ Просрочено", overdue),
+        ("📅 На сегодня", due_today),
+        ("🔴 Высокий приоритет", high_priority),
+    ):
+        if not section:
+            continue
+        response += f"{title}:\n"
+        for task_id, text, due_date in section:
+            if due_date is not None:
+                response += f"  #{task_id} - {text} (до {format_due_date(due_date, tz_name)})\n"
+            else:
+                response += f"  #{task_id} - {text}\n"
+        response += "\n"
+    return response
+
+class DigestScheduler:
+    """Рассылка ежедневных сводок по минутным корзинам пользователей"""
+    
+    def __init__(self, manager, pacer=bulk_send_pacer):
+        self.manager = manager
+        self.pacer = pacer
+        self._task = None
+        self._last_minute = None
+        self._timezones = None
+        self._timezones_loaded = 0
+    
+    def start(self, application):
+        """Запуск цикла рассылки"""
+        self._last_minute = int(time.time()) // 60
+        self._task = asyncio.create_task(self._run(application.bot))
+        logger.info("Планировщик ежедневных сводок запущен")
+    
+    async def stop(self):
+        """Остановка цикла рассылки"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(60 - time.time() % 60)
+            current_minute = int(time.time()) // 60
+            # Если рассылка заняла больше минуты, догоняем пропущенные корзины
+            for minute in range(self._last_minute + 1, current_minute + 1):
+                try:
+                    await self.send_bucket(bot, minute * 60)
+                except Exception as e:
+                    logger.error(f"Ошибка рассылки сводок: {e}")
+            self._last_minute = current_minute
+    
+    async def _timezones_by_bucket(self, moment):
+        """Часовые пояса, в которых сейчас DIGEST_HOUR, сгруппированные по корзине"""
+        if self._timezones is None or time.time() - self._timezones_loaded > DIGEST_TIMEZONES_TTL:
+            self._timezones = await asyncio.to_thread(self.manager.get_known_timezones)
+            self._timezones_loaded = time.time()
+        
+        buckets = {}
+        for tz_name in self._timezones:
+            local = to_local(moment, tz_name)
+            if local.hour == DIGEST_HOUR:
+                buckets.setdefault(local.minute % DIGEST_BUCKETS, []).append(tz_name)
+        return buckets
+    
+    async def send_bucket(self, bot, moment):
+        """Отправка сводок корзине пользователей, для которых наступило время"""
+        horizon = moment + 2 * 24 * 3600
+        messages = []
+        for bucket, timezones in (await self._timezones_by_bucket(moment)).items():
+            # Выборка идет в потоке, чтобы не задерживать цикл событий
+            rows = await asyncio.to_thread(self.manager.get_digest_rows, timezones, bucket, horizon)
+            for user_id, tz_name, tasks_json in rows:
+                text = build_digest_text(json.loads(tasks_json), tz_name, moment)
+                if text:
+                    messages.append((user_id, text))
+        
+        interval = digest_send_interval(len(messages))
+        if len(messages) * interval > DIGEST_SEND_WINDOW:
+            logger.warning(f"Сводки корзины ({len(messages)}) не укладываются в минуту при лимите Telegram")
+        
+        sent = 0
+        started = time.monotonic()
+        for position, (user_id, text) in enumerate(messages):
+            # Паузы отсчитываются от начала, чтобы время отправки не накапливалось
+            delay = started + position * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.pacer.wait()
+            try:
+                await bot.send_message(user_id, text)
+                sent += 1
+            except Exception as e:
+                logger.warning(f"Не удалось отправить сводку пользователю {user_id}: {e}")
+        if sent:
+            logger.info(f"Отправлено ежедневных сводок: {sent}")
+        return sent
+
+digest_scheduler = DigestScheduler(task_manager)
+
+# ПУЛ ПРОЦЕССОВ ДЛЯ ТЯЖЕЛЫХ ЗАДАЧ
+# Отрисовка больших списков, форматирование новостей и экспорт выполняются
+# в отдельных процессах, чтобы не задерживать цикл событий для остальных.
+# WORKER_PROCESSES=0 - все выполняется в основном процессе, как раньше.
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0'))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '32'))
+WORKER_USER_JOBS = 2
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '30'))
+# Маленькие списки быстрее отрисовать на месте, чем передавать в процесс
+WORKER_INLINE_ITEMS = 200
+
+BUSY_TEXT = "⏳ Бот сейчас перегружен, попробуйте через минуту."
+
+class WorkerPoolBusy(Exception):
+    """Очередь пула (общая или пользователя) заполнена"""
+
+class WorkerPool:
+    """Пул процессов с ограниченной очередью и таймаутом на задание"""
+    
+    def __init__(self, processes=WORKER_PROCESSES, queue_size=WORKER_QUEUE_SIZE,
+                 user_jobs=WORKER_USER_JOBS, timeout=WORKER_TIMEOUT):
+        self.processes = processes
+        self.queue_size = queue_size
+        self.user_jobs = user_jobs
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._user_pending = {}
+    
+    def start(self):
+        if self.processes <= 0 or self._executor is not None:
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        # Процессы создаются при первом задании: запускаем их сразу, пока нагрузки нет
+        for _ in range(self.processes):
+            self._executor.submit(abs, 0)
+        logger.info(f"Пул процессов запущен: {self.processes} процессов, очередь {self.queue_size}")
+    
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    async def run(self, func, *args, user_id=None, inline=False, blocking=False):
+        """Выполнение func(*args) в пуле.
+        
+        Если очередь заполнена, сразу поднимает WorkerPoolBusy; если задание
+        не уложилось в таймаут - asyncio.TimeoutError. Место в очереди
+        освобождается только когда процесс действительно закончил работу.
+        Без пула (WORKER_PROCESSES=0) func выполняется прямо в цикле событий,
+        а blocking-задание (чтение БД, запись файла) - в потоке.
+        """
+        if inline:
+            return func(*args)
+        if self._executor is None:
+            return await asyncio.to_thread(func, *args) if blocking else func(*args)
+        
+        if self._pending >= self.queue_size or self._user_pending.get(user_id, 0) >= self.user_jobs:
+            raise WorkerPoolBusy()
+        
+        future = self._executor.submit(func, *args)
+        self._pending += 1
+        self._user_pending[user_id] = self._user_pending.get(user_id, 0) + 1
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(self._release, user_id))
+        
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+    
+    def _release(self, user_id):
+        self._pending -= 1
+        left = self._user_pending.pop(user_id, 1) - 1
+        if left:
+            self._user_pending[user_id] = left
+
+worker_pool = WorkerPool()
+
+# ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ
+# Перед всеми обработчиками стоит проверка: у каждого пользователя свое ведро
+# токенов на класс действий, плюс общее ведро на весь бот. Класс: (емкость,
+# пополнение токенов в секунду).
+RATE_LIMITS = {
+    'news': (3, 1 / 20),
+    'list': (10, 1 / 2),
+    'mutation': (20, 1),
+    'other': (30, 2),
+    # Инлайн-запросы приходят на каждое нажатие клавиши
+    'inline': (30, 5),
+}
+GLOBAL_RATE_LIMIT = (
+    int(os.getenv('GLOBAL_RATE_BURST', '300')),
+    float(os.getenv('GLOBAL_RATE_PER_SECOND', '100')),
+)
+# Состояние пользователя, не писавшего столько секунд, удаляется
+RATE_LIMIT_IDLE = 600
+# Сверх этого числа пользователей вытесняются самые давние, даже если не простаивают
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', '100000'))
+# Предупреждение о превышении отправляется не чаще раза в столько секунд
+THROTTLE_NOTICE_INTERVAL = 10
+THROTTLE_TEXT = "⏳ Слишком много запросов, подождите немного."
+
+NEWS_ACTIONS = {"📰 Бизнес-новости США", "/news", "refresh_news"}
+LIST_ACTIONS = {
+    "📋 Список задач", "✅ Выполненные", "⚙️ Управление задачами",
+    "/list", "/export", "back_to_list", "/lists", "/shared", "/stats",
+}
+OTHER_ACTIONS = {"/start", "/help", "ℹ️ Помощь", "close_news"}
+
+def classify_update(update):
+    """Класс действия для ограничения частоты"""
+    if update.callback_query:
+        action = (update.callback_query.data or "").split(":", 1)[0]
+        if action.startswith("manage_"):
+            return 'list'
+    elif update.inline_query:
+        return 'inline'
+    elif update.message and update.message.text:
+        action = update.message.text
+        if action.startswith("/"):
+            action = action.split(maxsplit=1)[0].split("@", 1)[0]
+    else:
+        return 'mutation'
+    
+    if action in NEWS_ACTIONS:
+        return 'news'
+    if action in LIST_ACTIONS:
+        return 'list'
+    if action in OTHER_ACTIONS:
+        return 'other'
+    return 'mutation'
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+    
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+    
+    def take(self, now):
+        """Списать токен, если он есть"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class UserLimits:
+    __slots__ = ("buckets", "seen", "noticed")
+    
+    def __init__(self, now):
+        self.buckets = {}
+        self.seen = now
+        self.noticed = 0.0
+
+class RateLimiter:
+    """Ведра токенов в памяти: O(1) на запрос, простаивающие пользователи вытесняются"""
+    
+    def __init__(self, limits=RATE_LIMITS, global_limit=GLOBAL_RATE_LIMIT, idle=RATE_LIMIT_IDLE,
+                 max_users=RATE_LIMIT_MAX_USERS):
+        self.limits = limits
+        self.global_bucket = TokenBucket(*global_limit, time.monotonic())
+        self.idle = idle
+        self.max_users = max_users
+        # Порядок - по последнему обращению, самые давние в начале
+        self._users = OrderedDict()
+    
+    def __len__(self):
+        return len(self._users)
+    
+    def allow(self, user_id, action_class, now=None):
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        
+        limits = self._users.get(user_id)
+        if limits is None:
+            if len(self._users) >= self.max_users:
+                self._users.popitem(last=False)
+            limits = self._users[user_id] = UserLimits(now)
+        else:
+            limits.seen = now
+            self._users.move_to_end(user_id)
+        
+        bucket = limits.buckets.get(action_class)
+        if bucket is None:
+            bucket = limits.buckets[action_class] = TokenBucket(*self.limits[action_class], now)
+        
+        if not bucket.take(now):
+            return False
+        if not self.global_bucket.take(now):
+            bucket.tokens += 1
+            return False
+        return True
+    
+    def should_notify(self, user_id, now=None):
+        """Нужно ли отвечать пользователю о превышении (не чаще THROTTLE_NOTICE_INTERVAL)"""
+        now = time.monotonic() if now is None else now
+        limits = self._users.get(user_id)
+        if limits is None or now - limits.noticed < THROTTLE_NOTICE_INTERVAL:
+            return False
+        limits.noticed = now
+        return True
+    
+    def _evict(self, now):
+        while self._users:
+            user_id, limits = next(iter(self._users.items()))
+            if now - limits.seen < self.idle:
+                break
+            del self._users[user_id]
+
+rate_limiter = RateLimiter()
+
+async def rate_limit_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверка частоты перед всеми обработчиками; при превышении обработка прерывается"""
+    user = update.effective_user
+    if user is None:
+        return
+    
+    action_class = classify_update(update)
+    if rate_limiter.allow(user.id, action_class):
+        return
+    
+    logger.warning(f"Пользователь {user.id} превысил лимит запросов ({action_class})")
+    try:
+        if update.callback_query:
+            # Ответ на callback нужен в любом случае, иначе кнопка "зависнет"
+            await update.callback_query.answer(THROTTLE_TEXT)
+        elif update.effective_message and rate_limiter.should_notify(user.id):
+            await update.effective_message.reply_text(THROTTLE_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка ответа о превышении лимита: {e}")
+    raise ApplicationHandlerStop
+
+# ДАННЫЕ ПОЛЬЗОВАТЕЛЕЙ В ПАМЯТИ
+# context.user_data (шаги диалогов) живет в памяти процесса, пока его не удалят.
+# У пользователя, не писавшего USER_DATA_IDLE секунд, он удаляется, чтобы бот,
+# работающий месяцами, не хранил его для всех, кто когда-либо писал.
+USER_DATA_IDLE = int(os.getenv('USER_DATA_IDLE', str(24 * 3600)))
+
+class UserDataJanitor:
+    """Удаление user_data простаивающих пользователей: O(1) на обновление"""
+    
+    def __init__(self, idle=USER_DATA_IDLE):
+        self.idle = idle
+        # Порядок - по последнему обращению, самые давние в начале
+        self._seen = OrderedDict()
+    
+    def __len__(self):
+        return len(self._seen)
+    
+    def touch(self, application, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        self._seen[user_id] = now
+        self._seen.move_to_end(user_id)
+        
+        while self._seen:
+            oldest_id, seen = next(iter(self._seen.items()))
+            if now - seen < self.idle:
+                break
+            del self._seen[oldest_id]
+            application.drop_user_data(oldest_id)
+
+user_data_janitor = UserDataJanitor()
+
+def forget_persistence_marks(application):
+    """Очистка отметок для сохранения данных, если сохранение не настроено.
+    
+    PTB 20.7 после каждого обновления запоминает id чата и пользователя, чтобы
+    сохранить их данные, но очищает эти множества только при сохранении. Без
+    него в них остается каждый, кто когда-либо писал боту.
+    """
+    if application.persistence is None:
+        application._chat_ids_to_be_updated_in_persistence.clear()
+        application._user_ids_to_be_updated_in_persistence.clear()
+        application._chat_ids_to_be_deleted_in_persistence.clear()
+        application._user_ids_to_be_deleted_in_persistence.clear()
+
+async def user_data_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметка активности пользователя перед всеми обработчиками"""
+    forget_persistence_marks(context.application)
+    if update.effective_user is not None:
+        user_data_janitor.touch(context.application, update.effective_user.id)
+
+# ЛЕНТЫ НОВОСТЕЙ
+# Лента - пара "страна:категория" NewsAPI. Каждая лента запрашивается не чаще
+# раза в NEWS_CACHE_TTL секунд, сколько бы пользователей ее ни читали, и
+# рассылается подписчикам раз в NEWS_PUSH_INTERVAL секунд.
+NEWS_COUNTRY_NAMES = {
+    'us': "🇺🇸 США",
+    'gb': "🇬🇧 Великобритания",
+    'de': "🇩🇪 Германия",
+    'fr': "🇫🇷 Франция",
+    'ru': "🇷🇺 Россия",
+    'ca': "🇨🇦 Канада",
+    'jp': "🇯🇵 Япония",
+}
+NEWS_CATEGORY_NAMES = {
+    'business': "Бизнес",
+    'technology': "Технологии",
+    'science': "Наука",
+    'health': "Здоровье",
+    'sports': "Спорт",
+    'entertainment': "Развлечения",
+    'general': "Главное",
+}
+NEWS_COUNTRIES = [
+    country for country in os.getenv('NEWS_COUNTRIES', 'us,gb,de,ru').split(',')
+    if country in NEWS_COUNTRY_NAMES
+]
+NEWS_CATEGORIES = [
+    category for category in os.getenv('NEWS_CATEGORIES', ','.join(NEWS_CATEGORY_NAMES)).split(',')
+    if category in NEWS_CATEGORY_NAMES
+]
+DEFAULT_FEED = "us:business"
+NEWS_CACHE_TTL = int(os.getenv('NEWS_CACHE_TTL', '600'))
+NEWS_PUSH_INTERVAL = int(os.getenv('NEWS_PUSH_INTERVAL', '10800'))
+NEWS_ARTICLES_PER_MESSAGE = 8
+
+def parse_feed(country, category='business'):
+    """Ключ ленты по стране и категории или None, если лента не настроена"""
+    country, category = country.lower(), category.lower()
+    if country in NEWS_COUNTRIES and category in NEWS_CATEGORIES:
+        return f"{country}:{category}"
+    return None
+
+def is_known_feed(feed):
+    return feed == DEFAULT_FEED or (feed.count(":") == 1 and parse_feed(*feed.split(":")) == feed)
+
+def feed_title(feed):
+    """Заголовок ленты: "🇺🇸 США: Бизнес" """
+    country, category = feed.split(":")
+    return f"{NEWS_COUNTRY_NAMES[country]}: {NEWS_CATEGORY_NAMES[category]}"
+
+@lru_cache(maxsize=None)
+def get_news_session():
+    """HTTP-сессия NewsAPI; соединение переиспользуется между запросами.
+    
+    requests загружается только при первом запросе новостей - это заметная
+    часть времени импорта бота.
+    """
+    import requests
+    return requests.Session()
+
+def fetch_news(feed):
+    """Запрос ленты в NewsAPI (блокирующий, вызывается в отдельном потоке)"""
+    import requests
+    country, category = feed.split(":")
+    try:
+        logger.info(f"Запрос ленты {feed} в NewsAPI...")
+        
+        response = get_news_session().get(
+            NEWS_API_URL,
+            params={'country': country, 'category': category, 'apiKey': NEWS_API_KEY},
+            timeout=15
+        )
+        logger.info(f"Статус ответа NewsAPI: {response.status_code}")
+        
+        if response.status_code == 200:
+            data = response.json()
+            logger.info(f"Статус NewsAPI: {data.get('status')}, всего новостей: {data.get('totalResults', 0)}")
+            
+            if data['status'] == 'ok' and data['totalResults'] > 0:
+                articles = data['articles']
+                logger.info(f"Успешно получено {len(articles)} новостей ленты {feed}")
+                return articles
+            else:
+                logger.warning(f"Новости ленты {feed} не найдены")
+                return None
+        else:
+            logger.error(f"Ошибка NewsAPI: {response.status_code}")
+            return None
+            
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Ошибка подключения к NewsAPI: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка при получении новостей: {e}")
+        return None
+
+# Отпечатки статей: нормализованный URL и нормализованный заголовок. Одна и та же
+# новость часто приходит с другими utm-метками или с другим суффиксом источника.
+NEWS_SEEN_TTL = int(os.getenv('NEWS_SEEN_TTL', str(7 * 24 * 3600)))
+_TRACKING_PARAM_RE = re.compile(r"^(utm_|fbclid$|gclid$|ref$|cmpid$)")
+_TITLE_SOURCE_RE = re.compile(r"\s+[-|–—]\s+[^-|–—]+$")
+_TITLE_NOISE_RE = re.compile(r"[\W_]+")
+
+def _fingerprint(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big', signed=True)
+
+def normalize_article_url(url):
+    parts = urlsplit(url.strip())
+    query = "&".join(sorted(
+        param for param in parts.query.split("&")
+        if param and not _TRACKING_PARAM_RE.match(param.split("=", 1)[0].lower())
+    ))
+    return f"{parts.netloc.lower().removeprefix('www.')}{parts.path.rstrip('/')}?{query}"
+
+def normalize_article_title(title):
+    return _TITLE_NOISE_RE.sub(" ", _TITLE_SOURCE_RE.sub("", title.strip())).strip().lower()
+
+def article_fingerprints(article):
+    """Отпечатки статьи: совпадение любого из них означает, что статья уже была"""
+    prints = []
+    if article.get('url'):
+        prints.append(_fingerprint("url:" + normalize_article_url(article['url'])))
+    title = normalize_article_title(article.get('title') or '')
+    if title:
+        prints.append(_fingerprint("title:" + title))
+    return tuple(prints)
+
+class FeedSnapshot:
+    """Загруженная версия ленты; first_seen - момент первого появления каждой статьи"""
+    __slots__ = ("loaded", "stamp", "feed", "articles", "first_seen", "text")
     
-    def add_task(self, user_id, text, due_date=None, priority=2):
-        """Добавление новой задачи в базу данных"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            created_at = datetime.now().isoformat()
-            
-            cursor.execute('''
-                INSERT INTO tasks (user_id, text, due_date, priority, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, text, due_date, priority, created_at))
-            
-            task_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"Задача #{task_id} создана для пользователя {user_id}")
-            return task_id
-        except Exception as e:
-            logger.error(f"Ошибка добавления задачи: {e}")
+    def __init__(self, feed, stamp, articles, first_seen):
+        self.loaded = time.monotonic()
+        self.stamp = stamp
+        self.feed = feed
+        self.articles = articles
+        self.first_seen = first_seen
+        self.text = format_news_text(articles, feed_title(feed))
+    
+    def new_since(self, watermark):
+        """Статьи, появившиеся после отметки пользователя (None - все)"""
+        if watermark is None:
+            return self.articles
+        return [article for article, seen in zip(self.articles, self.first_seen) if seen > watermark]
+    
+    def delta_text(self, watermark):
+        """Текст только с новыми статьями или None, если новых нет"""
+        fresh = self.new_since(watermark)
+        if not fresh:
             return None
+        if len(fresh) == len(self.articles):
+            return self.text
+        return format_news_text(fresh, f"🆕 {feed_title(self.feed)}")
+
+class NewsFeedCache:
+    """Кэш лент: одна загрузка на ленту за TTL, параллельные запросы ждут ее.
     
-    def get_user_tasks(self, user_id, status='active'):
-        """Получение задач пользователя с сортировкой по приоритету и дате"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT * FROM tasks 
-                WHERE user_id = ? AND status = ?
-                ORDER BY priority DESC, due_date ASC
-            ''', (user_id, status))
-            
-            tasks = cursor.fetchall()
-            conn.close()
-            return tasks
-        except Exception as e:
-            logger.error(f"Ошибка получения задач: {e}")
-            return []
+    Каждая загрузка сверяется с индексом отпечатков, чтобы знать, какие статьи
+    новые. Пользователю показываются статьи, появившиеся после его отметки
+    в news_watermarks, поэтому на пользователя хранится одна строка на ленту,
+    а не список увиденных статей.
+    """
     
-    def get_task(self, task_id, user_id):
-        """Получение конкретной задачи по ID"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT * FROM tasks WHERE id = ? AND user_id = ?
-            ''', (task_id, user_id))
-            
-            task = cursor.fetchone()
-            conn.close()
-            return task
-        except Exception as e:
-            logger.error(f"Ошибка получения задачи #{task_id}: {e}")
+    def __init__(self, manager, ttl=NEWS_CACHE_TTL):
+        self.manager = manager
+        self.ttl = ttl
+        # лента -> FeedSnapshot
+        self._entries = {}
+        self._locks = {}
+    
+    async def get(self, feed):
+        """Текущая версия ленты или None, если загрузить не удалось"""
+        snapshot = self._fresh_entry(feed)
+        if snapshot is None:
+            async with self._locks.setdefault(feed, asyncio.Lock()):
+                snapshot = self._fresh_entry(feed)
+                if snapshot is None:
+                    snapshot = await self._load(feed)
+        return snapshot
+    
+    def _fresh_entry(self, feed):
+        snapshot = self._entries.get(feed)
+        if snapshot and time.monotonic() - snapshot.loaded < self.ttl:
+            return snapshot
+        return None
+    
+    async def _load(self, feed):
+        articles = await asyncio.to_thread(fetch_news, feed)
+        stale = self._entries.get(feed)
+        if articles:
+            # Отметки - миллисекунды; строго растут, даже если часы сдвинулись назад
+            stamp = max(int(time.time() * 1000), stale.stamp + 1 if stale else 0)
+            fingerprints = [article_fingerprints(article) for article in articles]
+            articles = [article for article, prints in zip(articles, fingerprints) if prints]
+            first_seen = await asyncio.to_thread(
+                self.manager.record_feed_articles, feed, [prints for prints in fingerprints if prints], stamp
+            )
+            snapshot = FeedSnapshot(feed, stamp, articles, first_seen)
+        elif stale:
+            # NewsAPI недоступен - до следующей попытки отдаем прошлую версию
+            logger.warning(f"Лента {feed} не обновилась, используется кэш")
+            snapshot = stale
+            snapshot.loaded = time.monotonic()
+        else:
             return None
+        self._entries[feed] = snapshot
+        return snapshot
+
+news_cache = NewsFeedCache(task_manager)
+
+class NewsDeliveryScheduler:
+    """Рассылка лент подписчикам: одна загрузка ленты на всех ее подписчиков"""
     
-    def update_task(self, task_id, user_id, **kwargs):
-        """Обновление задачи"""
-        try:
-            if not kwargs:
-                return False
-                
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
-            values = list(kwargs.values()) + [task_id, user_id]
-            
-            cursor.execute(f'''
-                UPDATE tasks SET {set_clause} 
-                WHERE id = ? AND user_id = ?
-            ''', values)
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
-            
-            if success:
-                logger.info(f"Задача #{task_id} обновлена")
-            return success
-        except Exception as e:
-            logger.error(f"Ошибка обновления задачи #{task_id}: {e}")
-            return False
+    def __init__(self, manager, cache, interval=NEWS_PUSH_INTERVAL, pacer=bulk_send_pacer):
+        self.manager = manager
+        self.cache = cache
+        self.interval = interval
+        self.pacer = pacer
+        self._task = None
     
-    def delete_task(self, task_id, user_id):
-        """Удаление задачи"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                DELETE FROM tasks WHERE id = ? AND user_id = ?
-            ''', (task_id, user_id))
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
-            
-            if success:
-                logger.info(f"Задача #{task_id} удалена")
-            return success
-        except Exception as e:
-            logger.error(f"Ошибка удаления задачи #{task_id}: {e}")
-            return False
+    def start(self, application):
+        """Запуск цикла рассылки"""
+        self._task = asyncio.create_task(self._run(application.bot))
+        logger.info("Рассылка лент новостей запущена")
+    
+    async def stop(self):
+        """Остановка цикла рассылки"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            # Запросы к шардам идут в потоке, чтобы не останавливать цикл событий
+            await asyncio.to_thread(self.manager.evict_news_index, int((time.time() - NEWS_SEEN_TTL) * 1000))
+            for feed in await asyncio.to_thread(self.manager.get_subscribed_feeds):
+                if not is_known_feed(feed):
+                    continue
+                try:
+                    await self.deliver(bot, feed)
+                except Exception as e:
+                    logger.error(f"Ошибка рассылки ленты {feed}: {e}")
+    
+    async def deliver(self, bot, feed):
+        """Отправка подписчикам только тех статей, которых они еще не видели"""
+        snapshot = await self.cache.get(feed)
+        if not snapshot:
+            return 0
+        
+        reply_markup = get_news_keyboard(feed, True)
+        sent = 0
+        batches = self.manager.iter_feed_subscribers(feed)
+        while True:
+            user_ids = await asyncio.to_thread(next, batches, None)
+            if user_ids is None:
+                break
+            watermarks = await asyncio.to_thread(self.manager.get_news_watermarks, feed, user_ids)
+            # Наборы новых статей вложены друг в друга, поэтому их число - ключ текста
+            texts = {}
+            delivered = []
+            for user_id in user_ids:
+                watermark = watermarks.get(user_id)
+                fresh_count = len(snapshot.new_since(watermark))
+                if not fresh_count:
+                    continue
+                if fresh_count not in texts:
+                    texts[fresh_count] = snapshot.delta_text(watermark)
+                await self.pacer.wait()
+                try:
+                    await bot.send_message(
+                        user_id, texts[fresh_count],
+                        reply_markup=reply_markup,
+                        parse_mode='Markdown',
+                        disable_web_page_preview=True
+                    )
+                    delivered.append(user_id)
+                    sent += 1
+                except Forbidden:
+                    # Пользователь заблокировал бота
+                    await asyncio.to_thread(self.manager.unsubscribe_news, user_id, feed)
+                except Exception as e:
+                    logger.warning(f"Не удалось отправить ленту {feed} пользователю {user_id}: {e}")
+            await asyncio.to_thread(self.manager.set_news_watermarks, feed, delivered, snapshot.stamp)
+        logger.info(f"Лента {feed}: новые статьи отправлены подписчикам: {sent}")
+        return sent
+
+news_scheduler = NewsDeliveryScheduler(task_manager, news_cache)
+
+# КЭШ КЛАВИАТУР
+class CachedMarkupMixin:
+    """Строит словарь разметки один раз и переиспользует его.
+    
+    PTB сериализует параметры запроса через to_dict() и json.dumps, так что
+    кэшировать достаточно словарь.
+    """
+
+    __slots__ = ()
 
-# Глобальный экземпляр менеджера задач
-task_manager = TaskManager()
+    def to_dict(self, recursive=True):
+        if not recursive:
+            return super().to_dict(recursive)
+        cached = getattr(self, '_cached_dict', None)
+        if cached is None:
+            cached = super().to_dict()
+            self._cached_dict = cached
+        return cached
 
+class CachedInlineKeyboardMarkup(CachedMarkupMixin, InlineKeyboardMarkup):
+    """Инлайн-клавиатура с однократным построением словаря"""
+
+    __slots__ = ("_cached_dict",)
+
+class CachedReplyKeyboardMarkup(CachedMarkupMixin, ReplyKeyboardMarkup):
+    """Клавиатура меню с однократным построением словаря"""
+
+    __slots__ = ("_cached_dict",)
+
+BACK_BUTTON = InlineKeyboardButton("⬅️ Назад", callback_data="back")
+
+@lru_cache(maxsize=None)
 def get_main_menu():
     """Главное меню команд"""
-    return ReplyKeyboardMarkup([
+    return CachedReplyKeyboardMarkup([
         [KeyboardButton("📝 Добавить задачу"), KeyboardButton("📋 Список задач")],
         [KeyboardButton("✅ Выполненные"), KeyboardButton("⚙️ Управление задачами")],
         [KeyboardButton("📰 Бизнес-новости США"), KeyboardButton("ℹ️ Помощь")]
@@ -194,7 +3328,120 @@ def get_main_menu():
 
 def get_back_button():
     """Кнопка Назад для инлайн-клавиатур"""
-    return [InlineKeyboardButton("⬅️ Назад", callback_data="back")]
+    return [BACK_BUTTON]
+
+@lru_cache(maxsize=None)
+def get_back_keyboard():
+    """Клавиатура с единственной кнопкой Назад"""
+    return CachedInlineKeyboardMarkup([get_back_button()])
+
+@lru_cache(maxsize=None)
+def get_due_date_keyboard():
+    """Клавиатура выбора срока выполнения"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("Сегодня", callback_data="today")],
+        [InlineKeyboardButton("Завтра", callback_data="tomorrow")],
+        [InlineKeyboardButton("Через 3 дня", callback_data="3days")],
+        [InlineKeyboardButton("📅 Кастомный формат", callback_data="custom")],
+        [InlineKeyboardButton("🔁 Повторять", callback_data="recurring")],
+        [InlineKeyboardButton("Без срока", callback_data="no_date")],
+        get_back_button()
+    ])
+
+@lru_cache(maxsize=None)
+def get_recurrence_keyboard():
+    """Клавиатура выбора правила повторения"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("Каждый день", callback_data="rec_daily")],
+        [InlineKeyboardButton("По будням", callback_data="rec_weekdays")],
+        [InlineKeyboardButton("Каждую неделю", callback_data="rec_weekly")],
+        [InlineKeyboardButton("Каждый месяц", callback_data="rec_monthly")],
+        get_back_button()
+    ])
+
+@lru_cache(maxsize=None)
+def get_priority_keyboard():
+    """Клавиатура выбора приоритета"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("🔴 Высокий", callback_data="3")],
+        [InlineKeyboardButton("🟡 Средний", callback_data="2")],
+        [InlineKeyboardButton("🔵 Низкий", callback_data="1")],
+        get_back_button()
+    ])
+
+@lru_cache(maxsize=None)
+def get_news_keyboard(feed=DEFAULT_FEED, subscribed=False):
+    """Клавиатура под лентой новостей (кэшируется по ленте и состоянию подписки)"""
+    if subscribed:
+        toggle = InlineKeyboardButton("🔕 Отписаться", callback_data=f"unsub_news:{feed}")
+    else:
+        toggle = InlineKeyboardButton("🔔 Подписаться", callback_data=f"sub_news:{feed}")
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Обновить новости", callback_data=f"refresh_news:{feed}")],
+        [toggle],
+        get_back_button(),
+        [InlineKeyboardButton("❌ Закрыть", callback_data="close_news")]
+    ])
+
+# Отложить задачу: действие -> (сдвиг срока в секундах, подпись)
+SNOOZE_OPTIONS = {
+    "snooze1h": (3600, "+1 час"),
+    "snooze1d": (24 * 3600, "+1 день"),
+}
+
+def _snooze_buttons(task_id):
+    return [
+        InlineKeyboardButton(f"⏰ {label}", callback_data=f"{action}_{task_id}")
+        for action, (_, label) in SNOOZE_OPTIONS.items()
+    ]
+
+@lru_cache(maxsize=1024)
+def get_task_actions_keyboard(task_id):
+    """Клавиатура действий с задачей (кэшируется по ID задачи)"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Выполнить", callback_data=f"complete_{task_id}")],
+        _snooze_buttons(task_id),
+        [InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{task_id}")],
+        get_back_button()
+    ])
+
+@lru_cache(maxsize=1024)
+def get_snooze_keyboard(task_id):
+    """Клавиатура под напоминанием о сроке (кэшируется по ID задачи)"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Выполнить", callback_data=f"complete_{task_id}")],
+        _snooze_buttons(task_id),
+    ])
+
+@lru_cache(maxsize=1024)
+def get_delete_confirmation_keyboard(task_id):
+    """Клавиатура подтверждения удаления (кэшируется по ID задачи)"""
+    return CachedInlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Да", callback_data=f"confirm_delete_{task_id}")],
+        get_back_button(),
+        [InlineKeyboardButton("❌ Нет", callback_data="cancel_delete")]
+    ])
+
+@lru_cache(maxsize=4096)
+def get_task_button(task_id, version, priority, text):
+    """Кнопка задачи в списке управления (кэшируется по ID и версии задачи)"""
+    priority_emoji = {3: "🔴", 2: "🟡", 1: "🔵"}[priority]
+    button_text = f"{priority_emoji} #{task_id}: {text[:20]}..."
+    return InlineKeyboardButton(button_text, callback_data=f"manage_{task_id}")
+
+_MANAGEMENT_FOOTER = (
+    (BACK_BUTTON,),
+    (InlineKeyboardButton("❌ Отмена", callback_data="cancel_manage"),)
+)
+
+def get_task_management_keyboard(tasks):
+    """Клавиатура выбора задачи для управления; tasks - строки VERSIONED_TASK_COLUMNS"""
+    keyboard = []
+    for task in tasks:
+        task_id, _, text, due_date, priority, status, created_at, version = task
+        keyboard.append((get_task_button(task_id, version, priority, text),))
+    keyboard.extend(_MANAGEMENT_FOOTER)
+    return InlineKeyboardMarkup(keyboard)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start с меню"""
@@ -223,7 +3470,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
     try:
-        help_text = """
+        help_text = f"""
 📋 **Как пользоваться ботом:**
 
 *Добавление задачи:*
@@ -236,14 +3483,51 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 - "📋 Список задач" - активные задачи
 - "✅ Выполненные" - выполненные задачи  
 - "⚙️ Управление задачами" - редактирование и удаление
+- /stats - статистика за неделю: создано, выполнено, вовремя
+
+*Напоминания:*
+Когда наступает срок, бот присылает напоминание с кнопками "+1 час" и "+1 день".
+Если задачу не выполнить и не отложить, бот напомнит снова через 1, 3, 12 и 24
+часа и через 3 дня, каждый раз повышая приоритет.
+
+*Поиск задач:*
+В любом чате наберите @имя_бота и начало задачи, чтобы найти и отправить ее.
+
+*Резервная копия:*
+- /export - выгрузить задачи в CSV (/export json - в JSON Lines)
+- /import - загрузить задачи из файла экспорта
+
+*Группы:*
+Добавьте бота в группу: задачи группы общие для всех участников.
+- /board - закрепить доску задач чата (обновляется автоматически)
+- /add текст - быстро добавить задачу, /done ID - выполнить
+
+*Общие списки:*
+- /newlist Название - создать список и получить код приглашения
+- /join КОД - вступить, /lists - ваши списки, /leave ID - выйти
+- /shared ID - задачи списка, /shared ID текст - добавить задачу
+- /take ID [@username] - назначить исполнителя, /sdone ID - выполнить
 
 *Новости:*
 - "📰 Бизнес-новости США" - свежие бизнес-новости из США
+- /news - другие страны и категории, /news de technology - показать ленту
+- /subscribe de technology - получать ленту автоматически, /unsubscribe - отписаться
 
 *Формат даты:*
-Для кастомного ввода используйте формат:
-`ГГГГ-ММ-ДД ЧЧ:ММ`
+Для кастомного ввода можно написать срок словами:
+`завтра в 9`, `через 3 дня`, `в пятницу в 18:00`, `next friday 18:00`
+или использовать формат `ГГГГ-ММ-ДД ЧЧ:ММ`
 Пример: `2024-12-31 23:59`
+Время указывается в вашем часовом поясе: /timezone Europe/Moscow
+
+*Повторяющиеся задачи:*
+Выберите "🔁 Повторять" на шаге срока или введите правило:
+`daily`, `weekly:mon,thu`, `monthly:15`, `cron:0 9 * * 1-5`
+Следующее повторение создается при выполнении задачи.
+
+*Ежедневная сводка:*
+Каждое утро в {DIGEST_HOUR}:00 (по вашему часовому поясу) бот присылает
+просроченные задачи, задачи на сегодня и задачи с высоким приоритетом.
 
 💡 *Совет:* На каждом этапе есть кнопка "⬅️ Назад" для возврата к предыдущему шагу!
 """
@@ -251,6 +3535,41 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Ошибка в команде /help: {e}")
 
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /timezone"""
+    try:
+        user_id = task_owner_id(update)
+        
+        if not context.args:
+            tz_name = task_manager.get_user_timezone(user_id)
+            await update.message.reply_text(
+                f"🌍 Ваш часовой пояс: {tz_name}\n"
+                f"🕒 Сейчас: {user_now(tz_name).strftime('%d.%m.%Y %H:%M')}\n\n"
+                "Чтобы изменить, отправьте, например:\n"
+                "/timezone Europe/Moscow"
+            )
+            return
+        
+        tz_name = context.args[0]
+        try:
+            get_zone(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(
+                "❌ Неизвестный часовой пояс!\n"
+                "Используйте название из базы IANA, например: Europe/Moscow, Asia/Yekaterinburg"
+            )
+            return
+        
+        if task_manager.set_user_timezone(user_id, tz_name):
+            await update.message.reply_text(
+                f"✅ Часовой пояс установлен: {tz_name}\n"
+                f"🕒 Сейчас: {user_now(tz_name).strftime('%d.%m.%Y %H:%M')}"
+            )
+        else:
+            await update.message.reply_text("❌ Не удалось сохранить часовой пояс.")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /timezone: {e}")
+
 async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора из меню"""
     try:
@@ -275,13 +3594,18 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
 # ФУНКЦИИ ДЛЯ НОВОСТЕЙ
 async def show_business_news(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать бизнес-новости США"""
+    await show_news(update, DEFAULT_FEED)
+
+async def show_news(update, feed):
+    """Показать ленту новостей"""
     try:
-        await update.message.reply_text("📡 Загружаю последние бизнес-новости США...")
+        await update.message.reply_text(f"📡 Загружаю новости: {feed_title(feed)}...")
         
-        news_data = await fetch_business_news()
+        snapshot = await news_cache.get(feed)
         
-        if news_data:
-            await send_news_articles(update, news_data)
+        if snapshot:
+            await send_news_articles(update, feed, snapshot.text)
+            task_manager.set_news_watermarks(feed, [update.effective_user.id], snapshot.stamp)
         else:
             await update.message.reply_text(
                 "❌ Не удалось загрузить новости. Попробуйте позже."
@@ -291,75 +3615,70 @@ async def show_business_news(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.error(f"Ошибка загрузки новостей: {e}")
         await update.message.reply_text("❌ Произошла ошибка при загрузке новостей.")
 
-async def fetch_business_news():
-    """Получение бизнес-новостей из США"""
+def describe_feeds(subscriptions):
+    """Справка по доступным лентам и подпискам пользователя"""
+    text = "📰 Ленты новостей\n\n"
+    text += "Страны: " + ", ".join(f"{code} ({NEWS_COUNTRY_NAMES[code]})" for code in NEWS_COUNTRIES) + "\n"
+    text += "Категории: " + ", ".join(f"{code} ({NEWS_CATEGORY_NAMES[code]})" for code in NEWS_CATEGORIES) + "\n\n"
+    text += "Показать ленту: /news us technology\n"
+    text += "Подписаться: /subscribe us technology\n"
+    text += "Отписаться: /unsubscribe us technology\n\n"
+    if subscriptions:
+        text += "🔔 Ваши подписки:\n" + "\n".join(
+            f"  {feed_title(feed)} ({feed.replace(':', ' ')})" for feed in subscriptions if is_known_feed(feed)
+        )
+    else:
+        text += "🔕 Подписок пока нет"
+    return text
+
+def feed_from_args(args):
+    """Лента из аргументов команды: /news us [technology]"""
+    if not args:
+        return None
+    return parse_feed(*args[:2])
+
+async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /news [страна] [категория]"""
     try:
-        logger.info("Запрос бизнес-новостей США...")
+        user_id = update.message.from_user.id
+        if not context.args:
+            await update.message.reply_text(describe_feeds(task_manager.get_news_subscriptions(user_id)))
+            return
         
-        response = requests.get(NEWS_API_URL, timeout=15)
-        logger.info(f"Статус ответа NewsAPI: {response.status_code}")
+        feed = feed_from_args(context.args)
+        if not feed:
+            await update.message.reply_text("❌ Такой ленты нет. Список лент: /news")
+            return
+        await show_news(update, feed)
+    except Exception as e:
+        logger.error(f"Ошибка в команде /news: {e}")
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команд /subscribe и /unsubscribe"""
+    try:
+        user_id = update.message.from_user.id
+        subscribe = update.message.text.startswith("/subscribe")
+        feed = feed_from_args(context.args)
+        if not feed:
+            await update.message.reply_text("❌ Укажите ленту, например: /subscribe us technology\nСписок лент: /news")
+            return
         
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"Статус NewsAPI: {data.get('status')}, всего новостей: {data.get('totalResults', 0)}")
-            
-            if data['status'] == 'ok' and data['totalResults'] > 0:
-                articles = data['articles']
-                logger.info(f"Успешно получено {len(articles)} бизнес-новостей")
-                return articles
-            else:
-                logger.warning("Бизнес-новости не найдены")
-                return None
+        if subscribe:
+            task_manager.subscribe_news(user_id, feed)
+            await update.message.reply_text(f"🔔 Вы подписались на ленту {feed_title(feed)}")
+        elif task_manager.unsubscribe_news(user_id, feed):
+            await update.message.reply_text(f"🔕 Вы отписались от ленты {feed_title(feed)}")
         else:
-            logger.error(f"Ошибка NewsAPI: {response.status_code}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка подключения к NewsAPI: {e}")
-        return None
+            await update.message.reply_text("📭 Вы не подписаны на эту ленту")
     except Exception as e:
-        logger.error(f"Неожиданная ошибка при получении новостей: {e}")
-        return None
+        logger.error(f"Ошибка изменения подписки: {e}")
 
-async def send_news_articles(update, articles):
+async def send_news_articles(update, feed, news_text):
     """Отправка новостей пользователю"""
     try:
-        news_text = "📰 **🇺🇸 Бизнес-новости США**\n\n"
-        
-        for i, article in enumerate(articles[:8], 1):
-            title = article.get('title', 'Без названия').strip()
-            source = article.get('source', {}).get('name', 'Неизвестный источник')
-            url = article.get('url', '#')
-            description = article.get('description', '')
-            published_at = article.get('publishedAt', '')
-            
-            # Форматируем дату
-            if published_at:
-                try:
-                    pub_date = datetime.fromisoformat(published_at.replace('Z', '+00:00'))
-                    date_str = pub_date.strftime("%d.%m.%Y %H:%M")
-                except ValueError:
-                    date_str = published_at[:10]
-            else:
-                date_str = "Дата неизвестна"
-            
-            news_text += f"**{i}. {title}**\n"
-            if description and description != title and len(description) > 10:
-                clean_description = description[:120] + "..." if len(description) > 120 else description
-                news_text += f"_{clean_description}_\n"
-            news_text += f"📰 *{source}* | 🕒 {date_str}\n"
-            news_text += f"🔗 [Читать]({url})\n\n"
-        
         # Добавляем кнопки с возможностью возврата
-        keyboard = [
-            [InlineKeyboardButton("🔄 Обновить новости", callback_data="refresh_news")],
-            get_back_button(),
-            [InlineKeyboardButton("❌ Закрыть", callback_data="close_news")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        if len(news_text) > 4000:
-            news_text = news_text[:4000] + "\n\n... (новости сокращены)"
+        subscribed = feed in task_manager.get_news_subscriptions(update.effective_user.id)
+        reply_markup = get_news_keyboard(feed, subscribed)
         
         await update.message.reply_text(
             news_text,
@@ -372,51 +3691,77 @@ async def send_news_articles(update, articles):
         logger.error(f"Ошибка отправки новостей: {e}")
         await update.message.reply_text("❌ Произошла ошибка при отображении новостей.")
 
+def format_news_text(articles, header):
+    """Текст подборки новостей (Markdown, не длиннее лимита сообщения)"""
+    news_text = f"📰 **{header}**\n\n"
+    
+    for i, article in enumerate(articles[:NEWS_ARTICLES_PER_MESSAGE], 1):
+        title = (article.get('title') or 'Без названия').strip()
+        source = (article.get('source') or {}).get('name') or 'Неизвестный источник'
+        url = article.get('url') or '#'
+        description = article.get('description') or ''
+        published_at = article.get('publishedAt') or ''
+        
+        # Форматируем дату
+        if published_at:
+            try:
+                pub_date = datetime.fromisoformat(published_at.replace('Z', '+00:00'))
+                date_str = pub_date.strftime("%d.%m.%Y %H:%M")
+            except ValueError:
+                date_str = published_at[:10]
+        else:
+            date_str = "Дата неизвестна"
+        
+        news_text += f"**{i}. {title}**\n"
+        if description and description != title and len(description) > 10:
+            clean_description = description[:120] + "..." if len(description) > 120 else description
+            news_text += f"_{clean_description}_\n"
+        news_text += f"📰 *{source}* | 🕒 {date_str}\n"
+        news_text += f"🔗 [Читать]({url})\n\n"
+    
+    if len(news_text) > 4000:
+        news_text = news_text[:4000] + "\n\n... (новости сокращены)"
+    return news_text
+
 async def handle_news_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка действий с новостями"""
     try:
         query = update.callback_query
+        action, _, feed = query.data.partition(":")
+        # Кнопки старых сообщений не содержат ленту
+        feed = feed if feed and is_known_feed(feed) else DEFAULT_FEED
+        user_id = query.from_user.id
+        
+        if action in ("sub_news", "unsub_news"):
+            subscribed = action == "sub_news"
+            if subscribed:
+                task_manager.subscribe_news(user_id, feed)
+                await query.answer(f"🔔 Подписка на ленту {feed_title(feed)} оформлена")
+            else:
+                task_manager.unsubscribe_news(user_id, feed)
+                await query.answer("🔕 Подписка отменена")
+            await query.edit_message_reply_markup(get_news_keyboard(feed, subscribed))
+            return
+        
         await query.answer()
         
-        if query.data == "refresh_news":
+        if action == "refresh_news":
             await query.edit_message_text("📡 Обновляю новости...")
             
-            news_data = await fetch_business_news()
-            if news_data:
-                news_text = "📰 **🇺🇸 Бизнес-новости США**\n\n"
-                
-                for i, article in enumerate(news_data[:8], 1):
-                    title = article.get('title', 'Без названия').strip()
-                    source = article.get('source', {}).get('name', 'Неизвестный источник')
-                    url = article.get('url', '#')
-                    description = article.get('description', '')
-                    published_at = article.get('publishedAt', '')
-                    
-                    if published_at:
-                        try:
-                            pub_date = datetime.fromisoformat(published_at.replace('Z', '+00:00'))
-                            date_str = pub_date.strftime("%d.%m.%Y %H:%M")
-                        except ValueError:
-                            date_str = published_at[:10]
-                    else:
-                        date_str = "Дата неизвестна"
-                    
-                    news_text += f"**{i}. {title}**\n"
-                    if description and description != title and len(description) > 10:
-                        clean_description = description[:120] + "..." if len(description) > 120 else description
-                        news_text += f"_{clean_description}_\n"
-                    news_text += f"📰 *{source}* | 🕒 {date_str}\n"
-                    news_text += f"🔗 [Читать]({url})\n\n"
-                
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Обновить новости", callback_data="refresh_news")],
-                    get_back_button(),
-                    [InlineKeyboardButton("❌ Закрыть", callback_data="close_news")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            snapshot = await news_cache.get(feed)
+            if snapshot:
+                subscribed = feed in task_manager.get_news_subscriptions(user_id)
+                reply_markup = get_news_keyboard(feed, subscribed)
                 
-                if len(news_text) > 4000:
-                    news_text = news_text[:4000] + "\n\n... (новости обновлены)"
+                # Показываются только статьи, которых пользователь еще не видел
+                news_text = snapshot.delta_text(task_manager.get_news_watermark(user_id, feed))
+                task_manager.set_news_watermarks(feed, [user_id], snapshot.stamp)
+                if not news_text:
+                    await query.edit_message_text(
+                        f"🆕 Новых статей в ленте {feed_title(feed)} пока нет. Загляните позже!",
+                        reply_markup=reply_markup
+                    )
+                    return
                 
                 await query.edit_message_text(
                     news_text,
@@ -427,10 +3772,10 @@ async def handle_news_actions(update: Update, context: ContextTypes.DEFAULT_TYPE
             else:
                 await query.edit_message_text("❌ Не удалось обновить новости. Попробуйте позже.")
                 
-        elif query.data == "close_news":
+        elif action == "close_news":
             await query.edit_message_text("📰 Просмотр новостей завершен")
         
-        elif query.data == "back":
+        elif action == "back":
             # Возврат в главное меню
             await query.edit_message_text(
                 "Возврат в главное меню",
@@ -441,16 +3786,181 @@ async def handle_news_actions(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.error(f"Ошибка обработки действий с новостей: {e}")
         await update.callback_query.edit_message_text("❌ Произошла ошибка.")
 
+# ДОСКИ ЗАДАЧ В ГРУППАХ
+# В группе задачи принадлежат чату (user_id задачи = id чата), а их список
+# закреплен одним сообщением. Доска появляется только по команде /board; если
+# ее сообщение удалили, бот перестает ее вести. Правки участников сливаются: доска обновляется
+# через BOARD_DEBOUNCE после первой правки и не чаще раза в BOARD_EDIT_INTERVAL
+# секунд, чтобы не упираться в лимиты Telegram на редактирование.
+GROUP_CHAT_TYPES = ("group", "supergroup")
+BOARD_DEBOUNCE = 1.0
+BOARD_EDIT_INTERVAL = float(os.getenv('BOARD_EDIT_INTERVAL', '3'))
+BOARD_CACHE_SIZE = 10000
+BOARD_TITLE = "📌 Доска задач чата"
+
+def task_owner_id(update):
+    """Владелец задач: в группе - сам чат, в личном чате - пользователь"""
+    chat = update.effective_chat
+    if chat is not None and chat.type in GROUP_CHAT_TYPES:
+        return chat.id
+    return update.effective_user.id
+
+def render_board(tasks, tz_name):
+    """Текст закрепленной доски"""
+    if not tasks:
+        return f"{BOARD_TITLE}:\n\n📭 Активных задач нет.\n➕ /add текст задачи"
+    return format_tasks_list(tasks, BOARD_TITLE, tz_name) + "➕ /add текст задачи, ✅ /done ID"
+
+class BoardUpdater:
+    """Отложенное обновление досок: не больше одной правки сообщения за окно"""
+    
+    def __init__(self, manager, debounce=BOARD_DEBOUNCE, interval=BOARD_EDIT_INTERVAL):
+        self.manager = manager
+        self.debounce = debounce
+        self.interval = interval
+        self._bot = None
+        # chat_id -> задача отложенного обновления
+        self._scheduled = {}
+        # chat_id -> время последней правки, самые давние в начале
+        self._last_edit = OrderedDict()
+        # chat_id -> хэш текста доски (LRU), чтобы не отправлять одинаковые правки
+        self._texts = OrderedDict()
+    
+    def start(self, application):
+        self._bot = application.bot
+    
+    async def stop(self):
+        for task in list(self._scheduled.values()):
+            task.cancel()
+        self._scheduled.clear()
+    
+    def touch(self, owner_id):
+        """Задачи владельца изменились; для личных задач ничего не делает"""
+        if owner_id >= 0 or self._bot is None or owner_id in self._scheduled:
+            return
+        now = time.monotonic()
+        while self._last_edit:
+            chat_id, edited = next(iter(self._last_edit.items()))
+            if now - edited < self.interval:
+                break
+            del self._last_edit[chat_id]
+        
+        last = self._last_edit.get(owner_id)
+        delay = self.debounce if last is None else max(self.debounce, last + self.interval - now)
+        self._scheduled[owner_id] = asyncio.create_task(self._refresh_later(owner_id, delay))
+    
+    async def _refresh_later(self, chat_id, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._scheduled.pop(chat_id, None)
+        try:
+            await self.refresh(chat_id)
+        except Exception as e:
+            logger.error(f"Ошибка обновления доски чата {chat_id}: {e}")
+    
+    async def refresh(self, chat_id):
+        """Правка закрепленной доски по текущим задачам чата (если чат ее включил)"""
+        message_id = self.manager.get_chat_board(chat_id)
+        if message_id is None:
+            return
+        text = render_board(self.manager.get_user_tasks(chat_id), self.manager.get_user_timezone(chat_id))
+        digest = hash(text)
+        if self._texts.get(chat_id) == digest:
+            return
+        
+        self._last_edit[chat_id] = time.monotonic()
+        self._last_edit.move_to_end(chat_id)
+        try:
+            await self._bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+        except BadRequest as e:
+            error = str(e).lower()
+            if "not found" in error:
+                # Сообщение доски удалили - чат от нее отказался, вернуть можно через /board
+                logger.info(f"Доска чата {chat_id} удалена, обновления прекращены")
+                self.manager.delete_chat_board(chat_id)
+                self._texts.pop(chat_id, None)
+                return
+            if "not modified" not in error:
+                logger.warning(f"Доска чата {chat_id} не обновилась: {e}")
+                return
+        self._remember(chat_id, digest)
+    
+    async def post(self, chat_id, text=None):
+        """Публикация и закрепление нового сообщения доски"""
+        if text is None:
+            text = render_board(self.manager.get_user_tasks(chat_id), self.manager.get_user_timezone(chat_id))
+        message = await self._bot.send_message(chat_id, text)
+        self.manager.set_chat_board(chat_id, message.message_id)
+        self._remember(chat_id, hash(text))
+        try:
+            await self._bot.pin_chat_message(chat_id, message.message_id, disable_notification=True)
+        except Exception as e:
+            logger.warning(f"Не удалось закрепить доску в чате {chat_id}: {e}")
+        return message
+    
+    def _remember(self, chat_id, digest):
+        self._texts[chat_id] = digest
+        self._texts.move_to_end(chat_id)
+        if len(self._texts) > BOARD_CACHE_SIZE:
+            self._texts.popitem(last=False)
+
+board_updater = BoardUpdater(task_manager)
+
+async def board_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /board: опубликовать и закрепить доску задач чата"""
+    try:
+        if update.effective_chat.type not in GROUP_CHAT_TYPES:
+            await update.message.reply_text("📌 Доска задач доступна в групповых чатах. Добавьте бота в группу!")
+            return
+        await board_updater.post(update.effective_chat.id)
+    except Exception as e:
+        logger.error(f"Ошибка в команде /board: {e}")
+
+async def quick_add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавление задачи одной командой: /add текст"""
+    owner_id = task_owner_id(update)
+    text = " ".join(context.args).strip()
+    task_id = task_manager.add_task(owner_id, text)
+    if not task_id:
+        await update.message.reply_text("❌ Ошибка при создании задачи!")
+        return
+    board_updater.touch(owner_id)
+    await update.message.reply_text(f"✅ Задача #{task_id} создана: {text}")
+
+async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /done ID"""
+    try:
+        if not context.args or not context.args[0].lstrip('#').isdigit():
+            await update.message.reply_text("❌ Укажите номер задачи: /done 12")
+            return
+        
+        owner_id = task_owner_id(update)
+        task_id = int(context.args[0].lstrip('#'))
+        success, next_due = task_manager.complete_task(task_id, owner_id)
+        if not success:
+            await update.message.reply_text("❌ Активная задача с таким номером не найдена.")
+            return
+        if next_due:
+            deadline_scheduler.wake()
+        board_updater.touch(owner_id)
+        await update.message.reply_text(f"✅ Задача #{task_id} отмечена как выполненная! 🎉")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /done: {e}")
+
 # ФУНКЦИИ ДЛЯ ЗАДАЧ
 async def add_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало процесса добавления задачи"""
     try:
+        if context.args:
+            await quick_add_task(update, context)
+            return ConversationHandler.END
+        
         context.user_data.clear()
         context.user_data['current_step'] = 'text'
         
         # ИСПРАВЛЕНО: используем "back" вместо "back_to_main"
-        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_back_keyboard()
         
         await update.message.reply_text(
             "📝 Введите текст задачи:",
@@ -477,15 +3987,7 @@ async def add_task_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['task_text'] = update.message.text
         context.user_data['current_step'] = 'due_date'
         
-        keyboard = [
-            [InlineKeyboardButton("Сегодня", callback_data="today")],
-            [InlineKeyboardButton("Завтра", callback_data="tomorrow")],
-            [InlineKeyboardButton("Через 3 дня", callback_data="3days")],
-            [InlineKeyboardButton("📅 Кастомный формат", callback_data="custom")],
-            [InlineKeyboardButton("Без срока", callback_data="no_date")],
-            get_back_button()
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_due_date_keyboard()
         
         await update.message.reply_text(
             "⏰ Укажите срок выполнения:",
@@ -510,8 +4012,7 @@ async def add_task_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Возврат к вводу текста
             context.user_data['current_step'] = 'text'
             # ИСПРАВЛЕНО: используем "back" вместо "back_to_main"
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_back_keyboard()
             
             await query.edit_message_text(
                 "📝 Введите текст задачи:",
@@ -521,18 +4022,29 @@ async def add_task_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if user_choice == "custom":
             context.user_data['current_step'] = 'custom_date'
-            keyboard = [get_back_button()]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_back_keyboard()
             
             await query.edit_message_text(
-                "📅 Введите дату и время в формате:\n"
-                "`ГГГГ-ММ-ДД ЧЧ:ММ`\n"
-                "Пример: `2024-12-31 23:59`",
+                "📅 Введите дату и время, например:\n"
+                "`завтра в 9`, `через 3 дня`, `next friday 18:00`\n"
+                "или в формате `ГГГГ-ММ-ДД ЧЧ:ММ`: `2024-12-31 23:59`",
                 reply_markup=reply_markup
             )
             return CUSTOM_DATE
         
-        now = datetime.now()
+        if user_choice == "recurring":
+            context.user_data['current_step'] = 'recurrence'
+            
+            await query.edit_message_text(
+                "🔁 Как часто повторять задачу?\n"
+                "Можно также ввести правило текстом, например:\n"
+                "`weekly:mon,thu` или `cron:0 9 * * 1-5`",
+                reply_markup=get_recurrence_keyboard()
+            )
+            return RECURRENCE
+        
+        tz_name = task_manager.get_user_timezone(task_owner_id(update))
+        now = user_now(tz_name)
         
         if user_choice == "today":
             due_date = now.replace(hour=23, minute=59, second=59)
@@ -545,16 +4057,10 @@ async def add_task_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:  # no_date
             due_date = None
         
-        context.user_data['due_date'] = due_date.isoformat() if due_date else None
+        context.user_data['due_date'] = to_epoch(due_date, tz_name) if due_date else None
         context.user_data['current_step'] = 'priority'
         
-        keyboard = [
-            [InlineKeyboardButton("🔴 Высокий", callback_data="3")],
-            [InlineKeyboardButton("🟡 Средний", callback_data="2")],
-            [InlineKeyboardButton("🔵 Низкий", callback_data="1")],
-            get_back_button()
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_priority_keyboard()
         
         await query.edit_message_text(
             "🎯 Выберите приоритет:",
@@ -576,15 +4082,7 @@ async def handle_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # Возврат к выбору даты
             context.user_data['current_step'] = 'due_date'
             
-            keyboard = [
-                [InlineKeyboardButton("Сегодня", callback_data="today")],
-                [InlineKeyboardButton("Завтра", callback_data="tomorrow")],
-                [InlineKeyboardButton("Через 3 дня", callback_data="3days")],
-                [InlineKeyboardButton("📅 Кастомный формат", callback_data="custom")],
-                [InlineKeyboardButton("Без срока", callback_data="no_date")],
-                get_back_button()
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_due_date_keyboard()
             
             await update.message.reply_text(
                 "⏰ Укажите срок выполнения:",
@@ -593,42 +4091,103 @@ async def handle_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return DUE_DATE
         
         try:
-            due_date = datetime.strptime(custom_date, "%Y-%m-%d %H:%M")
-            if due_date < datetime.now():
+            tz_name = task_manager.get_user_timezone(task_owner_id(update))
+            now = user_now(tz_name)
+            due_date = parse_due_date(custom_date, now)
+            if due_date < now:
                 await update.message.reply_text("❌ Дата должна быть в будущем! Попробуйте снова:")
                 return CUSTOM_DATE
                 
-            context.user_data['due_date'] = due_date.isoformat()
+            context.user_data['due_date'] = to_epoch(due_date, tz_name)
             context.user_data['current_step'] = 'priority'
             
-            keyboard = [
-                [InlineKeyboardButton("🔴 Высокий", callback_data="3")],
-                [InlineKeyboardButton("🟡 Средний", callback_data="2")],
-                [InlineKeyboardButton("🔵 Низкий", callback_data="1")],
-                get_back_button()
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_priority_keyboard()
+            
+            await update.message.reply_text(
+                "🎯 Выберите приоритет:",
+                reply_markup=reply_markup
+            )
+            return PRIORITY
+            
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Не удалось понять дату!\n"
+                "Примеры: `завтра в 9`, `через 3 дня`, `next friday 18:00`,\n"
+                "`31.12 18:00` или `2024-12-31 23:59`\n"
+                "Попробуйте снова:"
+            )
+            return CUSTOM_DATE
+            
+    except Exception as e:
+        logger.error(f"Ошибка обработки кастомной даты: {e}")
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте снова.")
+        return ConversationHandler.END
+
+async def add_task_recurrence(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка выбора правила повторения"""
+    try:
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            # Возврат к выбору даты
+            context.user_data['current_step'] = 'due_date'
             
-            await update.message.reply_text(
-                "🎯 Выберите приоритет:",
-                reply_markup=reply_markup
+            await query.edit_message_text(
+                "⏰ Укажите срок выполнения:",
+                reply_markup=get_due_date_keyboard()
             )
-            return PRIORITY
-            
-        except ValueError:
+            return DUE_DATE
+        
+        tz_name = task_manager.get_user_timezone(task_owner_id(update))
+        rule = RECURRENCE_PRESETS[query.data](user_now(tz_name))
+        return await save_recurrence(query.edit_message_text, context, rule, tz_name)
+        
+    except Exception as e:
+        logger.error(f"Ошибка выбора повторения: {e}")
+        await update.callback_query.edit_message_text("❌ Произошла ошибка. Попробуйте снова.")
+        return ConversationHandler.END
+
+async def handle_recurrence_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка правила повторения, введенного текстом"""
+    try:
+        rule = update.message.text.strip().lower()
+        
+        try:
+            parse_recurrence(rule)
+        except (ValueError, KeyError):
             await update.message.reply_text(
-                "❌ Неверный формат даты!\n"
-                "Используйте: `ГГГГ-ММ-ДД ЧЧ:ММ`\n"
-                "Пример: `2024-12-31 23:59`\n"
+                "❌ Неизвестное правило повторения!\n"
+                "Примеры: `daily`, `weekly:mon,thu`, `monthly:15`, `cron:0 9 * * 1-5`\n"
                 "Попробуйте снова:"
             )
-            return CUSTOM_DATE
-            
+            return RECURRENCE
+        
+        tz_name = task_manager.get_user_timezone(task_owner_id(update))
+        return await save_recurrence(update.message.reply_text, context, rule, tz_name)
+        
     except Exception as e:
-        logger.error(f"Ошибка обработки кастомной даты: {e}")
+        logger.error(f"Ошибка обработки правила повторения: {e}")
         await update.message.reply_text("❌ Произошла ошибка. Попробуйте снова.")
         return ConversationHandler.END
 
+async def save_recurrence(reply, context, rule, tz_name):
+    """Сохранение правила повторения и переход к выбору приоритета"""
+    first_due = next_occurrence(rule, tz_name=tz_name)
+    if not first_due:
+        await reply("❌ По этому правилу нет ближайших дат. Попробуйте другое:")
+        return RECURRENCE
+    
+    context.user_data['recurrence'] = rule
+    context.user_data['due_date'] = first_due
+    context.user_data['current_step'] = 'priority'
+    
+    await reply(
+        "🎯 Выберите приоритет:",
+        reply_markup=get_priority_keyboard()
+    )
+    return PRIORITY
+
 async def add_task_priority(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора приоритета и сохранение задачи"""
     try:
@@ -639,15 +4198,7 @@ async def add_task_priority(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Возврат к выбору даты
             context.user_data['current_step'] = 'due_date'
             
-            keyboard = [
-                [InlineKeyboardButton("Сегодня", callback_data="today")],
-                [InlineKeyboardButton("Завтра", callback_data="tomorrow")],
-                [InlineKeyboardButton("Через 3 дня", callback_data="3days")],
-                [InlineKeyboardButton("📅 Кастомный формат", callback_data="custom")],
-                [InlineKeyboardButton("Без срока", callback_data="no_date")],
-                get_back_button()
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_due_date_keyboard()
             
             await query.edit_message_text(
                 "⏰ Укажите срок выполнения:",
@@ -655,30 +4206,45 @@ async def add_task_priority(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return DUE_DATE
         
+        if 'task_text' not in context.user_data:
+            # Шаги диалога удалены за время простоя
+            await query.edit_message_text("⌛ Время ввода задачи истекло, начните заново: /add")
+            return ConversationHandler.END
+        
         priority = int(query.data)
-        user_id = query.from_user.id
+        user_id = task_owner_id(update)
         task_text = context.user_data['task_text']
         due_date = context.user_data.get('due_date')
+        recurrence = context.user_data.get('recurrence')
         
-        task_id = task_manager.add_task(user_id, task_text, due_date, priority)
+        task_id = task_manager.add_task(user_id, task_text, due_date, priority, recurrence)
         
         if not task_id:
             await query.edit_message_text("❌ Ошибка при создании задачи!")
             return ConversationHandler.END
         
+        if due_date:
+            deadline_scheduler.wake()
+        board_updater.touch(user_id)
+        
         priority_text = {3: "🔴 Высокий", 2: "🟡 Средний", 1: "🔵 Низкий"}[priority]
         
         if due_date:
-            due_date_str = datetime.fromisoformat(due_date).strftime("%d.%m.%Y %H:%M")
+            due_date_str = format_due_date(due_date, task_manager.get_user_timezone(user_id))
         else:
             due_date_str = "Не указан"
         
+        if recurrence:
+            recurrence_str = f"\n🔁 Повтор: {parse_recurrence(recurrence).describe()}"
+        else:
+            recurrence_str = ""
+        
         confirmation_text = f"""
 ✅ Задача создана!
 
 "{task_text}"
 📅 Срок: {due_date_str}
-🎯 Приоритет: {priority_text}
+🎯 Приоритет: {priority_text}{recurrence_str}
 ID: #{task_id}
 
 💡 Не забывайте проверять список задач!
@@ -696,16 +4262,21 @@ ID: #{task_id}
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список активных задач"""
     try:
-        user_id = update.message.from_user.id
+        user_id = task_owner_id(update)
         tasks = task_manager.get_user_tasks(user_id)
         
         if not tasks:
             await update.message.reply_text("📭 У вас нет активных задач!")
             return
         
-        response = format_tasks_list(tasks, "📋 Ваши активные задачи")
+        response = await worker_pool.run(
+            format_tasks_list, tasks, "📋 Ваши активные задачи", task_manager.get_user_timezone(user_id),
+            user_id=user_id, inline=len(tasks) < WORKER_INLINE_ITEMS
+        )
         await update.message.reply_text(response)
         
+    except (WorkerPoolBusy, asyncio.TimeoutError):
+        await update.message.reply_text(BUSY_TEXT)
     except Exception as e:
         logger.error(f"Ошибка показа списка задач: {e}")
         await update.message.reply_text("❌ Произошла ошибка при получении списка задач.")
@@ -713,21 +4284,64 @@ async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_completed_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список выполненных задач"""
     try:
-        user_id = update.message.from_user.id
+        user_id = task_owner_id(update)
         tasks = task_manager.get_user_tasks(user_id, 'completed')
         
         if not tasks:
             await update.message.reply_text("📭 У вас нет выполненных задач!")
             return
         
-        response = format_tasks_list(tasks, "✅ Выполненные задачи")
+        response = await worker_pool.run(
+            format_tasks_list, tasks, "✅ Выполненные задачи", task_manager.get_user_timezone(user_id),
+            user_id=user_id, inline=len(tasks) < WORKER_INLINE_ITEMS
+        )
         await update.message.reply_text(response)
         
+    except (WorkerPoolBusy, asyncio.TimeoutError):
+        await update.message.reply_text(BUSY_TEXT)
     except Exception as e:
         logger.error(f"Ошибка показа выполненных задач: {e}")
         await update.message.reply_text("❌ Произошла ошибка при получении списка задач.")
 
-def format_tasks_list(tasks, title):
+STATS_DAYS = 7
+
+def format_stats(daily, backlog, today, days=STATS_DAYS):
+    """Текст /stats по дневным агрегатам и активным задачам"""
+    by_day = {day: (created, completed) for day, created, completed, _ in daily}
+    created = sum(row[1] for row in daily)
+    completed = sum(row[2] for row in daily)
+    on_time = sum(row[3] for row in daily)
+    
+    response = f"📊 Статистика за {days} дней:\n\n"
+    response += f"📝 Создано задач: {created}\n"
+    response += f"✅ Выполнено задач: {completed}\n"
+    if completed:
+        response += f"⏱ Выполнено вовремя: {round(100 * on_time / completed)}%\n"
+    
+    response += "\n📅 По дням (создано / выполнено):\n"
+    for offset in range(days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        day_created, day_completed = by_day.get(day.isoformat(), (0, 0))
+        response += f"  {day.strftime('%d.%m')}: +{day_created} / ✅ {day_completed} {'▮' * min(day_completed, 10)}\n"
+    
+    response += "\n📋 Активные задачи по приоритетам:\n"
+    for priority in [3, 2, 1]:
+        priority_text = {3: "🔴 Высокий", 2: "🟡 Средний", 1: "🔵 Низкий"}[priority]
+        response += f"  {priority_text}: {backlog.get(priority, 0)}\n"
+    return response
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats"""
+    try:
+        owner_id = task_owner_id(update)
+        daily, backlog = task_manager.get_stats(owner_id, STATS_DAYS)
+        today = user_now(task_manager.get_user_timezone(owner_id)).date()
+        await update.message.reply_text(format_stats(daily, backlog, today))
+    except Exception as e:
+        logger.error(f"Ошибка в команде /stats: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при получении статистики.")
+
+def format_tasks_list(tasks, title, tz_name=DEFAULT_TIMEZONE):
     """Форматирование списка задач"""
     tasks_by_priority = {3: [], 2: [], 1: []}
     
@@ -747,7 +4361,7 @@ def format_tasks_list(tasks, title):
         
         for task_id, text, due_date in priority_tasks:
             if due_date:
-                due_date_str = datetime.fromisoformat(due_date).strftime("%d.%m.%Y %H:%M")
+                due_date_str = format_due_date(due_date, tz_name)
                 response += f"  #{task_id} - {text} (до {due_date_str})\n"
             else:
                 response += f"  #{task_id} - {text}\n"
@@ -759,24 +4373,14 @@ def format_tasks_list(tasks, title):
 async def show_task_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать меню управления задачами"""
     try:
-        user_id = update.message.from_user.id
-        tasks = task_manager.get_user_tasks(user_id)
+        user_id = task_owner_id(update)
+        tasks = task_manager.get_user_tasks(user_id, with_version=True)
         
         if not tasks:
             await update.message.reply_text("📭 Нет активных задач для управления!")
             return
         
-        keyboard = []
-        for task in tasks:
-            task_id, _, text, due_date, priority, status, created_at = task
-            priority_emoji = {3: "🔴", 2: "🟡", 1: "🔵"}[priority]
-            button_text = f"{priority_emoji} #{task_id}: {text[:20]}..."
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"manage_{task_id}")])
-        
-        keyboard.append(get_back_button())
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_manage")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_task_management_keyboard(tasks)
         
         await update.message.reply_text(
             "⚙️ Выберите задачу для управления:",
@@ -806,7 +4410,7 @@ async def handle_task_management(update: Update, context: ContextTypes.DEFAULT_T
             return
         
         task_id = int(query.data.split("_")[1])
-        user_id = query.from_user.id
+        user_id = task_owner_id(update)
         
         task = task_manager.get_task(task_id, user_id)
         if not task:
@@ -815,12 +4419,7 @@ async def handle_task_management(update: Update, context: ContextTypes.DEFAULT_T
         
         context.user_data['manage_task_id'] = task_id
         
-        keyboard = [
-            [InlineKeyboardButton("✅ Выполнить", callback_data=f"complete_{task_id}")],
-            [InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{task_id}")],
-            get_back_button()
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = get_task_actions_keyboard(task_id)
         
         task_text = task[2]
         priority = task[4]
@@ -829,7 +4428,7 @@ async def handle_task_management(update: Update, context: ContextTypes.DEFAULT_T
         priority_text = {3: "🔴 Высокий", 2: "🟡 Средний", 1: "🔵 Низкий"}[priority]
         
         if due_date:
-            due_date_str = datetime.fromisoformat(due_date).strftime("%d.%m.%Y %H:%M")
+            due_date_str = format_due_date(due_date, task_manager.get_user_timezone(user_id))
             task_info = f"до {due_date_str}"
         else:
             task_info = "без срока"
@@ -853,34 +4452,48 @@ async def handle_management_action(update: Update, context: ContextTypes.DEFAULT
         await query.answer()
         
         if query.data == "back_to_list":
-            await show_task_management_from_query(query)
+            await show_task_management_from_query(update)
             return
         
         if query.data == "back":
             # Возврат к списку задач
-            await show_task_management_from_query(query)
+            await show_task_management_from_query(update)
             return
         
         action, task_id = query.data.split("_")
         task_id = int(task_id)
-        user_id = query.from_user.id
+        user_id = task_owner_id(update)
         
         if action == "complete":
-            success = task_manager.update_task(task_id, user_id, status='completed')
+            success, next_due = task_manager.complete_task(task_id, user_id)
             if success:
+                board_updater.touch(user_id)
+            if success and next_due:
+                next_due_str = format_due_date(next_due, task_manager.get_user_timezone(user_id))
+                deadline_scheduler.wake()
+                await query.edit_message_text(
+                    f"✅ Задача отмечена как выполненная! 🎉\n"
+                    f"🔁 Следующее повторение: {next_due_str}"
+                )
+            elif success:
                 await query.edit_message_text("✅ Задача отмечена как выполненная! 🎉")
             else:
                 await query.edit_message_text("❌ Ошибка при обновлении задачи!")
+        
+        elif action in SNOOZE_OPTIONS:
+            due_date = task_manager.snooze_task(task_id, user_id, SNOOZE_OPTIONS[action][0])
+            if due_date:
+                board_updater.touch(user_id)
+                deadline_scheduler.wake()
+                due_date_str = format_due_date(due_date, task_manager.get_user_timezone(user_id))
+                await query.edit_message_text(f"⏰ Задача #{task_id} отложена до {due_date_str}")
+            else:
+                await query.edit_message_text("❌ Задача не найдена или уже изменена!")
                 
         elif action == "delete":
             task = task_manager.get_task(task_id, user_id)
             if task:
-                keyboard = [
-                    [InlineKeyboardButton("✅ Да", callback_data=f"confirm_delete_{task_id}")],
-                    get_back_button(),
-                    [InlineKeyboardButton("❌ Нет", callback_data="cancel_delete")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = get_delete_confirmation_keyboard(task_id)
                 await query.edit_message_text(
                     f"❓ Вы уверены, что хотите удалить задачу '{task[2]}'?",
                     reply_markup=reply_markup
@@ -890,22 +4503,13 @@ async def handle_management_action(update: Update, context: ContextTypes.DEFAULT
         logger.error(f"Ошибка обработки действия: {e}")
         await update.callback_query.edit_message_text("❌ Произошла ошибка.")
 
-async def show_task_management_from_query(query):
+async def show_task_management_from_query(update):
     """Показать управление задачами из callback query"""
-    user_id = query.from_user.id
-    tasks = task_manager.get_user_tasks(user_id)
-    
-    keyboard = []
-    for task in tasks:
-        task_id, _, text, due_date, priority, status, created_at = task
-        priority_emoji = {3: "🔴", 2: "🟡", 1: "🔵"}[priority]
-        button_text = f"{priority_emoji} #{task_id}: {text[:20]}..."
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"manage_{task_id}")])
-    
-    keyboard.append(get_back_button())
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_manage")])
+    query = update.callback_query
+    user_id = task_owner_id(update)
+    tasks = task_manager.get_user_tasks(user_id, with_version=True)
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = get_task_management_keyboard(tasks)
     
     await query.edit_message_text(
         "⚙️ Выберите задачу для управления:",
@@ -926,15 +4530,10 @@ async def handle_delete_confirmation(update: Update, context: ContextTypes.DEFAU
             # Возврат к управлению задачей
             task_id = context.user_data.get('manage_task_id')
             if task_id:
-                user_id = query.from_user.id
+                user_id = task_owner_id(update)
                 task = task_manager.get_task(task_id, user_id)
                 if task:
-                    keyboard = [
-                        [InlineKeyboardButton("✅ Выполнить", callback_data=f"complete_{task_id}")],
-                        [InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{task_id}")],
-                        get_back_button()
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
+                    reply_markup = get_task_actions_keyboard(task_id)
                     
                     task_text = task[2]
                     priority = task[4]
@@ -943,7 +4542,7 @@ async def handle_delete_confirmation(update: Update, context: ContextTypes.DEFAU
                     priority_text = {3: "🔴 Высокий", 2: "🟡 Средний", 1: "🔵 Низкий"}[priority]
                     
                     if due_date:
-                        due_date_str = datetime.fromisoformat(due_date).strftime("%d.%m.%Y %H:%M")
+                        due_date_str = format_due_date(due_date, task_manager.get_user_timezone(user_id))
                         task_info = f"до {due_date_str}"
                     else:
                         task_info = "без срока"
@@ -959,10 +4558,11 @@ async def handle_delete_confirmation(update: Update, context: ContextTypes.DEFAU
         
         if query.data.startswith("confirm_delete_"):
             task_id = int(query.data.split("_")[2])
-            user_id = query.from_user.id
+            user_id = task_owner_id(update)
             
             success = task_manager.delete_task(task_id, user_id)
             if success:
+                board_updater.touch(user_id)
                 await query.edit_message_text("✅ Задача успешно удалена!")
             else:
                 await query.edit_message_text("❌ Ошибка при удалении задачи!")
@@ -970,6 +4570,736 @@ async def handle_delete_confirmation(update: Update, context: ContextTypes.DEFAU
         logger.error(f"Ошибка подтверждения удаления: {e}")
         await update.callback_query.edit_message_text("❌ Произошла ошибка.")
 
+# ОБЩИЕ СПИСКИ
+# Изменения в списке рассылаются участникам пачками: события за
+# LIST_NOTIFY_INTERVAL секунд собираются в одно сообщение на участника, а
+# участники всех затронутых списков читаются одним запросом.
+LIST_NOTIFY_INTERVAL = 5
+LIST_NOTIFY_MAX_LINES = 20
+
+class ListNotifier:
+    """Пакетная рассылка изменений общих списков"""
+    
+    def __init__(self, manager, interval=LIST_NOTIFY_INTERVAL, pacer=bulk_send_pacer):
+        self.manager = manager
+        self.interval = interval
+        self.pacer = pacer
+        # id списка -> [(автор, текст события)]
+        self._pending = {}
+        self._task = None
+    
+    def notify(self, list_id, actor_id, text):
+        """Поставить событие в очередь; автор уведомление не получает"""
+        events = self._pending.setdefault(list_id, [])
+        events.append((actor_id, text))
+        if len(events) > LIST_NOTIFY_MAX_LINES:
+            del events[0]
+    
+    def start(self, application):
+        """Запуск цикла рассылки"""
+        self._task = asyncio.create_task(self._run(application.bot))
+        logger.info("Рассылка изменений общих списков запущена")
+    
+    async def stop(self):
+        """Остановка цикла рассылки"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush(bot)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки изменений списков: {e}")
+    
+    async def flush(self, bot):
+        """Отправка накопленных событий"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        
+        sent = 0
+        members = await asyncio.to_thread(self.manager.get_list_members, list(pending))
+        for list_id, events in pending.items():
+            name, user_ids = members.get(list_id, (None, []))
+            for user_id in user_ids:
+                lines = [text for actor_id, text in events if actor_id != user_id]
+                if not lines:
+                    continue
+                await self.pacer.wait()
+                try:
+                    await bot.send_message(user_id, f"👥 Список «{name}»:\n" + "\n".join(lines))
+                    sent += 1
+                except Exception as e:
+                    logger.warning(f"Не удалось уведомить пользователя {user_id} о списке #{list_id}: {e}")
+        return sent
+
+list_notifier = ListNotifier(task_manager)
+
+def _list_id_arg(args):
+    if args and args[0].lstrip('#').isdigit():
+        return int(args[0].lstrip('#'))
+    return None
+
+async def new_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /newlist Название"""
+    try:
+        user = update.message.from_user
+        name = " ".join(context.args).strip()
+        if not name:
+            await update.message.reply_text("❌ Укажите название: /newlist Ремонт кухни")
+            return
+        
+        list_id, invite_code = task_manager.create_shared_list(user.id, user.first_name, user.username, name[:100])
+        if not list_id:
+            await update.message.reply_text("❌ Не удалось создать список.")
+            return
+        await update.message.reply_text(
+            f"👥 Общий список #{list_id} «{name[:100]}» создан!\n\n"
+            f"Чтобы пригласить участников, перешлите им команду:\n/join {invite_code}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в команде /newlist: {e}")
+
+async def join_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /join КОД"""
+    try:
+        user = update.message.from_user
+        if not context.args:
+            await update.message.reply_text("❌ Укажите код приглашения: /join a1b2c3d4")
+            return
+        
+        joined = task_manager.join_shared_list(user.id, user.first_name, user.username, context.args[0])
+        if not joined:
+            await update.message.reply_text("❌ Список с таким кодом не найден.")
+            return
+        list_id, name = joined
+        list_notifier.notify(list_id, user.id, f"➕ {user.first_name} присоединился к списку")
+        await update.message.reply_text(
+            f"✅ Вы в списке #{list_id} «{name}»\nЗадачи списка: /shared {list_id}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в команде /join: {e}")
+
+async def leave_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /leave ID"""
+    try:
+        user = update.message.from_user
+        list_id = _list_id_arg(context.args)
+        if list_id is None:
+            await update.message.reply_text("❌ Укажите номер списка: /leave 3")
+            return
+        
+        if task_manager.leave_shared_list(user.id, list_id):
+            list_notifier.notify(list_id, user.id, f"➖ {user.first_name} покинул список")
+            await update.message.reply_text(f"👋 Вы покинули список #{list_id}")
+        else:
+            await update.message.reply_text("❌ Вы не состоите в этом списке.")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /leave: {e}")
+
+async def lists_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /lists"""
+    try:
+        lists = task_manager.get_user_lists(update.message.from_user.id)
+        if not lists:
+            await update.message.reply_text(
+                "📭 Вы не состоите в общих списках.\n"
+                "Создать: /newlist Название\nВступить: /join КОД"
+            )
+            return
+        
+        response = "👥 Ваши общие списки:\n\n"
+        for list_id, name, invite_code, members, active in lists:
+            response += f"#{list_id} «{name}» - участников: {members}, задач: {active}\n"
+            response += f"  Задачи: /shared {list_id}, приглашение: /join {invite_code}\n"
+        await update.message.reply_text(response)
+    except Exception as e:
+        logger.error(f"Ошибка в команде /lists: {e}")
+
+async def shared_tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /shared ID [текст новой задачи]"""
+    try:
+        user = update.message.from_user
+        list_id = _list_id_arg(context.args)
+        if list_id is None:
+            await update.message.reply_text(
+                "❌ Укажите номер списка: /shared 3\n"
+                "Добавить задачу: /shared 3 Купить краску"
+            )
+            return
+        
+        text = " ".join(context.args[1:]).strip()
+        if text:
+            task_id = task_manager.add_list_task(list_id, user.id, text)
+            if not task_id:
+                await update.message.reply_text("❌ Вы не состоите в этом списке.")
+                return
+            list_notifier.notify(list_id, user.id, f"📝 {user.first_name} добавил задачу #{task_id}: {text}")
+            await update.message.reply_text(f"✅ Задача #{task_id} добавлена в список #{list_id}")
+            return
+        
+        result = task_manager.get_list_tasks(list_id, user.id)
+        if result is None:
+            await update.message.reply_text("❌ Вы не состоите в этом списке.")
+            return
+        name, tasks = result
+        if not tasks:
+            await update.message.reply_text(f"📭 В списке «{name}» нет активных задач!")
+            return
+        
+        response = f"👥 Список «{name}»:\n\n"
+        for task_id, task_text, assignee in tasks:
+            response += f"  #{task_id} - {task_text}"
+            response += f" (👤 {assignee})\n" if assignee else "\n"
+        response += "\n🙋 Взять задачу: /take ID, назначить: /take ID @username\n✅ Выполнить: /sdone ID"
+        await update.message.reply_text(response)
+    except Exception as e:
+        logger.error(f"Ошибка в команде /shared: {e}")
+
+async def take_list_task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /take ID [@username]"""
+    try:
+        user = update.message.from_user
+        task_id = _list_id_arg(context.args)
+        if task_id is None:
+            await update.message.reply_text("❌ Укажите номер задачи: /take 12 или /take 12 @username")
+            return
+        
+        username = context.args[1].lstrip('@') if len(context.args) > 1 else None
+        assigned = task_manager.assign_list_task(task_id, user.id, username)
+        if not assigned:
+            await update.message.reply_text("❌ Задача или участник не найдены.")
+            return
+        list_id, text, assignee = assigned
+        list_notifier.notify(list_id, user.id, f"🙋 Задача #{task_id} «{text}» - исполнитель {assignee}")
+        await update.message.reply_text(f"✅ Исполнитель задачи #{task_id}: {assignee}")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /take: {e}")
+
+async def complete_list_task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /sdone ID"""
+    try:
+        user = update.message.from_user
+        task_id = _list_id_arg(context.args)
+        if task_id is None:
+            await update.message.reply_text("❌ Укажите номер задачи: /sdone 12")
+            return
+        
+        completed = task_manager.complete_list_task(task_id, user.id)
+        if not completed:
+            await update.message.reply_text("❌ Активная задача с таким номером не найдена.")
+            return
+        list_id, text = completed
+        list_notifier.notify(list_id, user.id, f"✅ {user.first_name} выполнил задачу #{task_id}: {text}")
+        await update.message.reply_text(f"🎉 Задача #{task_id} выполнена!")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /sdone: {e}")
+
+# ИНЛАЙН-ПОИСК ЗАДАЧ
+# "@бот начало задачи" в любом чате показывает подходящие задачи, выбранная
+# отправляется в чат. Инлайн-запрос приходит на каждое нажатие клавиши, поэтому:
+# результаты кэшируются по префиксу (ответ на "купи" фильтруется из полного
+# ответа на "куп" без обращения к БД), в БД идет только последний запрос после
+# паузы в наборе INLINE_DEBOUNCE, а страницы листаются через next_offset из кэша.
+INLINE_DEBOUNCE = 0.3
+INLINE_PAGE_SIZE = 20
+INLINE_FETCH_LIMIT = 100
+INLINE_CACHE_TTL = 15
+INLINE_CACHE_TIME = 10
+INLINE_CACHE_USERS = 5000
+INLINE_CACHE_QUERIES = 32
+INLINE_MAX_QUERY = 64
+
+def search_prefixes(query):
+    """Варианты префикса: как введено, с заглавной и со строчной первой буквой"""
+    return sorted({query, query[:1].upper() + query[1:], query[:1].lower() + query[1:]})
+
+class InlineSearchCache:
+    """Результаты инлайн-поиска по пользователям: LRU пользователей, у каждого
+    LRU запросов, весь набор пользователя живет INLINE_CACHE_TTL секунд"""
+    
+    def __init__(self, ttl=INLINE_CACHE_TTL, max_users=INLINE_CACHE_USERS, max_queries=INLINE_CACHE_QUERIES):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_queries = max_queries
+        self._users = OrderedDict()
+        self._pending = {}
+    
+    def __len__(self):
+        return len(self._users)
+    
+    def get(self, user_id, query):
+        """Задачи по запросу из кэша или None, если нужно читать БД"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        created, queries = entry
+        if time.monotonic() - created > self.ttl:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        
+        cached = queries.get(query)
+        if cached is not None:
+            queries.move_to_end(query)
+            return cached[0]
+        
+        # Полный (не обрезанный лимитом) ответ на более короткий префикс
+        # содержит все задачи для более длинного
+        prefixes = tuple(search_prefixes(query))
+        for length in range(len(query) - 1, -1, -1):
+            cached = queries.get(query[:length])
+            if cached is not None and cached[1]:
+                tasks = [task for task in cached[0] if task[2].startswith(prefixes)]
+                self._store(queries, query, tasks, True)
+                return tasks
+        return None
+    
+    def put(self, user_id, query, tasks, complete):
+        entry = self._users.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            entry = self._users[user_id] = (time.monotonic(), OrderedDict())
+        self._users.move_to_end(user_id)
+        self._store(entry[1], query, tasks, complete)
+        # В начале - давно не искавшие пользователи: их наборы уже устарели
+        while self._users:
+            created, _ = next(iter(self._users.values()))
+            if len(self._users) <= self.max_users and time.monotonic() - created <= self.ttl:
+                break
+            self._users.popitem(last=False)
+    
+    def _store(self, queries, query, tasks, complete):
+        queries[query] = (tasks, complete)
+        queries.move_to_end(query)
+        while len(queries) > self.max_queries:
+            queries.popitem(last=False)
+    
+    async def debounce(self, user_id, query_id):
+        """Ожидание паузы в наборе; False, если пользователь уже ввел следующий символ"""
+        self._pending[user_id] = query_id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if self._pending.get(user_id) != query_id:
+            return False
+        del self._pending[user_id]
+        return True
+
+inline_cache = InlineSearchCache()
+
+def inline_task_result(task, tz_name):
+    """Карточка задачи для ответа на инлайн-запрос"""
+    task_id, _, text, due_date, priority, status, created_at = task
+    priority_emoji = {3: "🔴", 2: "🟡", 1: "🔵"}[priority]
+    due_text = f"до {format_due_date(due_date, tz_name)}" if due_date else "без срока"
+    return InlineQueryResultArticle(
+        id=str(task_id),
+        title=f"{priority_emoji} {text}",
+        description=due_text,
+        input_message_content=InputTextMessageContent(f"📋 {text}\n📅 Срок: {due_text}"),
+    )
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик инлайн-запросов: поиск своих задач по началу текста"""
+    query = update.inline_query
+    try:
+        user_id = query.from_user.id
+        text = query.query.strip()[:INLINE_MAX_QUERY]
+        offset = int(query.offset) if query.offset.isdigit() else 0
+        
+        tasks = inline_cache.get(user_id, text)
+        if tasks is None:
+            if not await inline_cache.debounce(user_id, query.id):
+                return
+            tasks = task_manager.search_tasks(user_id, search_prefixes(text), INLINE_FETCH_LIMIT + 1)
+            complete = len(tasks) <= INLINE_FETCH_LIMIT
+            tasks = tasks[:INLINE_FETCH_LIMIT]
+            inline_cache.put(user_id, text, tasks, complete)
+        
+        page = tasks[offset:offset + INLINE_PAGE_SIZE]
+        next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(tasks) else ""
+        tz_name = task_manager.get_user_timezone(user_id)
+        await query.answer(
+            [inline_task_result(task, tz_name) for task in page],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            next_offset=next_offset,
+        )
+    except BadRequest as e:
+        # Запрос устарел, пока ждали паузы или БД
+        logger.warning(f"Инлайн-запрос пользователя {query.from_user.id} не принят: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка инлайн-поиска: {e}")
+
+# ИМПОРТ И ЭКСПОРТ ЗАДАЧ
+def _export_row(row):
+    """Строка БД -> значения колонок файла экспорта (срок в ISO 8601 UTC)"""
+    task_id, text, due_date, priority, status, created_at, recurrence = row
+    if due_date is not None:
+        due_date = datetime.fromtimestamp(due_date, timezone.utc).isoformat()
+    return [task_id, text, due_date, priority, status, created_at, recurrence]
+
+def write_tasks_export(rows, fmt, fileobj):
+    """Построчная запись задач в CSV или JSON Lines; возвращает число строк"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(fileobj)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(_export_row(row))
+            count += 1
+    else:
+        for row in rows:
+            fileobj.write(json.dumps(dict(zip(EXPORT_COLUMNS, _export_row(row))), ensure_ascii=False))
+            fileobj.write("\n")
+            count += 1
+    return count
+
+def export_tasks_file(db_path, user_id, fmt, path):
+    """Экспорт задач пользователя в файл path (выполняется в пуле).
+    
+    Файл создает и удаляет вызывающий; здесь он открывается без создания,
+    так что задание, не уложившееся в таймаут, не оставит файл после
+    удаления. Возвращает число задач.
+    """
+    with open(path, 'r+', encoding='utf-8', newline='') as text_file:
+        text_file.truncate()
+        return write_tasks_export(read_user_tasks(db_path, user_id), fmt, text_file)
+
+def _parse_import_due_date(value):
+    """Срок из файла импорта: epoch или ISO 8601 (без пояса - UTC)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    due_date = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if due_date.tzinfo is None:
+        due_date = due_date.replace(tzinfo=timezone.utc)
+    return int(due_date.timestamp())
+
+def _normalize_import_record(record, now):
+    """Проверка записи импорта и приведение к кортежу для вставки"""
+    text = str(record.get('text') or '').strip()
+    if not text:
+        raise ValueError("Пустой текст задачи")
+    
+    due_date = _parse_import_due_date(record.get('due_date'))
+    priority = int(record.get('priority') or 2)
+    if priority not in (1, 2, 3):
+        raise ValueError(f"Некорректный приоритет: {priority}")
+    status = record.get('status') or 'active'
+    if status not in ('active', 'completed'):
+        raise ValueError(f"Некорректный статус: {status}")
+    recurrence = record.get('recurrence') or None
+    if recurrence:
+        parse_recurrence(recurrence)
+    created_at = record.get('created_at') or datetime.now().isoformat()
+    # Не напоминаем о сроках, которые прошли до импорта
+    notified = 1 if due_date is not None and due_date <= now else 0
+    return text, due_date, priority, status, created_at, recurrence, notified
+
+def read_tasks_import(fileobj, fmt, stats):
+    """Построчный разбор файла импорта; некорректные строки пропускаются"""
+    now = int(time.time())
+    if fmt == 'csv':
+        lines = csv.DictReader(fileobj)
+    else:
+        lines = (line for line in fileobj if line.strip())
+    
+    for line in lines:
+        try:
+            record = line if fmt == 'csv' else json.loads(line)
+            yield _normalize_import_record(record, now)
+        except (ValueError, TypeError, AttributeError, KeyError):
+            stats['skipped'] += 1
+
+def detect_import_format(file_name):
+    """Формат файла импорта по расширению"""
+    file_name = (file_name or '').lower()
+    if file_name.endswith('.csv'):
+        return 'csv'
+    if file_name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return None
+
+async def export_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export [csv|json]"""
+    try:
+        user_id = task_owner_id(update)
+        fmt = 'jsonl' if context.args and context.args[0].lower() in ('json', 'jsonl') else 'csv'
+        
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        os.close(fd)
+        try:
+            count = await worker_pool.run(
+                export_tasks_file, task_manager.user_db_path(user_id), user_id, fmt, path,
+                user_id=user_id, blocking=True
+            )
+            if not count:
+                await update.message.reply_text("📭 У вас нет задач для экспорта!")
+                return
+            
+            with open(path, 'rb') as export_file:
+                await update.message.reply_document(
+                    document=export_file,
+                    filename=f"tasks.{fmt}",
+                    caption=f"📤 Экспортировано задач: {count}\nДля восстановления используйте /import"
+                )
+        finally:
+            os.remove(path)
+        logger.info(f"Пользователь {user_id} экспортировал {count} задач ({fmt})")
+        
+    except (WorkerPoolBusy, asyncio.TimeoutError):
+        await update.message.reply_text(BUSY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка экспорта задач: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при экспорте задач.")
+
+async def import_tasks_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /import"""
+    try:
+        context.user_data['awaiting_import'] = True
+        await update.message.reply_text(
+            "📥 Отправьте файл .csv или .jsonl, полученный через /export"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в команде /import: {e}")
+
+async def handle_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт задач из присланного файла"""
+    try:
+        if not context.user_data.pop('awaiting_import', False):
+            # В группах документы - обычная переписка участников
+            if update.effective_chat.type == "private":
+                await update.message.reply_text("💡 Чтобы импортировать задачи, сначала отправьте /import")
+            return
+        
+        user_id = task_owner_id(update)
+        document = update.message.document
+        fmt = detect_import_format(document.file_name)
+        if not fmt:
+            await update.message.reply_text("❌ Поддерживаются только файлы .csv и .jsonl")
+            return
+        
+        telegram_file = await document.get_file()
+        stats = {'skipped': 0}
+        with tempfile.TemporaryFile() as raw:
+            await telegram_file.download_to_memory(raw)
+            raw.seek(0)
+            text_file = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            # Разбор и вставка до 100k строк - в потоке, чтобы не задерживать цикл событий
+            imported = await asyncio.to_thread(
+                task_manager.import_tasks, user_id, read_tasks_import(text_file, fmt, stats)
+            )
+            text_file.detach()
+        
+        deadline_scheduler.wake()
+        board_updater.touch(user_id)
+        response = f"✅ Импортировано задач: {imported}"
+        if stats['skipped']:
+            response += f"\n⚠️ Пропущено некорректных строк: {stats['skipped']}"
+        await update.message.reply_text(response)
+        
+    except Exception as e:
+        logger.error(f"Ошибка импорта задач: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при импорте задач.")
+
+# ПРОФИЛИРОВАНИЕ
+# Сэмплирующий профилировщик: фоновый поток раз в PROFILE_INTERVAL секунд
+# снимает стеки всех потоков бота (цикл событий и потоки to_thread с запросами
+# к БД) и считает одинаковые стеки. Пока профилирование не включено, накладных
+# расходов нет. Результат - файл в формате collapsed stacks ("a;b;c N"),
+# который понимают flamegraph.pl, speedscope и inferno.
+# ADMIN_IDS - id администраторов через запятую; PROFILE_ON_START=N - снять
+# профиль первых N секунд работы и прислать его администраторам.
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if admin_id}
+PROFILE_ON_START = int(os.getenv('PROFILE_ON_START', '0'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_DEPTH = 128
+PROFILE_SUMMARY_TOP = 5
+
+# Потоки, у которых последний кадр - одно из этих ожиданий, простаивают
+PROFILE_IDLE_FRAMES = frozenset({'select', 'wait', '_worker', '_wait_for_tstate_lock'})
+
+class SamplingProfiler:
+    """Профилировщик стеков с агрегацией по обработчикам и методам TaskManager"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.handlers = Counter()
+        self.methods = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._labels = {}
+        # Код зарегистрированных callback-функций: по нему кадр узнается как обработчик
+        self.handler_codes = frozenset()
+        self._thread = None
+        self._stop = threading.Event()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def begin(self, application, chat_ids, seconds):
+        """Запуск профилирования на seconds секунд с отправкой файла в chat_ids"""
+        if self.running:
+            return False
+        self.watch_handlers(application)
+        self._task = asyncio.create_task(self._run(application, chat_ids, seconds))
+        return True
+
+    def watch_handlers(self, application):
+        """Запоминает callback-функции всех обработчиков application, включая шаги диалогов"""
+        codes = set()
+        pending = [handler for handlers in application.handlers.values() for handler in handlers]
+        while pending:
+            handler = pending.pop()
+            if isinstance(handler, ConversationHandler):
+                pending.extend(handler.entry_points)
+                pending.extend(step for steps in handler.states.values() for step in steps)
+                pending.extend(handler.fallbacks)
+            elif hasattr(handler.callback, '__code__'):
+                codes.add(handler.callback.__code__)
+        self.handler_codes = frozenset(codes)
+        self._labels.clear()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._stop_sampling)
+
+    async def _run(self, application, chat_ids, seconds):
+        self._start_sampling()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(self._stop_sampling)
+
+        try:
+            data = self.collapsed().encode('utf-8')
+            caption = self.summary()
+            filename = f"profile-{datetime.fromtimestamp(self.started_at):%Y%m%d-%H%M%S}.collapsed"
+            for chat_id in chat_ids:
+                await application.bot.send_document(
+                    chat_id, document=io.BytesIO(data), filename=filename, caption=caption
+                )
+        except Exception as e:
+            logger.error(f"Ошибка отправки профиля: {e}")
+
+    def _start_sampling(self):
+        self.stacks.clear()
+        self.handlers.clear()
+        self.methods.clear()
+        self.samples = 0
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Профилирование запущено, интервал {self.interval * 1000:.0f} мс")
+
+    def _stop_sampling(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Профилирование остановлено: {self.samples} снимков, {len(self.stacks)} стеков")
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_name in PROFILE_IDLE_FRAMES:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self._record(thread_names.get(thread_id, 'thread'), frame)
+            self.samples += 1
+
+    def _record(self, thread_name, frame):
+        names = []
+        handlers = set()
+        methods = set()
+        while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+            name, kind = self._label(frame.f_code)
+            names.append(name)
+            if kind == 'handler':
+                handlers.add(name)
+            elif kind == 'method':
+                methods.add(name)
+            frame = frame.f_back
+        names.append(thread_name)
+        self.stacks[';'.join(reversed(names))] += 1
+        # Каждая функция учитывается один раз на снимок, даже при рекурсии
+        self.handlers.update(handlers)
+        self.methods.update(methods)
+
+    def _label(self, code):
+        """Имя кадра и его вид: обработчик обновления, метод TaskManager или прочее"""
+        label = self._labels.get(code)
+        if label is None:
+            name = f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+            kind = None
+            if code in self.handler_codes:
+                kind = 'handler'
+            elif code.co_filename == __file__ and code.co_qualname.startswith('TaskManager.'):
+                kind = 'method'
+            label = self._labels[code] = (name, kind)
+        return label
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        lines = [f"🔥 Профиль: {self.samples} снимков по {self.interval * 1000:.0f} мс"]
+        for title, counter in (("Обработчики", self.handlers), ("Методы TaskManager", self.methods)):
+            if not counter:
+                continue
+            lines.append(f"\n{title}:")
+            for name, count in counter.most_common(PROFILE_SUMMARY_TOP):
+                lines.append(f"• {name.split(' ')[0]}: {count} ({count * self.interval * 1000:.0f} мс)")
+        # Подпись к файлу в Telegram ограничена 1024 символами
+        return '\n'.join(lines)[:1024]
+
+profiler = SamplingProfiler()
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile [секунды] (только для администраторов)"""
+    try:
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+
+        seconds = PROFILE_DEFAULT_SECONDS
+        if context.args:
+            if not context.args[0].isdigit():
+                await update.message.reply_text("❌ Использование: /profile [секунды]")
+                return
+            seconds = max(1, min(int(context.args[0]), PROFILE_MAX_SECONDS))
+
+        if not profiler.begin(context.application, [update.effective_chat.id], seconds):
+            await update.message.reply_text("⏳ Профилирование уже идет, дождитесь результата.")
+            return
+        await update.message.reply_text(f"🔥 Профилирование на {seconds} с запущено, файл придет в этот чат.")
+    except Exception as e:
+        logger.error(f"Ошибка в команде /profile: {e}")
+        await update.message.reply_text("❌ Не удалось запустить профилирование.")
+
 # ИСПРАВЛЕННЫЙ обработчик кнопки Назад
 async def handle_back_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки Назад в различных состояниях"""
@@ -991,8 +5321,7 @@ async def handle_back_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
         elif current_step == 'due_date':
             # Возврат к вводу текста
             context.user_data['current_step'] = 'text'
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_back_keyboard()
             
             await query.edit_message_text(
                 "📝 Введите текст задачи:",
@@ -1000,18 +5329,10 @@ async def handle_back_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return TEXT
             
-        elif current_step == 'priority':
+        elif current_step in ('priority', 'recurrence'):
             # Возврат к выбору даты
             context.user_data['current_step'] = 'due_date'
-            keyboard = [
-                [InlineKeyboardButton("Сегодня", callback_data="today")],
-                [InlineKeyboardButton("Завтра", callback_data="tomorrow")],
-                [InlineKeyboardButton("Через 3 дня", callback_data="3days")],
-                [InlineKeyboardButton("📅 Кастомный формат", callback_data="custom")],
-                [InlineKeyboardButton("Без срока", callback_data="no_date")],
-                get_back_button()
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = get_due_date_keyboard()
             
             await query.edit_message_text(
                 "⏰ Укажите срок выполнения:",
@@ -1064,6 +5385,142 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Exception while handling an update: {context.error}")
 
+async def wait_database_ready(manager):
+    """Окончание инициализации БД, запущенной warm_up, и создание зависящих от раскладки компонентов"""
+    await asyncio.to_thread(manager.wait_ready)
+    snapshot_managers[:] = build_snapshot_managers(manager)
+
+async def post_init(application: Application):
+    """Запуск фоновых задач после инициализации приложения"""
+    # Обновления начинают обрабатываться только после post_init, так что
+    # обработчики всегда видят готовую БД
+    await wait_database_ready(task_manager)
+    shard_rebalancer.start(application)
+    deadline_scheduler.start(application)
+    digest_scheduler.start(application)
+    news_scheduler.start(application)
+    list_notifier.start(application)
+    board_updater.start(application)
+    for snapshot_manager in snapshot_managers:
+        snapshot_manager.start(application)
+    worker_pool.start()
+    if PROFILE_ON_START > 0 and ADMIN_IDS:
+        profiler.begin(application, sorted(ADMIN_IDS), min(PROFILE_ON_START, PROFILE_MAX_SECONDS))
+
+async def post_shutdown(application: Application):
+    """Остановка фоновых задач при завершении работы"""
+    await shard_rebalancer.stop()
+    await deadline_scheduler.stop()
+    await digest_scheduler.stop()
+    await news_scheduler.stop()
+    await list_notifier.stop()
+    await board_updater.stop()
+    for snapshot_manager in snapshot_managers:
+        await snapshot_manager.stop()
+    worker_pool.stop()
+    await profiler.stop()
+
+def register_handlers(application):
+    """Регистрация всех обработчиков (используется и ботом, и нагрузочным прогоном tests/soak.py)"""
+    # ИСПРАВЛЕННЫЙ ConversationHandler
+    add_conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler('add', add_task_start),
+            MessageHandler(filters.Text("📝 Добавить задачу"), add_task_start)
+        ],
+        states={
+            TEXT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, add_task_text),
+                CallbackQueryHandler(handle_back_button, pattern="^back$")
+            ],
+            DUE_DATE: [
+                CallbackQueryHandler(add_task_due_date, pattern="^(today|tomorrow|3days|no_date|custom|recurring|back)$")
+            ],
+            RECURRENCE: [
+                CallbackQueryHandler(add_task_recurrence, pattern="^(rec_daily|rec_weekdays|rec_weekly|rec_monthly|back)$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_recurrence_text)
+            ],
+            CUSTOM_DATE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_date),
+                CallbackQueryHandler(handle_back_button, pattern="^back$")
+            ],
+            PRIORITY: [
+                CallbackQueryHandler(add_task_priority, pattern="^(1|2|3|back)$")
+            ],
+        },
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            MessageHandler(filters.Text("❌ Отмена"), cancel),
+            CallbackQueryHandler(handle_back_button, pattern="^back$"),
+            MessageHandler(filters.Text(["назад", "back", "отмена", "cancel"]), cancel)
+        ],
+        # Диалог завершается тогда же, когда удаляются шаги в user_data, иначе
+        # вернувшийся пользователь застрянет на шаге без сохраненных данных
+        conversation_timeout=user_data_janitor.idle
+    )
+    
+    # Учет активности и ограничение частоты запросов - до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, user_data_middleware), group=-2)
+    application.add_handler(TypeHandler(Update, rate_limit_middleware), group=-1)
+    
+    # Добавление обработчиков
+    application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('help', help_command))
+    application.add_handler(CommandHandler('list', list_tasks))
+    application.add_handler(CommandHandler('timezone', set_timezone))
+    application.add_handler(CommandHandler('export', export_tasks))
+    application.add_handler(CommandHandler('import', import_tasks_start))
+    application.add_handler(CommandHandler('news', news_command))
+    application.add_handler(CommandHandler(['subscribe', 'unsubscribe'], subscribe_command))
+    application.add_handler(CommandHandler('stats', stats_command))
+    application.add_handler(CommandHandler('board', board_command))
+    application.add_handler(CommandHandler('done', done_command))
+    application.add_handler(CommandHandler('newlist', new_list_command))
+    application.add_handler(CommandHandler('join', join_list_command))
+    application.add_handler(CommandHandler('leave', leave_list_command))
+    application.add_handler(CommandHandler('lists', lists_command))
+    application.add_handler(CommandHandler('shared', shared_tasks_command))
+    application.add_handler(CommandHandler('take', take_list_task_command))
+    application.add_handler(CommandHandler('sdone', complete_list_task_command))
+    application.add_handler(CommandHandler('profile', profile_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_import_file))
+    # Не блокирует остальные обновления, пока ждет паузы в наборе
+    application.add_handler(InlineQueryHandler(inline_query_handler, block=False))
+    
+    application.add_handler(add_conv_handler)
+    
+    # Обработчики меню
+    application.add_handler(MessageHandler(
+        filters.Text([
+            "📝 Добавить задачу", "📋 Список задач", 
+            "✅ Выполненные", "⚙️ Управление задачами",
+            "📰 Бизнес-новости США", "ℹ️ Помощь"
+        ]), 
+        handle_menu_selection
+    ))
+    
+    # Обработчики callback запросов для задач
+    application.add_handler(CallbackQueryHandler(handle_task_management, pattern="^manage_"))
+    application.add_handler(CallbackQueryHandler(handle_management_action, pattern="^((complete|delete|snooze1h|snooze1d)_\\d+|back_to_list|back)$"))
+    application.add_handler(CallbackQueryHandler(handle_delete_confirmation, pattern="^(confirm_delete_|cancel_delete|back)$"))
+    
+    # Обработчики callback запросов для новостей
+    application.add_handler(CallbackQueryHandler(
+        handle_news_actions, pattern="^((refresh_news|sub_news|unsub_news)(:[a-z]+:[a-z]+)?|close_news|back)$"
+    ))
+    
+    # Обработчик кнопки Назад
+    application.add_handler(CallbackQueryHandler(handle_back_button, pattern="^back$"))
+    
+    # Обработчик текстовых команд (назад, отмена)
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND, 
+        handle_text_commands
+    ))
+    
+    # Добавление обработчика ошибок
+    application.add_error_handler(error_handler)
+
 def main():
     """Основная функция запуска бота"""
     try:
@@ -1075,77 +5532,20 @@ def main():
         print(f"✅ NEWS_API_KEY: {'Найден' if NEWS_API_KEY else 'Отсутствует'}")
         print("🚀 Запуск бота...")
         
-        application = Application.builder().token(BOT_TOKEN).build()
+        task_manager.warm_up()
         
-        # ИСПРАВЛЕННЫЙ ConversationHandler
-        add_conv_handler = ConversationHandler(
-            entry_points=[
-                CommandHandler('add', add_task_start),
-                MessageHandler(filters.Text("📝 Добавить задачу"), add_task_start)
-            ],
-            states={
-                TEXT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, add_task_text),
-                    CallbackQueryHandler(handle_back_button, pattern="^back$")
-                ],
-                DUE_DATE: [
-                    CallbackQueryHandler(add_task_due_date, pattern="^(today|tomorrow|3days|no_date|custom|back)$")
-                ],
-                CUSTOM_DATE: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_date),
-                    CallbackQueryHandler(handle_back_button, pattern="^back$")
-                ],
-                PRIORITY: [
-                    CallbackQueryHandler(add_task_priority, pattern="^(1|2|3|back)$")
-                ],
-            },
-            fallbacks=[
-                CommandHandler('cancel', cancel),
-                MessageHandler(filters.Text("❌ Отмена"), cancel),
-                CallbackQueryHandler(handle_back_button, pattern="^back$"),
-                MessageHandler(filters.Text(["назад", "back", "отмена", "cancel"]), cancel)
-            ]
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
         )
         
-        # Добавление обработчиков
-        application.add_handler(CommandHandler('start', start))
-        application.add_handler(CommandHandler('help', help_command))
-        application.add_handler(CommandHandler('list', list_tasks))
-        
-        application.add_handler(add_conv_handler)
-        
-        # Обработчики меню
-        application.add_handler(MessageHandler(
-            filters.Text([
-                "📝 Добавить задачу", "📋 Список задач", 
-                "✅ Выполненные", "⚙️ Управление задачами",
-                "📰 Бизнес-новости США", "ℹ️ Помощь"
-            ]), 
-            handle_menu_selection
-        ))
-        
-        # Обработчики callback запросов для задач
-        application.add_handler(CallbackQueryHandler(handle_task_management, pattern="^manage_"))
-        application.add_handler(CallbackQueryHandler(handle_management_action, pattern="^(complete_|delete_|back_to_list|back)$"))
-        application.add_handler(CallbackQueryHandler(handle_delete_confirmation, pattern="^(confirm_delete_|cancel_delete|back)$"))
-        
-        # Обработчики callback запросов для новостей
-        application.add_handler(CallbackQueryHandler(handle_news_actions, pattern="^(refresh_news|close_news|back)$"))
-        
-        # Обработчик кнопки Назад
-        application.add_handler(CallbackQueryHandler(handle_back_button, pattern="^back$"))
-        
-        # Обработчик текстовых команд (назад, отмена)
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            handle_text_commands
-        ))
-        
-        # Добавление обработчика ошибок
-        application.add_error_handler(error_handler)
+        register_handlers(application)
         
         print("✅ Бот запущен успешно!")
-        print("📰 Функция новостей: АКТИВНА (бизнес-новости США)")
+        print(f"📰 Функция новостей: АКТИВНА (лент: {len(NEWS_COUNTRIES) * len(NEWS_CATEGORIES)})")
         print("🔄 Функция возврата назад: АКТИВНА на всех этапах")
         
         application.run_polling()
@@ -1153,5 +5553,20 @@ def main():
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
 
+def rebalance_shards():
+    """Перенос пользователей между шардами после изменения DB_SHARDS.
+    
+    Только при остановленном боте: работающий бот держит раскладку в памяти
+    и сам переносит пользователей в фоне (ShardRebalancer).
+    """
+    task_manager.init_database()
+    moved = task_manager.rebalance()
+    print(f"✅ Перенесено пользователей: {moved}")
+    for index, path, users, tasks in task_manager.shard_stats():
+        print(f"  шард {index} ({path}): пользователей {users}, задач {tasks}")
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ['rebalance']:
+        rebalance_shards()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""Время разбора сроков: python tests/bench_due_dates.py"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from test_due_dates import CORPUS, NOW  # noqa: E402
+
+ROUNDS = 2000
+
+
+def main():
+    phrases = [phrase for phrase, _ in CORPUS]
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        for phrase in phrases:
+            bot.parse_due_date(phrase, NOW)
+    elapsed = time.perf_counter() - started
+    count = ROUNDS * len(phrases)
+    print(f"{count} фраз за {elapsed:.2f} с: {elapsed / count * 1e6:.1f} мкс на фразу")
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS * 10):
+        bot.parse_due_date("2024-12-31 23:59", NOW)
+    elapsed = time.perf_counter() - started
+    print(f"строгий формат: {elapsed / (ROUNDS * 10) * 1e6:.1f} мкс на фразу")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Скорость экспорта/импорта 100k задач: python tests/bench_import_export.py
+
+С ключом --memory вместо скорости измеряется пик памяти (tracemalloc
+замедляет работу в несколько раз, поэтому отдельным запуском).
+"""
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+TASKS = 100_000
+USER_ID = 1
+TRACE_MEMORY = '--memory' in sys.argv
+
+
+def measure(label, action):
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - started
+    if TRACE_MEMORY:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label}: пик памяти {peak / 1024:.0f} КБ")
+    else:
+        print(f"{label}: {TASKS / elapsed:,.0f} задач/с, {elapsed:.2f} с")
+    return result
+
+
+def main():
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = bot.TaskManager(db_path=os.path.join(directory, "tasks.db"))
+        manager.import_tasks(USER_ID, (
+            (f"Задача {index}", 1700000000 + index, index % 3 + 1, 'active', "2024-01-01T00:00:00", None, 1)
+            for index in range(TASKS)
+        ))
+
+        for fmt in ('csv', 'jsonl'):
+            path = os.path.join(directory, f"tasks.{fmt}")
+            with open(path, 'w', encoding='utf-8', newline='') as export_file:
+                measure(f"экспорт {fmt}", lambda: bot.write_tasks_export(
+                    manager.iter_user_tasks(USER_ID), fmt, export_file))
+            print(f"  размер файла: {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+
+            stats = {'skipped': 0}
+            with open(path, 'rb') as raw:
+                text_file = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+                imported = measure(f"импорт {fmt}", lambda: manager.import_tasks(
+                    USER_ID + 1, bot.read_tasks_import(text_file, fmt, stats)))
+            assert imported == TASKS and not stats['skipped']
+
+        for shard in manager.shards:
+            shard.conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Запись из нескольких потоков при разном числе шардов: python tests/bench_shards.py
+
+Параллельно в разные шарды пишут только разные потоки (фоновые задачи,
+перебалансировка); обработчики обновлений выполняются по очереди.
+Второй замер - сколько последний проход перебалансировки держит
+блокировки всех шардов, пока пользователи продолжают писать.
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+THREADS = 8
+TASKS_PER_THREAD = 2000
+
+
+def run(shard_count):
+    with tempfile.TemporaryDirectory() as directory:
+        manager = bot.TaskManager(db_path=os.path.join(directory, "tasks.db"), shard_count=shard_count)
+
+        def writer(first_user):
+            for index in range(TASKS_PER_THREAD):
+                manager.add_task(first_user + index % 100 * THREADS, f"Задача {index}")
+
+        threads = [threading.Thread(target=writer, args=(thread,)) for thread in range(THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        for shard in manager.shards:
+            shard.conn.close()
+    return THREADS * TASKS_PER_THREAD / elapsed
+
+
+def run_rebalance(users, writers=2):
+    """Перебалансировка 1 -> 4 шарда под записью: (всего, последний проход) в секундах и число записей"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tasks.db")
+        manager = bot.TaskManager(db_path=path, shard_count=1)
+        for user_id in range(1, users + 1):
+            manager.add_task(user_id, "Задача")
+        for shard in manager.shards:
+            shard.conn.close()
+
+        manager = bot.TaskManager(db_path=path, shard_count=4)
+        done = threading.Event()
+        written = []
+
+        def writer(first_user):
+            user_id = first_user
+            while not done.is_set():
+                user_id = (user_id + writers) % users + 1
+                manager.add_task(user_id, "Во время перебалансировки")
+                written.append(user_id)
+
+        threads = [threading.Thread(target=writer, args=(thread,)) for thread in range(writers)]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        manager.rebalance()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        for shard in manager.shards:
+            shard.conn.close()
+    return elapsed, manager.last_final_pass, len(written)
+
+
+def main():
+    logging.disable(logging.INFO)
+    for shard_count in (1, 2, 4, 8):
+        print(f"шардов {shard_count}: {run(shard_count):,.0f} задач/с ({THREADS} потоков)")
+    for users in (1000, 10000):
+        elapsed, final_pass, written = run_rebalance(users)
+        print(f"перебалансировка {users} пользователей: {elapsed:.2f} с, последний проход "
+              f"{final_pass * 1000:.1f} мс (записей во время переноса: {written})")
+
+
+if __name__ == '__main__':
+    main()
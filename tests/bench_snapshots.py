@@ -0,0 +1,87 @@
+"""Время снимков и задержка записи во время снимка: python tests/bench_snapshots.py"""
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+TASKS = 200_000
+WRITES_PER_SECOND = 200
+
+
+def write_latencies(db_path, stop):
+    """Одиночные UPDATE с commit из отдельного соединения, как у бота"""
+    conn = sqlite3.connect(db_path)
+    latencies = []
+    task_id = 0
+    while not stop.is_set():
+        task_id = task_id % TASKS + 1
+        started = time.perf_counter()
+        conn.execute("UPDATE tasks SET priority = priority % 3 + 1 WHERE id = ?", (task_id,))
+        conn.commit()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(1 / WRITES_PER_SECOND)
+    conn.close()
+    return latencies
+
+
+def measure_writes(db_path, action):
+    stop = threading.Event()
+    result = {}
+    writer = threading.Thread(target=lambda: result.setdefault('latencies', write_latencies(db_path, stop)))
+    writer.start()
+    started = time.perf_counter()
+    value = action()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    writer.join()
+    return value, elapsed, sorted(result['latencies'])
+
+
+def report(label, elapsed, latencies):
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label}: {elapsed:.2f} с; запись p50 {statistics.median(latencies) * 1000:.2f} мс, "
+          f"p99 {p99 * 1000:.2f} мс, макс {latencies[-1] * 1000:.2f} мс ({len(latencies)} записей)")
+
+
+def main():
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "tasks.db")
+        manager = bot.TaskManager(db_path=db_path)
+        manager.import_tasks(1, (
+            (f"Задача {index}", 1700000000 + index, index % 3 + 1, 'active', "2024-01-01T00:00:00", None, 1)
+            for index in range(TASKS)
+        ))
+        print(f"размер БД: {os.path.getsize(db_path) / 1024 / 1024:.1f} МБ")
+        snapshots = bot.SnapshotManager(db_path, backup_dir=os.path.join(directory, "backups"))
+
+        _, elapsed, latencies = measure_writes(db_path, lambda: time.sleep(2))
+        report("без снимка", elapsed, latencies)
+
+        path, elapsed, latencies = measure_writes(db_path, snapshots.take_snapshot)
+        report("полный снимок", elapsed, latencies)
+        print(f"  размер: {os.path.getsize(path) / 1024:.0f} КБ")
+
+        path, elapsed, latencies = measure_writes(db_path, snapshots.take_snapshot)
+        report("дельта", elapsed, latencies)
+        print(f"  размер: {os.path.getsize(path) / 1024:.0f} КБ")
+
+        os.remove(db_path)
+        started = time.perf_counter()
+        assert bot.restore_latest_snapshot(db_path, snapshots.backup_dir)
+        print(f"восстановление: {time.perf_counter() - started:.2f} с")
+
+        for shard in manager.shards:
+            shard.conn.close()
+
+
+if __name__ == '__main__':
+    main()
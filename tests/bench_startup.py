@@ -0,0 +1,132 @@
+"""Время запуска: импорт bot.py и задержка первого обновления: python tests/bench_startup.py
+
+Каждый запуск - отдельный процесс над готовой БД из SHARDS шардов с TASKS
+задачами. Первое обновление - /list, которому нужна готовая БД. Режим
+"сразу" открывает БД до сборки Application (как до ленивого запуска),
+"в фоне" - через warm_up параллельно со сборкой, как main().
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 7
+SHARDS = 4
+TASKS = 50_000
+USER_ID = 42
+
+
+def child(mode, db_path):
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import bot
+    from telegram import Update
+    from telegram.ext import Application
+    from telegram.request import BaseRequest
+    imported = time.perf_counter()
+
+    replied = asyncio.Event()
+
+    class OfflineRequest(BaseRequest):
+        """Bot API без сети: getMe и ответ на сообщение"""
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit('/', 1)[-1]
+            if api_method == 'getMe':
+                result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            else:
+                replied.set()
+                result = {"message_id": 2, "date": 0, "chat": {"id": USER_ID, "type": "private"}, "text": ""}
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def first_update():
+        bot.task_manager = bot.TaskManager(db_path=db_path, shard_count=SHARDS, lazy=True)
+        if mode == 'eager':
+            bot.task_manager.init_database()
+        else:
+            bot.task_manager.warm_up()
+        application = Application.builder().token("1:bench").request(OfflineRequest()).build()
+        bot.register_handlers(application)
+        await application.initialize()
+        built = time.perf_counter()
+        # То же, что post_init: обновления обрабатываются после готовности БД
+        await bot.wait_database_ready(bot.task_manager)
+        ready = time.perf_counter()
+
+        update = Update.de_json({
+            "update_id": 1,
+            "message": {
+                "message_id": 1, "date": int(time.time()), "text": "/list",
+                "chat": {"id": USER_ID, "type": "private"},
+                "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+            },
+        }, application.bot)
+        await application.process_update(update)
+        await replied.wait()
+        answered = time.perf_counter()
+        await application.shutdown()
+        return built, ready, answered
+
+    built, ready, answered = asyncio.run(first_update())
+    print(json.dumps({
+        "import": imported - started,
+        "build": built - imported,
+        "ready": ready - imported,
+        "first_update": answered - ready,
+        "total": answered - started,
+    }))
+
+
+def prepare(directory):
+    sys.path.insert(0, ROOT)
+    import logging
+    import bot
+    logging.disable(logging.INFO)
+    db_path = os.path.join(directory, "tasks.db")
+    manager = bot.TaskManager(db_path=db_path, shard_count=SHARDS)
+    for user_id in range(1, 101):
+        manager.import_tasks(user_id, (
+            (f"Задача {index}", None, 2, 'active', "2024-01-01T00:00:00", None, 0)
+            for index in range(TASKS // 100)
+        ))
+    for shard in manager.shards:
+        shard.conn.close()
+    return db_path
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = prepare(directory)
+        env = dict(os.environ, BACKUP_DIR=os.path.join(directory, "backups"))
+        for mode, label in (('eager', "сразу"), ('warm', "в фоне")):
+            runs = []
+            for _ in range(RUNS):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, db_path],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            medians = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+            print(f"БД {label}: импорт {medians['import']:.0f} мс, сборка {medians['build']:.0f} мс, "
+                  f"БД готова через {medians['ready']:.0f} мс, первое обновление {medians['first_update']:.0f} мс, "
+                  f"всего {medians['total']:.0f} мс (медиана {RUNS} запусков)")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,90 @@
+"""Задержка легких запросов рядом с тяжелыми: python tests/bench_worker_pool.py
+
+Легкий запрос - короткий обработчик, который раз в LIGHT_INTERVAL секунд
+просыпается в цикле событий; его задержка - насколько позже он получил
+управление. Параллельно пользователи с HEAVY_TASKS задачами запрашивают
+список и экспорт. Сравниваются режим без пула и пул из WORKER_PROCESSES
+процессов.
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+HEAVY_TASKS = 10_000
+HEAVY_USERS = 4
+HEAVY_ROUNDS = 3
+LIGHT_INTERVAL = 0.005
+WORKER_PROCESSES = 2
+
+
+async def light_requests(stop, delays):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LIGHT_INTERVAL)
+        delays.append(time.perf_counter() - started - LIGHT_INTERVAL)
+
+
+async def heavy_user(pool, manager, user_id):
+    tasks = manager.get_user_tasks(user_id)
+    for _ in range(HEAVY_ROUNDS):
+        await pool.run(bot.format_tasks_list, tasks, "📋 Задачи", bot.DEFAULT_TIMEZONE, user_id=user_id)
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            await pool.run(bot.export_tasks_file, manager.user_db_path(user_id), user_id, 'csv', path,
+                           user_id=user_id)
+        finally:
+            os.remove(path)
+
+
+async def run(pool, manager):
+    stop = asyncio.Event()
+    delays = []
+    light = asyncio.create_task(light_requests(stop, delays))
+    started = time.perf_counter()
+    await asyncio.gather(*(heavy_user(pool, manager, user_id) for user_id in range(1, HEAVY_USERS + 1)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await light
+    return elapsed, sorted(delays)
+
+
+def report(label, elapsed, delays):
+    p99 = delays[int(len(delays) * 0.99) - 1]
+    print(f"{label}: тяжелые запросы {elapsed:.2f} с; задержка легких p50 {statistics.median(delays) * 1000:.1f} мс, "
+          f"p99 {p99 * 1000:.1f} мс, макс {delays[-1] * 1000:.1f} мс ({len(delays)} легких запросов)")
+
+
+def main():
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = bot.TaskManager(db_path=os.path.join(directory, "tasks.db"))
+        for user_id in range(1, HEAVY_USERS + 1):
+            manager.import_tasks(user_id, (
+                (f"Задача {index}", 1700000000 + index, index % 3 + 1, 'active', "2024-01-01T00:00:00", None, 1)
+                for index in range(HEAVY_TASKS)
+            ))
+
+        report("без пула", *asyncio.run(run(bot.WorkerPool(processes=0), manager)))
+
+        pool = bot.WorkerPool(processes=WORKER_PROCESSES, timeout=120)
+        pool.start()
+        try:
+            report(f"пул из {WORKER_PROCESSES} процессов", *asyncio.run(run(pool, manager)))
+        finally:
+            pool.stop()
+
+        for shard in manager.shards:
+            shard.conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Менеджер задач на двух шардах во временном каталоге"""
+    task_manager = bot.TaskManager(db_path=str(tmp_path / "tasks.db"), shard_count=2)
+    yield task_manager
+    for shard in task_manager.shards:
+        shard.conn.close()
+
+
+def user_on_shard(index, shard_count=2):
+    """Первый user_id, который попадает в шард index"""
+    return next(user_id for user_id in range(1, 1000) if bot.user_shard_index(user_id, shard_count) == index)
@@ -0,0 +1,410 @@
+"""Нагрузочный прогон: python tests/soak.py [N]
+
+Прогоняет N синтетических обновлений (по умолчанию SOAK_UPDATES) через все
+обработчики bot.py во временной БД с постоянной частотой SOAK_RATE. Bot API и
+NewsAPI заменены заглушками, которые с вероятностью SOAK_FAILURE_RATE отвечают
+429 или таймаутом; с той же вероятностью обращение к БД получает "database is
+locked". Каждые SOAK_CHECKPOINT обновлений снимаются RSS, число блоков кучи
+Python, размеры структур по пользователям и задержки. Прогон завершается с
+кодом 1, если после разогрева (SOAK_WARMUP обновлений) что-то из этого растет
+линейно или p99 задержки заметно вырос. Для вердикта нужно не меньше 6 точек
+после разогрева, то есть при настройках по умолчанию прогон от 320 тысяч
+обновлений.
+
+Время в прогоне сжато: таймауты простоя (ограничитель, user_data, диалоги,
+кэши) уменьшены до SOAK_IDLE секунд, чтобы вытеснение успевало сработать, кэш
+часовых поясов - до числа активных пользователей, чтобы он заполнялся за
+разогрев, а общий лимит частоты снят. Обработчики и фоновые циклы берут
+менеджер задач, ограничитель и кэши из глобальных имен bot.py, поэтому прогон
+подменяет их свежими экземплярами до регистрации обработчиков.
+"""
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.error import TimedOut  # noqa: E402
+from telegram.ext import Application, ConversationHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import bot  # noqa: E402
+
+SOAK_UPDATES = 1_000_000
+SOAK_CHECKPOINT = int(os.getenv('SOAK_CHECKPOINT', '20000'))
+SOAK_USERS = int(os.getenv('SOAK_USERS', '2000'))
+# Раз в столько обновлений окно активных пользователей сдвигается на одного:
+# приходят новые пользователи, старые замолкают навсегда
+SOAK_CHURN_EVERY = int(os.getenv('SOAK_CHURN_EVERY', '20'))
+SOAK_GROUPS = 20
+SOAK_FAILURE_RATE = float(os.getenv('SOAK_FAILURE_RATE', '0.01'))
+SOAK_IDLE = 5
+# Обновления подаются с постоянной частотой, как при опросе Telegram: размер
+# структур по пользователям - это частота x SOAK_IDLE, и при подаче "как можно
+# быстрее" он зависел бы от скорости машины, а прогон не воспроизводился бы
+SOAK_RATE = int(os.getenv('SOAK_RATE', '1000'))
+SOAK_SEED = int(os.getenv('SOAK_SEED', '1'))
+# Разогрев: окно активных пользователей сменяется несколько раз, заполняются
+# кэши и страничный кэш SQLite. По замерам RSS выходит на плато к ~160 тысячам
+# обновлений; точки до конца разогрева в вердикт не входят
+SOAK_WARMUP = int(os.getenv('SOAK_WARMUP', '200000'))
+# Допустимый прирост на миллион обновлений после разогрева
+SOAK_MAX_RSS_GROWTH_MB = float(os.getenv('SOAK_MAX_RSS_GROWTH_MB', '8'))
+SOAK_MAX_BLOCK_GROWTH = int(os.getenv('SOAK_MAX_BLOCK_GROWTH', '20000'))
+SOAK_MAX_STATE_GROWTH = int(os.getenv('SOAK_MAX_STATE_GROWTH', '1000'))
+# Во сколько раз p99 задержки в конце может превышать p99 в начале
+SOAK_MAX_LATENCY_DRIFT = float(os.getenv('SOAK_MAX_LATENCY_DRIFT', '2'))
+
+SOAK_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Soak", "username": "soak_bot"}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot API без сети: отвечает правдоподобными объектами, иногда 429 или таймаутом"""
+
+    def __init__(self, rng, failure_rate):
+        self.rng = rng
+        self.failure_rate = failure_rate
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+
+        roll = self.rng.random() if api_method != 'getMe' else 1.0
+        if roll < self.failure_rate / 2:
+            raise TimedOut()
+        if roll < self.failure_rate:
+            return 429, json.dumps({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }).encode()
+
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == 'getMe':
+            return SOAK_BOT_USER
+        if api_method.startswith(('send', 'edit')) and 'chat_id' in params:
+            self._message_id += 1
+            chat_id = int(params['chat_id'])
+            return {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": SOAK_BOT_USER, "text": params.get('text', ''),
+            }
+        return True
+
+
+class FakeNewsAdapter(requests.adapters.BaseAdapter):
+    """Транспорт requests вместо NewsAPI: каждая загрузка ленты приносит пару новых статей"""
+
+    def __init__(self, rng, failure_rate):
+        super().__init__()
+        self.rng = rng
+        self.failure_rate = failure_rate
+        self.loads = 0
+
+    def send(self, request, **kwargs):
+        roll = self.rng.random()
+        if roll < self.failure_rate / 2:
+            raise requests.exceptions.ReadTimeout("NewsAPI не ответил (нагрузочный прогон)")
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if roll < self.failure_rate:
+            response.status_code = 429
+            response._content = b'{"status": "error", "code": "rateLimited"}'
+            return response
+
+        self.loads += 1
+        articles = [
+            {
+                "title": f"Новость {number} - Источник",
+                "description": "Синтетическая статья нагрузочного прогона",
+                "url": f"https://example.com/news/{number}?utm_source=soak",
+                "source": {"name": "Источник"},
+                "publishedAt": datetime.now(timezone.utc).isoformat(),
+            }
+            for number in range(self.loads * 2, self.loads * 2 + 10)
+        ]
+        response.status_code = 200
+        response._content = json.dumps({"status": "ok", "totalResults": len(articles), "articles": articles}).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def inject_db_failures(manager, rng, failure_rate):
+    """Случайные "database is locked" при входе в сессию шарда"""
+    for shard in manager.shards:
+        @contextmanager
+        def flaky_session(session=shard.session):
+            if rng.random() < failure_rate:
+                raise sqlite3.OperationalError("database is locked")
+            with session() as conn:
+                yield conn
+        shard.session = flaky_session
+
+
+def install_components(db_path, rng):
+    """Свежие менеджер, ограничитель, кэши и фоновые циклы вместо глобальных в bot.py"""
+    manager = bot.TaskManager(db_path, shard_count=bot.DB_SHARDS, lazy=True, timezone_cache_size=SOAK_USERS)
+    manager.init_database()
+    inject_db_failures(manager, rng, SOAK_FAILURE_RATE)
+    news_cache = bot.NewsFeedCache(manager, ttl=SOAK_IDLE)
+
+    bot.task_manager = manager
+    bot.rate_limiter = bot.RateLimiter(global_limit=(10**9, 10**9), idle=SOAK_IDLE)
+    bot.user_data_janitor = bot.UserDataJanitor(idle=SOAK_IDLE)
+    bot.inline_cache = bot.InlineSearchCache(ttl=SOAK_IDLE)
+    bot.news_cache = news_cache
+    bot.deadline_scheduler = bot.DeadlineScheduler(manager)
+    bot.digest_scheduler = bot.DigestScheduler(manager)
+    bot.news_scheduler = bot.NewsDeliveryScheduler(manager, news_cache, interval=SOAK_IDLE)
+    bot.list_notifier = bot.ListNotifier(manager)
+    bot.board_updater = bot.BoardUpdater(manager)
+    return (bot.deadline_scheduler, bot.digest_scheduler, bot.news_scheduler, bot.list_notifier, bot.board_updater)
+
+
+class SoakTraffic:
+    """Синтетические обновления: команды, меню, шаги диалогов, кнопки, инлайн, группы"""
+
+    PRIVATE_TEXTS = (
+        "/start", "/help", "/list", "/stats", "/lists", "/news", "/news de technology",
+        "/subscribe us business", "/unsubscribe us business", "/timezone Europe/Moscow",
+        "📋 Список задач", "✅ Выполненные", "⚙️ Управление задачами", "📰 Бизнес-новости США",
+        "📝 Добавить задачу", "Купить молоко {n}", "завтра в 9", "назад", "/cancel",
+    )
+    CALLBACKS = (
+        "manage_{task}", "complete_{task}", "snooze1h_{task}", "snooze1d_{task}", "delete_{task}",
+        "today", "tomorrow", "2", "3", "back", "back_to_list", "refresh_news:us:business",
+    )
+    GROUP_TEXTS = ("/add Задача группы {n}", "/board", "/done {task}", "/list")
+
+    def __init__(self, rng, users=SOAK_USERS, churn_every=SOAK_CHURN_EVERY, groups=SOAK_GROUPS):
+        self.rng = rng
+        self.users = users
+        self.churn_every = churn_every
+        self.groups = groups
+
+    def make(self, n):
+        user_id = 10_000 + n // self.churn_every + self.rng.randrange(self.users)
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        private = {"id": user_id, "type": "private", "first_name": user["first_name"]}
+        task = self.rng.randint(1, max(1, n // 5))
+
+        roll = self.rng.random()
+        if roll < 0.5:
+            text = self.rng.choice(self.PRIVATE_TEXTS).format(n=n)
+            return {"update_id": n, "message": self._message(n, private, user, text)}
+        if roll < 0.8:
+            data = self.rng.choice(self.CALLBACKS).format(task=task)
+            return {"update_id": n, "callback_query": {
+                "id": str(n), "from": user, "chat_instance": "soak", "data": data,
+                "message": self._message(n, private, SOAK_BOT_USER, "⚙️"),
+            }}
+        if roll < 0.9:
+            query = "Купить молоко"[:self.rng.randint(0, 13)]
+            return {"update_id": n, "inline_query": {"id": str(n), "from": user, "query": query, "offset": ""}}
+
+        # Группы сменяются с той же скоростью, что и пользователи: иначе доски
+        # копят задачи и задержка растет вместе с ними, а не из-за утечки
+        group_id = -1000 - n * self.groups // (self.users * self.churn_every) - self.rng.randrange(self.groups)
+        group = {"id": group_id, "type": "group", "title": f"Группа {-group_id}"}
+        text = self.rng.choice(self.GROUP_TEXTS).format(n=n, task=task)
+        return {"update_id": n, "message": self._message(n, group, user, text)}
+
+    @staticmethod
+    def _message(n, chat, user, text):
+        message = {"message_id": n, "date": int(time.time()), "chat": chat, "from": user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+
+class LogCounter(logging.Handler):
+    """Подсчет предупреждений и ошибок вместо их вывода"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.counts = Counter()
+
+    def emit(self, record):
+        self.counts[record.levelname] += 1
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (на Linux), иначе пиковый"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def conversations(application):
+    """Число незавершенных диалогов во всех ConversationHandler"""
+    return sum(
+        len(handler._conversations)
+        for handlers in application.handlers.values()
+        for handler in handlers
+        if isinstance(handler, ConversationHandler)
+    )
+
+
+def slope(points, key):
+    """Наклон прямой наименьших квадратов: прирост key на одно обновление"""
+    xs = [point['updates'] for point in points]
+    ys = [point[key] for point in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return (
+        sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        / sum((x - mean_x) ** 2 for x in xs)
+    )
+
+
+def verdict(checkpoints, warmup=SOAK_WARMUP):
+    """Нарушения после разогрева; контрольные точки первых warmup обновлений не учитываются"""
+    points = [point for point in checkpoints if point['updates'] > warmup]
+    if len(points) < 6:
+        return [f"после разогрева ({warmup} обновлений) меньше 6 контрольных точек, удлините прогон"]
+
+    failures = []
+    rss_growth = slope(points, 'rss') * 1_000_000 / 2**20
+    if rss_growth > SOAK_MAX_RSS_GROWTH_MB:
+        failures.append(f"RSS растет на {rss_growth:.1f} МБ на миллион обновлений")
+    block_growth = slope(points, 'blocks') * 1_000_000
+    if block_growth > SOAK_MAX_BLOCK_GROWTH:
+        failures.append(f"куча Python растет на {block_growth:.0f} блоков на миллион обновлений")
+    for key, title in (('user_data', "user_data"), ('limiter', "ограничитель"),
+                       ('inline', "инлайн-кэш"), ('conversations', "диалоги")):
+        growth = slope(points, key) * 1_000_000
+        if growth > SOAK_MAX_STATE_GROWTH:
+            failures.append(f"{title} растет на {growth:.0f} записей на миллион обновлений")
+
+    head = sorted(point['p99'] for point in points[:3])[1]
+    tail = sorted(point['p99'] for point in points[-3:])[1]
+    if tail > head * SOAK_MAX_LATENCY_DRIFT:
+        failures.append(f"p99 задержки вырос с {head * 1000:.1f} до {tail * 1000:.1f} мс")
+    return failures
+
+
+async def run(total):
+    """Нагрузочный прогон; возвращает код завершения процесса"""
+    rng = random.Random(SOAK_SEED)
+    workdir = tempfile.mkdtemp(prefix="soak-")
+    log_counter = LogCounter()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [log_counter]
+    root_logger.setLevel(logging.WARNING)
+
+    components = install_components(os.path.join(workdir, "soak.db"), rng)
+    bot.get_news_session().mount(bot.NEWS_API_URL, FakeNewsAdapter(rng, SOAK_FAILURE_RATE))
+
+    request = FakeTelegramRequest(rng, SOAK_FAILURE_RATE)
+    application = (
+        Application.builder()
+        .token("0:soak")
+        .request(request)
+        .get_updates_request(FakeTelegramRequest(rng, 0))
+        .build()
+    )
+    bot.register_handlers(application)
+
+    await application.initialize()
+    await application.start()
+    for component in components:
+        component.start(application)
+
+    print(f"🧪 Нагрузочный прогон: {total} обновлений, {SOAK_USERS} активных пользователей, "
+          f"сбоев {SOAK_FAILURE_RATE:.1%}, БД {workdir}")
+    traffic = SoakTraffic(rng)
+    checkpoints = []
+    latencies = []
+    started = time.perf_counter()
+    try:
+        for n in range(1, total + 1):
+            update = Update.de_json(traffic.make(n), application.bot)
+            update_started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - update_started)
+            # Между обновлениями цикл событий свободен: успевают фоновые циклы,
+            # отложенные задачи и таймауты диалогов. Без этого они копятся и
+            # выглядят как утечка
+            await asyncio.sleep(max(started + n / SOAK_RATE - time.perf_counter(), 0))
+            if n % SOAK_CHECKPOINT == 0 or n == total:
+                gc.collect()
+                latencies.sort()
+                point = {
+                    'updates': n,
+                    'rss': current_rss(),
+                    'blocks': sys.getallocatedblocks(),
+                    'user_data': len(application.user_data),
+                    'limiter': len(bot.rate_limiter),
+                    'inline': len(bot.inline_cache),
+                    'conversations': conversations(application),
+                    'p50': latencies[len(latencies) // 2],
+                    'p99': latencies[int(len(latencies) * 0.99)],
+                }
+                checkpoints.append(point)
+                latencies = []
+                print(
+                    f"{n:>10} | {n / (time.perf_counter() - started):>6.0f} обн/с"
+                    f" | RSS {point['rss'] / 2**20:>6.1f} МБ | блоков {point['blocks']:>8}"
+                    f" | p50 {point['p50'] * 1000:>5.2f} мс p99 {point['p99'] * 1000:>6.2f} мс"
+                    f" | user_data {point['user_data']} лимитер {point['limiter']}"
+                    f" инлайн {point['inline']} диалогов {point['conversations']}"
+                    f" | ошибок {log_counter.counts['ERROR']}"
+                )
+    finally:
+        for component in components:
+            await component.stop()
+        await application.stop()
+        await application.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    top_calls = ", ".join(f"{method} {count}" for method, count in request.calls.most_common(5))
+    print(f"Bot API: {top_calls}")
+    rate = total / (time.perf_counter() - started)
+    if rate < SOAK_RATE * 0.95:
+        print(f"⚠️ Частота {rate:.0f} обн/с ниже SOAK_RATE={SOAK_RATE}: результат зависит от скорости машины")
+    print(f"Журнал: предупреждений {log_counter.counts['WARNING']}, ошибок {log_counter.counts['ERROR']}")
+
+    failures = verdict(checkpoints)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ Память, состояние и задержки стабильны")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else SOAK_UPDATES)))
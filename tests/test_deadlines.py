@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import time
+
+import bot
+from conftest import user_on_shard
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_tick_queries_shards_off_the_loop(manager, monkeypatch):
+    first, second = user_on_shard(0), user_on_shard(1)
+    now = int(time.time())
+    manager.add_task(first, "Срок наступил", due_date=now - 60)
+    manager.add_task(second, "Тоже наступил", due_date=now - 30)
+
+    threads = []
+    for name in ("get_due_tasks", "mark_notified", "get_overdue_tasks", "get_next_deadline"):
+        method = getattr(manager, name)
+
+        def traced(*args, _method=method, **kwargs):
+            threads.append(threading.current_thread())
+            return _method(*args, **kwargs)
+
+        monkeypatch.setattr(manager, name, traced)
+
+    scheduler = bot.DeadlineScheduler(manager)
+    fake_bot = FakeBot()
+
+    async def run():
+        processed = await scheduler.tick(fake_bot)
+        delay = await scheduler._seconds_until_next()
+        return processed, delay, threading.current_thread()
+
+    processed, delay, loop_thread = asyncio.run(run())
+    assert processed == 2
+    assert sorted(chat_id for chat_id, _ in fake_bot.sent) == sorted([first, second])
+    assert 0 < delay <= scheduler.max_sleep
+    assert len(threads) == 4 and loop_thread not in threads
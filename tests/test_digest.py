@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import bot
+
+
+def digest_users(manager, bucket, timezones=(bot.DEFAULT_TIMEZONE,)):
+    return sorted(row[0] for row in manager.get_digest_rows(list(timezones), bucket, time.time() + 3600))
+
+
+def test_digest_rows_follow_bucket_and_timezone(manager):
+    manager.add_task(61, "Высокий приоритет", priority=3)
+    manager.add_task(121, "Тоже корзина 1", priority=3)
+    manager.add_task(62, "Другая корзина", priority=3)
+    manager.set_user_timezone(121, "Asia/Tokyo")
+
+    assert digest_users(manager, 1) == [61]
+    assert digest_users(manager, 1, ("Asia/Tokyo",)) == [121]
+    assert digest_users(manager, 2) == [62]
+
+
+def test_digest_slot_is_backfilled_for_existing_tasks(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    manager = bot.TaskManager(db_path=path)
+    manager.add_task(61, "Задача", priority=3)
+    with manager.shards[0].session() as conn:
+        conn.execute("DROP TABLE digest_slots")
+        conn.commit()
+        conn.close()
+
+    reopened = bot.TaskManager(db_path=path)
+    assert digest_users(reopened, 1) == [61]
+    reopened.shards[0].conn.close()
+
+
+def test_digest_query_uses_slot_index(manager):
+    with manager.shards[0].session() as conn:
+        plan = " ".join(row[3] for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT d.user_id FROM digest_slots d
+            CROSS JOIN tasks t ON t.user_id = d.user_id AND t.status = 'active'
+            WHERE d.bucket = ? AND d.timezone IN (?)
+        ''', (1, bot.DEFAULT_TIMEZONE)))
+    assert "idx_digest_slots_bucket" in plan
+    assert "SCAN t" not in plan
+
+
+def test_send_interval_fits_bucket_into_window():
+    assert bot.digest_send_interval(10) == 1 / bot.DIGEST_RATE_PER_SECOND
+    assert round(1667 * bot.digest_send_interval(1667), 6) <= bot.DIGEST_SEND_WINDOW
+    assert bot.digest_send_interval(5000) == 1 / bot.DIGEST_MAX_RATE_PER_SECOND
+
+
+def test_send_bucket_paces_without_drift(manager, monkeypatch):
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id, text):
+            await asyncio.sleep(0.01)
+            self.sent.append(chat_id)
+
+    moment = time.time()
+    user_ids = [61 + bucket_round * bot.DIGEST_BUCKETS for bucket_round in range(20)]
+    for user_id in user_ids:
+        manager.add_task(user_id, "Срочно", priority=3)
+
+    scheduler = bot.DigestScheduler(manager, pacer=bot.SendPacer(1000))
+    monkeypatch.setattr(scheduler, "_timezones_by_bucket", lambda _: _async({1: [bot.DEFAULT_TIMEZONE]}))
+    monkeypatch.setattr(bot, "DIGEST_SEND_WINDOW", 0.2)
+    monkeypatch.setattr(bot, "DIGEST_MAX_RATE_PER_SECOND", 1000)
+
+    fake = FakeBot()
+    started = time.monotonic()
+    assert asyncio.run(scheduler.send_bucket(fake, moment)) == len(user_ids)
+    # 20 отправок по 10 мс укладываются в окно, а не в 20 * (10 мс + пауза)
+    assert time.monotonic() - started < 0.2 + 0.1
+    assert sorted(fake.sent) == user_ids
+
+
+def test_bulk_senders_share_one_pace():
+    pacer = bot.SendPacer(rate=50)
+    stamps = []
+
+    async def sender(count):
+        for _ in range(count):
+            await pacer.wait()
+            stamps.append(time.monotonic())
+
+    async def scenario():
+        # Сводки, ленты и списки рассылаются одновременно, но вместе - не быстрее rate
+        started = time.monotonic()
+        await asyncio.gather(sender(10), sender(10), sender(10))
+        return started
+
+    started = asyncio.run(scenario())
+    stamps.sort()
+    assert len(stamps) == 30
+    # k-я отправка (из любого рассыльщика) - не раньше ее слота
+    assert all(stamp - started >= position / 50 - 0.005 for position, stamp in enumerate(stamps))
+
+
+async def _async(value):
+    return value
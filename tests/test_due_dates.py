@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import pytest
+
+import bot
+
+# Среда, 15 мая 2024, 14:30 (локальное время пользователя)
+NOW = datetime(2024, 5, 15, 14, 30, 45)
+
+CORPUS = [
+    # Строгий формат и даты
+    ("2024-12-31 23:59", datetime(2024, 12, 31, 23, 59)),
+    ("2024-06-01", datetime(2024, 6, 1, 23, 59)),
+    ("31.12", datetime(2024, 12, 31, 23, 59)),
+    ("01.05", datetime(2025, 5, 1, 23, 59)),
+    ("31.12 18:00", datetime(2024, 12, 31, 18, 0)),
+    ("31.12.2025 9:15", datetime(2025, 12, 31, 9, 15)),
+    ("31/12/25", datetime(2025, 12, 31, 23, 59)),
+    ("1 июня", datetime(2024, 6, 1, 23, 59)),
+    ("1 июня в 12", datetime(2024, 6, 1, 12, 0)),
+    ("15 января", datetime(2025, 1, 15, 23, 59)),
+    ("june 1", datetime(2024, 6, 1, 23, 59)),
+    ("june 1 at 7 pm", datetime(2024, 6, 1, 19, 0)),
+    # Дни
+    ("сегодня", datetime(2024, 5, 15, 23, 59)),
+    ("today 18:00", datetime(2024, 5, 15, 18, 0)),
+    ("завтра", datetime(2024, 5, 16, 23, 59)),
+    ("Завтра в 9", datetime(2024, 5, 16, 9, 0)),
+    ("завтра в 9 ч", datetime(2024, 5, 16, 9, 0)),
+    ("завтра 9h", datetime(2024, 5, 16, 9, 0)),
+    ("завтра в 9 вечера", datetime(2024, 5, 16, 21, 0)),
+    ("tomorrow 9pm", datetime(2024, 5, 16, 21, 0)),
+    ("tomorrow at 7 am", datetime(2024, 5, 16, 7, 0)),
+    ("послезавтра в 10:30", datetime(2024, 5, 17, 10, 30)),
+    # Дни недели: тот же день недели - через неделю
+    ("в пятницу", datetime(2024, 5, 17, 23, 59)),
+    ("next friday 18:00", datetime(2024, 5, 17, 18, 0)),
+    ("в среду", datetime(2024, 5, 22, 23, 59)),
+    ("monday", datetime(2024, 5, 20, 23, 59)),
+    ("в воскресенье в 10 утра", datetime(2024, 5, 19, 10, 0)),
+    ("sat 11:00", datetime(2024, 5, 18, 11, 0)),
+    ("в следующий вторник", datetime(2024, 5, 21, 23, 59)),
+    # Только время: прошедшее - завтра
+    ("в 18:00", datetime(2024, 5, 15, 18, 0)),
+    ("18:00", datetime(2024, 5, 15, 18, 0)),
+    ("в 3 дня", datetime(2024, 5, 15, 15, 0)),
+    ("3 дня", datetime(2024, 5, 15, 15, 0)),
+    ("в 2 дня", datetime(2024, 5, 16, 14, 0)),
+    ("в 9", datetime(2024, 5, 16, 9, 0)),
+    ("в 9 ч", datetime(2024, 5, 16, 9, 0)),
+    ("9 ч", datetime(2024, 5, 16, 9, 0)),
+    ("в 9 ч вечера", datetime(2024, 5, 15, 21, 0)),
+    ("в полдень", datetime(2024, 5, 16, 12, 0)),
+    ("в полночь", datetime(2024, 5, 16, 0, 0)),
+    ("noon", datetime(2024, 5, 16, 12, 0)),
+    ("12 am", datetime(2024, 5, 16, 0, 0)),
+    ("12 pm", datetime(2024, 5, 16, 12, 0)),
+    ("в 11 вечера", datetime(2024, 5, 15, 23, 0)),
+    # Относительные сдвиги - от текущего момента
+    ("через 3 дня", datetime(2024, 5, 18, 14, 30)),
+    ("через 3 дня 5 часов", datetime(2024, 5, 18, 19, 30)),
+    ("через 3 дня в 9", datetime(2024, 5, 18, 9, 0)),
+    ("через 2 часа", datetime(2024, 5, 15, 16, 30)),
+    ("через 2 ч", datetime(2024, 5, 15, 16, 30)),
+    ("через 3 дня в 9 ч", datetime(2024, 5, 18, 9, 0)),
+    ("завтра через 2 часа", datetime(2024, 5, 16, 16, 30)),
+    ("через час", datetime(2024, 5, 15, 15, 30)),
+    ("через полчаса", datetime(2024, 5, 15, 15, 0)),
+    ("через 15 минут", datetime(2024, 5, 15, 14, 45)),
+    ("через 1 час 30 минут", datetime(2024, 5, 15, 16, 0)),
+    ("через неделю", datetime(2024, 5, 22, 14, 30)),
+    ("через 2 недели", datetime(2024, 5, 29, 14, 30)),
+    ("через месяц", datetime(2024, 6, 15, 14, 30)),
+    ("через 2 месяца в 8 утра", datetime(2024, 7, 15, 8, 0)),
+    ("in 2 hours", datetime(2024, 5, 15, 16, 30)),
+    ("in a week", datetime(2024, 5, 22, 14, 30)),
+    ("in 3 days", datetime(2024, 5, 18, 14, 30)),
+    ("in 1 month", datetime(2024, 6, 15, 14, 30)),
+    ("in 10 mins", datetime(2024, 5, 15, 14, 40)),
+]
+
+INVALID = [
+    "",
+    "когда-нибудь",
+    "someday",
+    "25:00",
+    "в 13 вечера",
+    "завтра в 9 blah",
+    "32.13",
+    "через",
+]
+
+
+@pytest.mark.parametrize("phrase, expected", CORPUS)
+def test_corpus(phrase, expected):
+    assert bot.parse_due_date(phrase, NOW) == expected
+
+
+@pytest.mark.parametrize("phrase", INVALID)
+def test_invalid_phrases(phrase):
+    with pytest.raises(ValueError):
+        bot.parse_due_date(phrase, NOW)
+
+
+def test_month_shift_clamps_to_month_end():
+    now = datetime(2024, 1, 31, 10, 0)
+    assert bot.parse_due_date("через месяц", now) == datetime(2024, 2, 29, 10, 0)
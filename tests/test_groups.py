@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+import bot
+
+CHAT_ID = -100
+
+
+class FakeBot:
+    def __init__(self, edit_error=None):
+        self.calls = []
+        self.edit_error = edit_error
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(("send", chat_id))
+        return SimpleNamespace(message_id=7)
+
+    async def pin_chat_message(self, chat_id, message_id, disable_notification=False):
+        self.calls.append(("pin", chat_id))
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.calls.append(("edit", chat_id))
+        if self.edit_error:
+            raise BadRequest(self.edit_error)
+
+
+def board_updater(manager, fake):
+    updater = bot.BoardUpdater(manager)
+    updater._bot = fake
+    return updater
+
+
+def test_board_is_not_posted_without_opt_in(manager):
+    manager.add_task(CHAT_ID, "Задача группы")
+    fake = FakeBot()
+    asyncio.run(board_updater(manager, fake).refresh(CHAT_ID))
+    assert fake.calls == []
+
+
+def test_posted_board_is_edited(manager):
+    fake = FakeBot()
+    updater = board_updater(manager, fake)
+    asyncio.run(updater.post(CHAT_ID))
+    manager.add_task(CHAT_ID, "Задача группы")
+    asyncio.run(updater.refresh(CHAT_ID))
+    assert fake.calls == [("send", CHAT_ID), ("pin", CHAT_ID), ("edit", CHAT_ID)]
+
+
+def test_deleted_board_is_forgotten(manager):
+    manager.set_chat_board(CHAT_ID, 7)
+    manager.add_task(CHAT_ID, "Задача группы")
+    fake = FakeBot(edit_error="Message to edit not found")
+    asyncio.run(board_updater(manager, fake).refresh(CHAT_ID))
+    assert fake.calls == [("edit", CHAT_ID)]
+    assert manager.get_chat_board(CHAT_ID) is None
+
+
+def document_update(chat_type, replies):
+    async def reply_text(text):
+        replies.append(text)
+
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=CHAT_ID if chat_type != "private" else 1, type=chat_type),
+        effective_user=SimpleNamespace(id=1),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+
+def test_import_hint_only_in_private_chats():
+    for chat_type, expected in (("private", 1), ("group", 0), ("supergroup", 0)):
+        replies = []
+        context = SimpleNamespace(user_data={})
+        asyncio.run(bot.handle_import_file(document_update(chat_type, replies), context))
+        assert len(replies) == expected, chat_type
@@ -0,0 +1,117 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+import bot
+
+
+def export_text(manager, user_id, fmt):
+    buffer = io.StringIO(newline='')
+    count = bot.write_tasks_export(manager.iter_user_tasks(user_id), fmt, buffer)
+    return buffer.getvalue(), count
+
+
+def import_text(manager, user_id, text, fmt):
+    stats = {'skipped': 0}
+    imported = manager.import_tasks(user_id, bot.read_tasks_import(io.StringIO(text, newline=''), fmt, stats))
+    return imported, stats['skipped']
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_round_trip_keeps_tasks(manager, fmt):
+    manager.add_task(1, "Отчет, с запятой", due_date=1893456000, priority=3)
+    manager.add_task(1, 'Кавычки "внутри"', recurrence="daily")
+    done = manager.add_task(1, "Готово")
+    manager.complete_task(done, 1)
+
+    text, count = export_text(manager, 1, fmt)
+    assert count == 3
+    assert import_text(manager, 2, text, fmt) == (3, 0)
+
+    # Все, кроме id, переносится как есть (включая created_at)
+    source = sorted(row[1:] for row in manager.iter_user_tasks(1))
+    copied = sorted(row[1:] for row in manager.iter_user_tasks(2))
+    assert copied == source
+
+
+def test_invalid_lines_are_skipped():
+    lines = [
+        {"text": "Нормальная", "priority": 2},
+        {"text": "", "priority": 2},
+        {"text": "Плохой приоритет", "priority": 7},
+        {"text": "Плохой статус", "status": "deleted"},
+        {"text": "Плохой срок", "due_date": "завтра"},
+        {"text": "Плохое повторение", "recurrence": "иногда"},
+    ]
+    text = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n{не json\n\n"
+    stats = {'skipped': 0}
+    records = list(bot.read_tasks_import(io.StringIO(text), 'jsonl', stats))
+    assert [record[0] for record in records] == ["Нормальная"]
+    assert stats['skipped'] == 6
+
+
+def test_due_date_formats():
+    assert bot._parse_import_due_date("1700000000") == 1700000000
+    assert bot._parse_import_due_date("2024-01-01T00:00:00Z") == 1704067200
+    assert bot._parse_import_due_date("2024-01-01T03:00:00+03:00") == 1704067200
+    assert bot._parse_import_due_date("2024-01-01T00:00:00") == 1704067200
+    assert bot._parse_import_due_date("") is None
+
+
+def test_past_due_dates_are_not_reminded():
+    text = "text,due_date\nСтарая,2000-01-01T00:00:00Z\nБудущая,2999-01-01T00:00:00Z\n"
+    records = list(bot.read_tasks_import(io.StringIO(text), 'csv', {'skipped': 0}))
+    assert [record[6] for record in records] == [1, 0]
+
+
+def test_import_commits_in_batches(manager):
+    records = ((f"Задача {index}", None, 2, 'active', "2024-01-01T00:00:00", None, 0) for index in range(25))
+    assert manager.import_tasks(1, records, batch_size=10) == 25
+    assert len(manager.get_user_tasks(1)) == 25
+    assert manager.get_stats(1, 1)  # агрегаты обновлены без ошибок
+
+
+def test_import_is_streamed(manager):
+    consumed = []
+
+    def records():
+        for index in range(30):
+            consumed.append(index)
+            yield (f"Задача {index}", None, 2, 'active', "2024-01-01T00:00:00", None, 0)
+
+    iterator = records()
+    # До первой пачки генератор читается ровно на batch_size строк
+    original = manager._insert_import_batch
+    seen = []
+
+    def insert(batch):
+        seen.append(len(consumed))
+        return original(batch)
+
+    manager._insert_import_batch = insert
+    manager.import_tasks(1, iterator, batch_size=10)
+    assert seen == [10, 20, 30]
+
+
+class NullFile:
+    """Файл, который ничего не хранит: память экспорта не зависит от вывода"""
+
+    def write(self, data):
+        return len(data)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_export_memory_does_not_grow_with_size(manager, fmt):
+    def peak_for(user_id, count):
+        manager.import_tasks(user_id, ((f"Задача {index}", None, 2, 'active', "2024-01-01T00:00:00", None, 0)
+                                       for index in range(count)))
+        tracemalloc.start()
+        bot.write_tasks_export(manager.iter_user_tasks(user_id, chunk_size=500), fmt, NullFile())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    small, large = peak_for(1, 2000), peak_for(2, 20000)
+    assert large < small + 64 * 1024
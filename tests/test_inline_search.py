@@ -0,0 +1,88 @@
+import asyncio
+
+import bot
+
+
+def task(task_id, text):
+    return (task_id, 1, text, None, 2, 'active', "2024-01-01T00:00:00")
+
+
+TASKS = [task(1, "Купить молоко"), task(2, "Купить хлеб"), task(3, "Позвонить маме"), task(4, "купание")]
+
+
+def test_search_uses_status_text_index(manager):
+    manager.add_task(1, "Купить молоко")
+    done = manager.add_task(1, "Купить хлеб")
+    manager.complete_task(done, 1)
+    manager.add_task(1, "Позвонить маме")
+
+    assert [row[2] for row in manager.search_tasks(1, bot.search_prefixes("куп"), 10)] == ["Купить молоко"]
+    with manager._user_session(1) as conn:
+        plan = " ".join(row[3] for row in conn.execute(f'''
+            EXPLAIN QUERY PLAN
+            SELECT {bot.TASK_COLUMNS} FROM tasks
+            WHERE user_id = ? AND status = 'active' AND text >= ? AND text < ?
+            ORDER BY text LIMIT ?
+        ''', (1, "Куп", "Куп\U0010ffff", 10)))
+        dropped = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_tasks_text'").fetchone()
+    assert "idx_tasks_status_text (user_id=? AND status=? AND text>? AND text<?)" in plan
+    assert "TEMP B-TREE" not in plan
+    assert dropped is None
+
+
+def test_longer_query_is_narrowed_from_complete_prefix():
+    cache = bot.InlineSearchCache()
+    cache.put(1, "", TASKS, complete=True)
+    assert [row[0] for row in cache.get(1, "куп")] == [1, 2, 4]
+    assert [row[0] for row in cache.get(1, "Купить х")] == [2]
+    # Суженный ответ сохранен как полный и сам годится для следующих букв
+    assert cache._users[1][1]["Купить х"][1]
+
+
+def test_truncated_prefix_is_not_narrowed():
+    cache = bot.InlineSearchCache()
+    cache.put(1, "Куп", TASKS[:1], complete=False)
+    assert cache.get(1, "Купить") is None
+    assert cache.get(1, "Куп") == TASKS[:1]
+    assert cache.get(2, "Куп") is None
+
+
+def test_user_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    cache = bot.InlineSearchCache(ttl=15)
+    cache.put(1, "", TASKS, complete=True)
+    cache.put(2, "", TASKS, complete=True)
+
+    now[0] += 10
+    assert cache.get(1, "куп") is not None
+    now[0] += 6
+    # Набор живет ttl с момента создания, обращения его не продлевают
+    assert cache.get(1, "куп") is None and cache.get(1, "") is None
+    cache.put(3, "", TASKS, complete=True)
+    assert list(cache._users) == [3]
+
+
+def test_users_and_queries_are_capped():
+    cache = bot.InlineSearchCache(max_users=2, max_queries=2)
+    for user_id in (1, 2, 3):
+        cache.put(user_id, "", TASKS, complete=True)
+    assert list(cache._users) == [2, 3]
+    for query in ("а", "б", "в"):
+        cache.put(3, query, [], complete=True)
+    assert list(cache._users[3][1]) == ["б", "в"]
+
+
+def test_debounce_lets_only_last_keystroke_through(monkeypatch):
+    monkeypatch.setattr(bot, "INLINE_DEBOUNCE", 0.05)
+    cache = bot.InlineSearchCache()
+
+    async def typing():
+        first = asyncio.create_task(cache.debounce(1, "q1"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(cache.debounce(1, "q2"))
+        other = asyncio.create_task(cache.debounce(2, "q3"))
+        return await asyncio.gather(first, second, other)
+
+    assert asyncio.run(typing()) == [False, True, True]
+    assert not cache._pending
@@ -0,0 +1,25 @@
+import bot
+
+
+def test_static_keyboard_dict_is_built_once():
+    markup = bot.get_main_menu()
+    assert markup is bot.get_main_menu()
+    assert markup.to_dict() is markup.to_dict()
+
+
+def test_task_button_is_rebuilt_for_new_version(manager):
+    task_id = manager.add_task(1, "Купить молоко")
+    before = bot.get_task_management_keyboard(manager.get_user_tasks(1, with_version=True))
+    manager.update_task(task_id, 1, text="Купить хлеб")
+    after = bot.get_task_management_keyboard(manager.get_user_tasks(1, with_version=True))
+
+    assert "молоко" in before.inline_keyboard[0][0].text
+    assert "хлеб" in after.inline_keyboard[0][0].text
+
+
+def test_task_button_is_reused_for_same_version(manager):
+    manager.add_task(1, "Купить молоко")
+    tasks = manager.get_user_tasks(1, with_version=True)
+    first = bot.get_task_management_keyboard(tasks)
+    second = bot.get_task_management_keyboard(tasks)
+    assert first.inline_keyboard[0][0] is second.inline_keyboard[0][0]
@@ -0,0 +1,92 @@
+import asyncio
+
+import bot
+
+FEED = bot.DEFAULT_FEED
+
+
+def article(title, url):
+    return {"title": title, "url": url, "source": {"name": "Источник"}, "description": "", "publishedAt": ""}
+
+
+def fetch_sequence(manager, monkeypatch, *fetches):
+    """Кэш без TTL, которому NewsAPI по очереди отдает fetches"""
+    responses = iter(fetches)
+    monkeypatch.setattr(bot, "fetch_news", lambda feed: next(responses))
+    return bot.NewsFeedCache(manager, ttl=0)
+
+
+def load(cache):
+    return asyncio.run(cache.get(FEED))
+
+
+def seen_rows(manager):
+    with manager.shards[0].session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM news_seen").fetchone()[0]
+
+
+def test_fingerprints_ignore_tracking_params_and_source_suffix():
+    first = article("Рынки растут - Reuters", "https://www.example.com/markets/?utm_source=x&id=1")
+    second = article("Рынки  растут!", "https://example.com/markets?id=1&fbclid=abc")
+    assert bot.article_fingerprints(first) == bot.article_fingerprints(second)
+    assert bot.article_fingerprints(article("", "")) == ()
+
+
+def test_same_article_is_not_new_on_next_fetch(manager, monkeypatch):
+    old = article("Рынки растут - Reuters", "https://example.com/markets")
+    cache = fetch_sequence(
+        manager, monkeypatch,
+        [old],
+        [
+            # Тот же URL с метками и другой заголовок, тот же заголовок с другим URL и новая статья
+            article("Рынки растут: подробности", "https://example.com/markets?utm_campaign=push"),
+            article("Рынки растут - CNN", "https://cnn.example.com/markets"),
+            article("Нефть дешевеет", "https://example.com/oil"),
+        ],
+    )
+
+    first = load(cache)
+    second = load(cache)
+    assert second.stamp > first.stamp
+    assert second.first_seen[:2] == [first.stamp, first.stamp]
+    assert [fresh["title"] for fresh in second.new_since(first.stamp)] == ["Нефть дешевеет"]
+
+
+def test_refresh_shows_only_articles_after_watermark(manager, monkeypatch):
+    old = article("Рынки растут", "https://example.com/markets")
+    fresh = article("Нефть дешевеет", "https://example.com/oil")
+    cache = fetch_sequence(manager, monkeypatch, [old], [old, fresh], [old, fresh])
+    user_id = 61
+
+    first = load(cache)
+    assert first.delta_text(manager.get_news_watermark(user_id, FEED)) == first.text
+    manager.set_news_watermarks(FEED, [user_id], first.stamp)
+
+    second = load(cache)
+    text = second.delta_text(manager.get_news_watermark(user_id, FEED))
+    assert "Нефть дешевеет" in text and "Рынки растут" not in text
+    manager.set_news_watermarks(FEED, [user_id], second.stamp)
+
+    assert load(cache).delta_text(manager.get_news_watermark(user_id, FEED)) is None
+
+
+def test_ttl_eviction_keeps_news_index_bounded(manager):
+    day = 24 * 3600 * 1000
+    for fetch in range(30):
+        stamp = (fetch + 1) * day
+        articles = [article(f"Статья {fetch}-{index}", f"https://example.com/{fetch}/{index}") for index in range(10)]
+        manager.record_feed_articles(FEED, [bot.article_fingerprints(item) for item in articles], stamp)
+        manager.set_news_watermarks(FEED, [fetch + 1], stamp)
+        # Как в NewsDeliveryScheduler: перед рассылкой удаляется все старше TTL (здесь 7 дней)
+        manager.evict_news_index(stamp - 7 * day)
+        assert seen_rows(manager) <= 8 * 10 * 2
+
+    watermarks = 0
+    for shard in manager.shards:
+        with shard.session() as conn:
+            watermarks += conn.execute("SELECT COUNT(*) FROM news_watermarks").fetchone()[0]
+    assert watermarks == 8
+
+    # Статья, давно выпавшая из индекса, снова считается новой
+    comeback = [bot.article_fingerprints(article("Статья 0-0", "https://example.com/0/0"))]
+    assert manager.record_feed_articles(FEED, comeback, 31 * day) == [31 * day]
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from telegram.ext import Application, CommandHandler
+
+import bot
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+async def busy_command(update, context):
+    spin(context)
+
+
+def test_sampler_collapses_busy_thread_stacks():
+    application = Application.builder().token("0:test").build()
+    application.add_handler(CommandHandler("busy", busy_command))
+    profiler = bot.SamplingProfiler(interval=0.001)
+    profiler.watch_handlers(application)
+
+    stop = threading.Event()
+    worker = threading.Thread(target=lambda: asyncio.run(busy_command(None, stop)), name="busy-thread")
+    worker.start()
+    profiler._start_sampling()
+    time.sleep(0.3)
+    profiler._stop_sampling()
+    stop.set()
+    worker.join()
+
+    lines = profiler.collapsed().splitlines()
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    busy = {stack: count for stack, count in stacks.items() if stack.startswith("busy-thread;")}
+    assert profiler.samples > 0 and busy
+    assert sum(stacks.values()) >= sum(busy.values())
+    # Корень стека - поток, дальше вызовы от внешнего к внутреннему
+    assert all("busy_command (test_profiler.py);spin (test_profiler.py)" in stack for stack in busy)
+    assert profiler.handlers["busy_command (test_profiler.py)"] == sum(busy.values())
+    assert "🔥 Профиль" in profiler.summary() and "busy_command" in profiler.summary()
+
+
+def test_handlers_are_detected_by_registered_callbacks():
+    application = Application.builder().token("0:test").build()
+    bot.register_handlers(application)
+    profiler = bot.SamplingProfiler()
+    profiler.watch_handlers(application)
+
+    # Обычный обработчик и шаг диалога - обработчики
+    assert profiler._label(bot.list_tasks.__code__)[1] == 'handler'
+    assert profiler._label(bot.add_task_priority.__code__)[1] == 'handler'
+    assert profiler._label(bot.TaskManager.add_task.__code__)[1] == 'method'
+    # Функция с теми же аргументами, вызванная из обработчика меню, сама обработчиком не считается
+    assert profiler._label(bot.handle_menu_selection.__code__)[1] == 'handler'
+    assert profiler._label(bot.show_business_news.__code__)[1] is None
+
+
+def profile_update(user_id, replies):
+    async def reply_text(text):
+        replies.append(text)
+
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+
+def test_profile_command_is_admin_only(monkeypatch):
+    started = []
+    monkeypatch.setattr(bot, "ADMIN_IDS", {1})
+    monkeypatch.setattr(bot.profiler, "begin", lambda application, chat_ids, seconds: started.append(seconds) or True)
+
+    replies = []
+    context = SimpleNamespace(args=["5"], application=None)
+    asyncio.run(bot.profile_command(profile_update(2, replies), context))
+    assert started == [] and replies[-1].startswith("⛔")
+
+    asyncio.run(bot.profile_command(profile_update(1, replies), SimpleNamespace(args=["abc"], application=None)))
+    assert started == [] and "Использование" in replies[-1]
+
+    asyncio.run(bot.profile_command(profile_update(1, replies), context))
+    asyncio.run(bot.profile_command(profile_update(1, replies), SimpleNamespace(args=["99999"], application=None)))
+    assert started == [5, bot.PROFILE_MAX_SECONDS]
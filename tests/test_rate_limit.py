@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+LIMITS = {'list': (2, 1), 'mutation': (3, 0.5)}
+
+
+def make_update(text=None, data=None, document=None, inline=False):
+    return SimpleNamespace(
+        callback_query=SimpleNamespace(data=data) if data is not None else None,
+        inline_query=SimpleNamespace(query="") if inline else None,
+        message=SimpleNamespace(text=text, document=document) if text is not None or document else None,
+    )
+
+
+def test_bucket_allows_burst_then_refills():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(100, 100))
+    t0 = limiter.global_bucket.updated
+    assert [limiter.allow(1, 'list', now=t0) for _ in range(3)] == [True, True, False]
+    assert not limiter.allow(1, 'list', now=t0 + 0.5)
+    assert limiter.allow(1, 'list', now=t0 + 1.5)
+    # Пополнение не превышает емкость ведра
+    assert [limiter.allow(1, 'list', now=t0 + 100) for _ in range(3)] == [True, True, False]
+
+
+def test_classes_and_users_have_own_buckets():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(100, 100))
+    t0 = limiter.global_bucket.updated
+    assert limiter.allow(1, 'list', now=t0) and limiter.allow(1, 'list', now=t0)
+    assert not limiter.allow(1, 'list', now=t0)
+    assert limiter.allow(1, 'mutation', now=t0)
+    assert limiter.allow(2, 'list', now=t0)
+
+
+def test_global_bucket_refunds_user_token():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(1, 1))
+    t0 = limiter.global_bucket.updated
+    assert limiter.allow(1, 'list', now=t0)
+    # Общее ведро пусто: запрос отклонен, но токен пользователя возвращен
+    assert not limiter.allow(2, 'list', now=t0)
+    assert limiter._users[2].buckets['list'].tokens == 2
+    assert limiter.allow(2, 'list', now=t0 + 1)
+    assert limiter._users[2].buckets['list'].tokens == 1
+
+
+def test_idle_users_are_evicted():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(100, 100), idle=10)
+    t0 = limiter.global_bucket.updated
+    limiter.allow(1, 'list', now=t0)
+    limiter.allow(2, 'list', now=t0 + 5)
+    limiter.allow(3, 'list', now=t0 + 12)
+    assert list(limiter._users) == [2, 3]
+
+
+def test_least_recently_seen_user_is_evicted_at_cap():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(100, 100), max_users=3)
+    t0 = limiter.global_bucket.updated
+    for user_id in (1, 2, 3):
+        limiter.allow(user_id, 'list', now=t0)
+    limiter.allow(1, 'list', now=t0 + 1)
+    limiter.allow(4, 'list', now=t0 + 2)
+    assert len(limiter) == 3
+    assert list(limiter._users) == [3, 1, 4]
+
+
+def test_throttle_notice_is_rate_limited():
+    limiter = bot.RateLimiter(limits=LIMITS, global_limit=(100, 100))
+    t0 = limiter.global_bucket.updated
+    assert not limiter.should_notify(1, now=t0 + 100)
+    limiter.allow(1, 'list', now=t0 + 100)
+    assert limiter.should_notify(1, now=t0 + 100)
+    assert not limiter.should_notify(1, now=t0 + 100 + bot.THROTTLE_NOTICE_INTERVAL - 1)
+    assert limiter.should_notify(1, now=t0 + 100 + bot.THROTTLE_NOTICE_INTERVAL)
+
+
+@pytest.mark.parametrize("update, expected", [
+    (make_update(text="/news"), 'news'),
+    (make_update(text="/list@TaskBot extra"), 'list'),
+    (make_update(text="/start"), 'other'),
+    (make_update(text="/add"), 'mutation'),
+    (make_update(text="📋 Список задач"), 'list'),
+    (make_update(text="Купить молоко"), 'mutation'),
+    (make_update(data="refresh_news"), 'news'),
+    (make_update(data="manage_5"), 'list'),
+    (make_update(data="back_to_list"), 'list'),
+    (make_update(data="complete:5"), 'mutation'),
+    (make_update(document=SimpleNamespace(file_name="tasks.csv")), 'mutation'),
+    (make_update(inline=True), 'inline'),
+])
+def test_classify_update(update, expected):
+    assert bot.classify_update(update) == expected
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+
+import bot
+
+# Среда, 15 мая 2024, 07:00
+NOW = datetime(2024, 5, 15, 7, 0)
+
+
+def first_due(rule, now=NOW, tz_name="UTC"):
+    return bot.to_local(bot.next_occurrence(rule, tz_name=tz_name, now=now), tz_name)
+
+
+def next_due(rule, due, tz_name="UTC", now=NOW):
+    epoch = bot.next_occurrence(rule, bot.to_epoch(due, tz_name), tz_name, now=now)
+    return bot.to_local(epoch, tz_name)
+
+
+@pytest.mark.parametrize("rule, expected", [
+    # Сегодняшнее вхождение еще впереди - первый срок сегодня
+    ("cron:0 9 * * 1-5", datetime(2024, 5, 15, 9, 0)),
+    ("cron:*/30 * * * *", datetime(2024, 5, 15, 7, 30)),
+    ("daily", datetime(2024, 5, 15, 23, 59, 59)),
+    ("weekly:wed", datetime(2024, 5, 15, 23, 59, 59)),
+    ("monthly:15", datetime(2024, 5, 15, 23, 59, 59)),
+    # Сегодня не подходит
+    ("weekly:thu", datetime(2024, 5, 16, 23, 59, 59)),
+    ("cron:0 6 * * *", datetime(2024, 5, 16, 6, 0)),
+])
+def test_first_occurrence_includes_rest_of_today(rule, expected):
+    assert first_due(rule) == expected
+
+
+@pytest.mark.parametrize("rule, due, expected", [
+    ("daily", datetime(2024, 5, 15, 9, 0), datetime(2024, 5, 16, 9, 0)),
+    ("weekly:mon,fri", datetime(2024, 5, 17, 9, 0), datetime(2024, 5, 20, 9, 0)),
+    ("weekly:0,4", datetime(2024, 5, 20, 9, 0), datetime(2024, 5, 24, 9, 0)),
+    # Конец месяца: 31-е в коротких месяцах - последний день
+    ("monthly:31", datetime(2024, 1, 31, 10, 0), datetime(2024, 2, 29, 10, 0)),
+    ("monthly:31", datetime(2024, 2, 29, 10, 0), datetime(2024, 3, 31, 10, 0)),
+    ("monthly:30", datetime(2023, 1, 30, 10, 0), datetime(2023, 2, 28, 10, 0)),
+])
+def test_next_after_due_date(rule, due, expected):
+    assert next_due(rule, due, now=datetime(2020, 1, 1)) == expected
+
+
+def test_overdue_task_skips_to_next_future_slot():
+    due = datetime(2024, 5, 1, 9, 0)
+    assert next_due("daily", due) == datetime(2024, 5, 15, 9, 0)
+
+
+@pytest.mark.parametrize("rule, after, expected", [
+    ("cron:15 */6 * * *", datetime(2024, 5, 15, 6, 15), datetime(2024, 5, 15, 12, 15)),
+    ("cron:0 9-11 * * *", datetime(2024, 5, 15, 11, 0), datetime(2024, 5, 16, 9, 0)),
+    ("cron:0 12 1,15 * *", datetime(2024, 5, 15, 12, 0), datetime(2024, 6, 1, 12, 0)),
+    ("cron:0 8 * 2 *", datetime(2024, 5, 15), datetime(2025, 2, 1, 8, 0)),
+    # Воскресенье - и 0, и 7
+    ("cron:0 10 * * 0", datetime(2024, 5, 15), datetime(2024, 5, 19, 10, 0)),
+    ("cron:0 10 * * 7", datetime(2024, 5, 15), datetime(2024, 5, 19, 10, 0)),
+    # Ограничены и день месяца, и день недели: достаточно любого
+    ("cron:0 10 20 * 5", datetime(2024, 5, 15), datetime(2024, 5, 17, 10, 0)),
+    ("cron:0 10 16 * 5", datetime(2024, 5, 15), datetime(2024, 5, 16, 10, 0)),
+])
+def test_cron_fields(rule, after, expected):
+    assert bot.parse_recurrence(rule).next_after(after) == expected
+
+
+def test_daily_keeps_local_time_across_dst():
+    # В Берлине 31 марта 2024 часы переводятся на летнее время
+    due = datetime(2024, 3, 30, 9, 0)
+    epoch = bot.to_epoch(due, "Europe/Berlin")
+    following = bot.next_occurrence("daily", epoch, "Europe/Berlin", now=datetime(2024, 3, 1))
+    assert bot.to_local(following, "Europe/Berlin") == datetime(2024, 3, 31, 9, 0)
+    assert following - epoch == 23 * 3600
+
+
+@pytest.mark.parametrize("rule", [
+    "hourly", "weekly:", "weekly:funday", "weekly:8", "monthly:0", "monthly:32",
+    "cron:0 9 * *", "cron:60 * * * *", "cron:*/0 * * * *", "cron:0 24 * * *", "cron:0 9 5-1 * *",
+])
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises((ValueError, KeyError)):
+        bot.RecurrenceRule(rule)
+
+
+def test_describe():
+    assert bot.parse_recurrence("weekly:fri,mon").describe() == "по дням: пн, пт"
+    assert bot.parse_recurrence("monthly:15").describe() == "каждый месяц 15-го числа"
+    assert bot.parse_recurrence("cron:0 9 * * 1-5").describe() == "по расписанию 0 9 * * 1-5"
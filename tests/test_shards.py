@@ -0,0 +1,190 @@
+import bot
+from conftest import user_on_shard
+
+
+def open_manager(path, shard_count):
+    return bot.TaskManager(db_path=str(path / "tasks.db"), shard_count=shard_count)
+
+
+def close_manager(manager):
+    for shard in manager.shards:
+        shard.conn.close()
+
+
+def task_texts(manager, user_id):
+    return sorted(task[2] for task in manager.get_user_tasks(user_id))
+
+
+def test_fresh_database_uses_shard_count(manager):
+    assert manager.layout == 2
+
+
+def test_old_layout_is_used_until_rebalance(tmp_path):
+    user_id = user_on_shard(1)
+    manager = open_manager(tmp_path, 1)
+    manager.add_task(user_id, "До решардинга")
+    manager.set_user_timezone(user_id, "Europe/Moscow")
+    close_manager(manager)
+
+    manager = open_manager(tmp_path, 2)
+    assert manager.layout == 1
+    # Старые задачи видны, новые пишутся туда же, где лежат старые
+    assert task_texts(manager, user_id) == ["До решардинга"]
+    manager.add_task(user_id, "После решардинга")
+    manager.set_user_timezone(user_id, "Asia/Tokyo")
+
+    assert manager.rebalance() == 1
+    assert manager.layout == 2
+    assert manager._shard_for(user_id).index == 1
+    assert task_texts(manager, user_id) == ["До решардинга", "После решардинга"]
+    assert manager.get_user_timezone(user_id) == "Asia/Tokyo"
+    close_manager(manager)
+
+    manager = open_manager(tmp_path, 2)
+    assert manager.layout == 2
+    assert not manager._directory
+    assert task_texts(manager, user_id) == ["До решардинга", "После решардинга"]
+    close_manager(manager)
+
+
+def test_rebalance_merges_without_overwriting_newer_rows(manager):
+    user_id = user_on_shard(1)
+    # Данные разошлись по двум шардам: старые в шарде 0, новые уже в шарде 1
+    with manager.shards[0].session() as conn:
+        conn.execute(
+            "INSERT INTO tasks (user_id, text, created_at) VALUES (?, 'Старая', '2024-01-01T00:00:00')",
+            (user_id,)
+        )
+        conn.execute("INSERT INTO user_settings (user_id, timezone) VALUES (?, 'Europe/Moscow')", (user_id,))
+        conn.commit()
+    manager.add_task(user_id, "Новая")
+    manager.set_user_timezone(user_id, "Asia/Tokyo")
+
+    assert manager.rebalance() == 1
+    manager._timezones.clear()
+    assert task_texts(manager, user_id) == ["Новая", "Старая"]
+    assert manager.get_user_timezone(user_id) == "Asia/Tokyo"
+    with manager.shards[0].session() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ?", (user_id,)).fetchone()[0] == 0
+
+
+def test_interrupted_move_does_not_duplicate_tasks(manager):
+    user_id = user_on_shard(0)
+    manager.add_task(user_id, "Задача")
+    # Прерванный перенос: задача уже скопирована в шард 1, справочник не обновлен
+    with manager.shards[0].session() as conn:
+        row = conn.execute("SELECT user_id, text, created_at FROM tasks WHERE user_id = ?", (user_id,)).fetchone()
+    with manager.shards[1].session() as conn:
+        conn.execute("INSERT INTO tasks (user_id, text, created_at) VALUES (?, ?, ?)", row)
+        conn.commit()
+
+    assert manager.move_user(user_id, 1) == 1
+    assert manager._directory[user_id] == 1
+    assert task_texts(manager, user_id) == ["Задача"]
+
+
+def test_shrinking_moves_users_back(tmp_path):
+    user_id = user_on_shard(1)
+    manager = open_manager(tmp_path, 2)
+    manager.add_task(user_id, "Задача")
+    close_manager(manager)
+
+    manager = open_manager(tmp_path, 1)
+    assert manager.layout == 2 and len(manager.shards) == 2
+    assert task_texts(manager, user_id) == ["Задача"]
+
+    manager.rebalance()
+    assert len(manager.shards) == 1
+    assert task_texts(manager, user_id) == ["Задача"]
+    close_manager(manager)
+
+
+def test_stopped_rebalance_keeps_old_layout(tmp_path):
+    user_id = user_on_shard(1)
+    manager = open_manager(tmp_path, 1)
+    manager.add_task(user_id, "Задача")
+    close_manager(manager)
+
+    manager = open_manager(tmp_path, 2)
+    stop = bot.threading.Event()
+    stop.set()
+    assert manager.rebalance(stop) == 0
+    assert manager.layout == 1
+    assert task_texts(manager, user_id) == ["Задача"]
+    close_manager(manager)
+
+
+def test_rebalance_adds_up_stats(manager):
+    user_id = user_on_shard(1)
+    manager.add_task(user_id, "Новая")
+    day = manager.get_stats(user_id, 1)[0][0][0]
+    # Счетчики того же дня, накопленные в шарде 0 до переноса
+    with manager.shards[0].session() as conn:
+        manager._bump_stats(conn.cursor(), user_id, day, created=2, completed=1, on_time=1)
+        manager._bump_backlog(conn.cursor(), user_id, 2, 2)
+        conn.commit()
+
+    manager.rebalance()
+    daily, backlog = manager.get_stats(user_id, 1)
+    assert daily == [(day, 3, 1, 1)]
+    assert backlog == {2: 3}
+
+
+def misplaced_rows(manager):
+    rows = []
+    for shard in manager.shards:
+        with shard.session() as conn:
+            rows += [
+                user_id for (user_id,) in conn.execute("SELECT user_id FROM tasks")
+                if manager._shard_for(user_id) is not shard
+            ]
+    return rows
+
+
+def test_writer_blocked_during_move_follows_the_user(manager):
+    user_id = user_on_shard(1)
+    manager.add_task(user_id, "До переноса")
+    source, target = manager.shards[1], manager.shards[0]
+
+    with manager._sessions([source, target]) as conns:
+        # Обработчик выбрал шард 1 и ждет его блокировку, пока идет перенос
+        writer = bot.threading.Thread(target=manager.add_task, args=(user_id, "Во время переноса"))
+        writer.start()
+        bot.time.sleep(0.2)
+        manager._move_user(conns, user_id, source, target)
+    writer.join()
+
+    assert manager._shard_for(user_id) is target
+    assert task_texts(manager, user_id) == ["Во время переноса", "До переноса"]
+    assert misplaced_rows(manager) == []
+
+
+def test_writes_during_rebalance_are_not_orphaned(tmp_path):
+    manager = open_manager(tmp_path, 1)
+    for user_id in range(1, 201):
+        manager.add_task(user_id, "До перебалансировки")
+    close_manager(manager)
+
+    manager = open_manager(tmp_path, 2)
+    done = bot.threading.Event()
+    written = []
+
+    def writer():
+        user_id = 0
+        while not done.is_set():
+            user_id = user_id % 400 + 1
+            manager.add_task(user_id, "Во время перебалансировки")
+            written.append(user_id)
+
+    thread = bot.threading.Thread(target=writer)
+    thread.start()
+    manager.rebalance()
+    done.set()
+    thread.join()
+
+    assert manager.layout == 2 and len(manager.shards) == 2
+    assert misplaced_rows(manager) == []
+    assert sum(stats[3] for stats in manager.shard_stats()) == 200 + len(written)
+    # Последний проход под всеми блокировками переносит только тех, кто писал во время переноса
+    assert manager.last_final_pass is not None
+    close_manager(manager)
@@ -0,0 +1,95 @@
+import asyncio
+
+import bot
+
+OWNER, MEMBER, OUTSIDER = 11, 12, 13
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def shared_list(manager, name="Покупки"):
+    list_id, code = manager.create_shared_list(OWNER, "Аня", "anya", name)
+    assert manager.join_shared_list(MEMBER, "Боря", "borya", code) == (list_id, name)
+    return list_id, code
+
+
+def test_join_by_invite_code(manager):
+    list_id, code = shared_list(manager)
+    assert manager.join_shared_list(OUTSIDER, "Вера", "vera", "неверный") is None
+    # Повторное вступление обновляет имя, а не добавляет участника
+    manager.join_shared_list(MEMBER, "Борис", "boris", code)
+    name, members = manager.get_list_members([list_id])[list_id]
+    assert name == "Покупки" and sorted(members) == [OWNER, MEMBER]
+    assert [row[:4] for row in manager.get_user_lists(MEMBER)] == [(list_id, "Покупки", code, 2)]
+    assert manager.get_list_tasks(list_id, OUTSIDER) is None
+
+
+def test_leave_clears_assignment_and_last_member_deletes_list(manager):
+    list_id, _ = shared_list(manager)
+    task_id = manager.add_list_task(list_id, MEMBER, "Хлеб")
+    manager.assign_list_task(task_id, MEMBER)
+
+    assert manager.leave_shared_list(MEMBER, list_id)
+    assert not manager.leave_shared_list(MEMBER, list_id)
+    assert manager.get_list_tasks(list_id, OWNER) == ("Покупки", [(task_id, "Хлеб", None)])
+
+    assert manager.leave_shared_list(OWNER, list_id)
+    assert manager.get_list_members([list_id]) == {}
+    with manager.shards[0].session() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM list_tasks WHERE list_id = ?", (list_id,)).fetchone()[0] == 0
+
+
+def test_assignment_is_limited_to_members(manager):
+    list_id, _ = shared_list(manager)
+    task_id = manager.add_list_task(list_id, OWNER, "Молоко")
+    assert manager.add_list_task(list_id, OUTSIDER, "Чужая задача") is None
+
+    assert manager.assign_list_task(task_id, OWNER) == (list_id, "Молоко", "Аня")
+    assert manager.assign_list_task(task_id, OWNER, "BORYA") == (list_id, "Молоко", "Боря")
+    # Не участник не назначает, и назначить можно только участнику
+    assert manager.assign_list_task(task_id, OUTSIDER) is None
+    assert manager.assign_list_task(task_id, OWNER, "vera") is None
+    assert manager.get_list_tasks(list_id, OWNER)[1] == [(task_id, "Молоко", "Боря")]
+
+    assert manager.complete_list_task(task_id, MEMBER) == (list_id, "Молоко")
+    assert manager.assign_list_task(task_id, OWNER) is None
+
+
+def test_notifier_batches_events_per_member(manager):
+    first, _ = shared_list(manager)
+    second, _ = shared_list(manager, "Работа")
+    notifier = bot.ListNotifier(manager, pacer=bot.SendPacer(1000))
+    notifier.notify(first, OWNER, "➕ Хлеб")
+    notifier.notify(first, MEMBER, "➕ Молоко")
+    notifier.notify(first, OWNER, "✅ Сыр")
+    notifier.notify(second, OWNER, "➕ Отчет")
+
+    fake = FakeBot()
+    assert asyncio.run(notifier.flush(fake)) == 3
+    # Одно сообщение на участника и список; свои события автор не получает
+    assert sorted(fake.sent) == [
+        (OWNER, "👥 Список «Покупки»:\n➕ Молоко"),
+        (MEMBER, "👥 Список «Покупки»:\n➕ Хлеб\n✅ Сыр"),
+        (MEMBER, "👥 Список «Работа»:\n➕ Отчет"),
+    ]
+    assert asyncio.run(notifier.flush(fake)) == 0
+
+
+def test_notifier_keeps_only_latest_events(manager):
+    list_id, _ = shared_list(manager)
+    notifier = bot.ListNotifier(manager, pacer=bot.SendPacer(1000))
+    for index in range(bot.LIST_NOTIFY_MAX_LINES + 5):
+        notifier.notify(list_id, OWNER, f"событие {index}")
+
+    fake = FakeBot()
+    asyncio.run(notifier.flush(fake))
+    [(chat_id, text)] = fake.sent
+    lines = text.splitlines()[1:]
+    assert chat_id == MEMBER
+    assert len(lines) == bot.LIST_NOTIFY_MAX_LINES and lines[-1] == f"событие {bot.LIST_NOTIFY_MAX_LINES + 4}"
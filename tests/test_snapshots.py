@@ -0,0 +1,170 @@
+import gzip
+import os
+import sqlite3
+
+import bot
+from conftest import user_on_shard
+
+
+def make_db(path, rows=200):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+    conn.executemany("INSERT INTO items (body) VALUES (?)", [(f"строка {index} " * 20,) for index in range(rows)])
+    conn.commit()
+    return conn
+
+
+def bodies(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT body FROM items ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_unchanged_db_is_skipped_and_changes_go_to_delta(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    conn = make_db(db_path)
+    snapshots = bot.SnapshotManager(db_path, backup_dir=str(tmp_path / "backups"))
+
+    full = snapshots.take_snapshot()
+    assert full.endswith(bot.SNAPSHOT_SUFFIX)
+    assert snapshots.take_snapshot() is None
+
+    conn.execute("UPDATE items SET body = 'изменено' WHERE id = 1")
+    conn.commit()
+    delta = snapshots.take_snapshot()
+    assert delta.endswith(bot.DELTA_SUFFIX)
+    assert os.path.getsize(delta) < os.path.getsize(full)
+    conn.close()
+
+
+def test_restore_applies_delta_chain(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    conn = make_db(db_path)
+    snapshots = bot.SnapshotManager(db_path, backup_dir=str(tmp_path / "backups"))
+    snapshots.take_snapshot()
+
+    conn.execute("UPDATE items SET body = 'изменено' WHERE id = 1")
+    conn.commit()
+    snapshots.take_snapshot()
+    conn.executemany("INSERT INTO items (body) VALUES (?)", [("новая",)] * 500)
+    conn.execute("DELETE FROM items WHERE id = 2")
+    conn.commit()
+    snapshots.take_snapshot()
+    expected = bodies(db_path)
+    conn.close()
+
+    os.remove(db_path)
+    assert bot.restore_latest_snapshot(db_path, snapshots.backup_dir)
+    assert bodies(db_path) == expected
+
+
+def test_restore_falls_back_before_broken_delta(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    conn = make_db(db_path)
+    snapshots = bot.SnapshotManager(db_path, backup_dir=str(tmp_path / "backups"))
+    snapshots.take_snapshot()
+    conn.execute("UPDATE items SET body = 'первое' WHERE id = 1")
+    conn.commit()
+    snapshots.take_snapshot()
+    expected = bodies(db_path)
+    conn.execute("UPDATE items SET body = 'второе' WHERE id = 1")
+    conn.commit()
+    broken = snapshots.take_snapshot()
+    conn.close()
+
+    with gzip.open(broken, 'rb') as packed:
+        data = packed.read()
+    with gzip.open(broken, 'wb') as packed:
+        packed.write(data[:len(data) // 2])
+
+    os.remove(db_path)
+    assert bot.restore_latest_snapshot(db_path, snapshots.backup_dir)
+    assert bodies(db_path) == expected
+
+
+def test_restore_removes_stale_wal(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    conn = make_db(db_path)
+    snapshots = bot.SnapshotManager(db_path, backup_dir=str(tmp_path / "backups"))
+    snapshots.take_snapshot()
+    expected = bodies(db_path)
+
+    # WAL с кадрами, которых нет в снимке, остается от прежнего файла
+    conn.execute("PRAGMA wal_autocheckpoint=0")
+    conn.execute("DELETE FROM items")
+    conn.commit()
+    stale_wal = open(db_path + "-wal", 'rb').read()
+    conn.close()
+    os.remove(db_path)
+    with open(db_path + "-wal", 'wb') as stale:
+        stale.write(stale_wal)
+
+    assert bot.restore_latest_snapshot(db_path, snapshots.backup_dir)
+    assert bodies(db_path) == expected
+
+
+def test_retention_keeps_base_of_kept_deltas(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    conn = make_db(db_path)
+    snapshots = bot.SnapshotManager(db_path, backup_dir=str(tmp_path / "backups"), keep=3, full_every=3)
+
+    def snapshot_kinds():
+        return [bot.is_full_snapshot(path) for path in bot.list_snapshots(snapshots.backup_dir, "tasks-")]
+
+    for index in range(7):
+        conn.execute("UPDATE items SET body = ? WHERE id = 1", (f"версия {index}",))
+        conn.commit()
+        snapshots.take_snapshot()
+        if index == 5:
+            # Самая старая из трех последних - дельта первой цепочки: цепочка целиком остается
+            assert snapshot_kinds() == [True, False, False, False, True, False]
+    expected = bodies(db_path)
+    conn.close()
+
+    assert snapshot_kinds() == [True, False, False]
+
+    os.remove(db_path)
+    assert bot.restore_latest_snapshot(db_path, snapshots.backup_dir)
+    assert bodies(db_path) == expected
+
+
+def test_surplus_shards_get_snapshots_after_shrink(tmp_path):
+    user_id = user_on_shard(1)
+    manager = bot.TaskManager(db_path=str(tmp_path / "tasks.db"), shard_count=2)
+    manager.add_task(user_id, "Задача во втором шарде")
+    for shard in manager.shards:
+        shard.conn.close()
+
+    # DB_SHARDS уменьшили до 1: второй шард открыт, пока из него не перенесут данные
+    manager = bot.TaskManager(db_path=str(tmp_path / "tasks.db"), shard_count=1)
+    snapshot_managers = bot.build_snapshot_managers(manager)
+    assert [snapshots.db_path for snapshots in snapshot_managers] == [shard.db_path for shard in manager.shards]
+    assert len(snapshot_managers) == 2
+
+    surplus = snapshot_managers[1]
+    surplus.backup_dir = str(tmp_path / "backups")
+    assert surplus.take_snapshot().endswith(bot.SNAPSHOT_SUFFIX)
+    for shard in manager.shards:
+        shard.conn.close()
+
+
+def test_snapshot_managers_are_built_on_deferred_init(tmp_path, monkeypatch):
+    assert bot.snapshot_managers == []
+    monkeypatch.setattr(bot, "snapshot_managers", [])
+
+    user_id = user_on_shard(1)
+    manager = bot.TaskManager(db_path=str(tmp_path / "tasks.db"), shard_count=2)
+    manager.add_task(user_id, "Задача во втором шарде")
+    for shard in manager.shards:
+        shard.conn.close()
+
+    manager = bot.TaskManager(db_path=str(tmp_path / "tasks.db"), shard_count=1, lazy=True)
+    manager.warm_up()
+    bot.asyncio.run(bot.wait_database_ready(manager))
+    assert [snapshots.db_path for snapshots in bot.snapshot_managers] == [shard.db_path for shard in manager.shards]
+    assert len(bot.snapshot_managers) == 2
+    for shard in manager.shards:
+        shard.conn.close()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import re
+from types import SimpleNamespace
+
+import telegram
+from telegram.ext import Application, ConversationHandler
+
+import bot
+
+
+# Приватные множества Application, которые очищает forget_persistence_marks
+PERSISTENCE_MARKS = (
+    "_chat_ids_to_be_updated_in_persistence",
+    "_user_ids_to_be_updated_in_persistence",
+    "_chat_ids_to_be_deleted_in_persistence",
+    "_user_ids_to_be_deleted_in_persistence",
+)
+
+
+def build_application():
+    application = Application.builder().token("0:test").build()
+    bot.register_handlers(application)
+    return application
+
+
+def test_conversation_ends_with_user_data():
+    application = build_application()
+    conversations = [
+        handler
+        for handlers in application.handlers.values()
+        for handler in handlers
+        if isinstance(handler, ConversationHandler)
+    ]
+    assert [handler.conversation_timeout for handler in conversations] == [bot.user_data_janitor.idle]
+
+
+def test_priority_without_task_text_ends_conversation():
+    edits = []
+
+    async def answer():
+        pass
+
+    async def edit_message_text(text, **kwargs):
+        edits.append(text)
+
+    update = SimpleNamespace(
+        callback_query=SimpleNamespace(data="2", answer=answer, edit_message_text=edit_message_text),
+    )
+    # Шаги диалога удалены UserDataJanitor, пока пользователь молчал
+    context = SimpleNamespace(user_data={})
+    assert asyncio.run(bot.add_task_priority(update, context)) == ConversationHandler.END
+    assert len(edits) == 1 and "истекло" in edits[0]
+
+
+def test_persistence_marks_are_forgotten_without_persistence():
+    application = build_application()
+    application.mark_data_for_update_persistence(chat_ids=[1, 2], user_ids=[1, 2])
+    application.drop_user_data(3)
+
+    bot.forget_persistence_marks(application)
+    assert not any(getattr(application, name) for name in PERSISTENCE_MARKS)
+
+
+def test_pinned_ptb_keeps_persistence_marks():
+    # forget_persistence_marks полагается на приватные атрибуты PTB: при
+    # обновлении библиотеки этот тест укажет, что его нужно пересмотреть
+    requirements = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "requirements.txt")
+    with open(requirements) as requirements_file:
+        pinned = re.search(r"^python-telegram-bot\[job-queue\]==(\S+)$", requirements_file.read(), re.M)
+    assert pinned and telegram.__version__ == pinned.group(1)
+
+    application = build_application()
+    for name in PERSISTENCE_MARKS:
+        assert isinstance(getattr(application, name, None), set), name
+
+
+def test_janitor_drops_user_data_of_idle_users():
+    application = build_application()
+    janitor = bot.UserDataJanitor(idle=60)
+    for user_id in (1, 2, 3):
+        application.user_data[user_id]["step"] = "text"
+        janitor.touch(application, user_id, now=0)
+
+    janitor.touch(application, 2, now=30)
+    janitor.touch(application, 4, now=70)
+    # Пользователи 1 и 3 молчали дольше idle; 2 недавно писал
+    assert sorted(application.user_data) == [2]
+    assert list(janitor._seen) == [2, 4] and len(janitor) == 2
+
+
+def test_middleware_touches_user_and_forgets_marks(monkeypatch):
+    application = build_application()
+    janitor = bot.UserDataJanitor(idle=60)
+    monkeypatch.setattr(bot, "user_data_janitor", janitor)
+    application.mark_data_for_update_persistence(chat_ids=[5], user_ids=[5])
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=5))
+    asyncio.run(bot.user_data_middleware(update, SimpleNamespace(application=application)))
+    assert list(janitor._seen) == [5]
+    assert not any(getattr(application, name) for name in PERSISTENCE_MARKS)
+
+    asyncio.run(bot.user_data_middleware(SimpleNamespace(effective_user=None), SimpleNamespace(application=application)))
+    assert list(janitor._seen) == [5]
+
+
+def test_conversation_timeout_has_job_queue():
+    # conversation_timeout работает только с JobQueue (экстра job-queue в requirements.txt)
+    assert build_application().job_queue is not None
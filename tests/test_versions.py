@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+import bot
+
+
+def test_stale_version_is_rejected(manager):
+    task_id = manager.add_task(1, "Задача")
+    version = manager.get_task(task_id, 1, with_version=True)[7]
+
+    assert manager.update_task(task_id, 1, expected_version=version, text="С телефона")
+    assert manager.update_task(task_id, 1, expected_version=version, text="С ноутбука") is None
+
+    task = manager.get_task(task_id, 1, with_version=True)
+    assert task[2] == "С телефона"
+    assert task[7] == version + 1
+
+
+def test_unknown_column_raises(manager):
+    task_id = manager.add_task(1, "Задача")
+    with pytest.raises(ValueError):
+        manager.update_task(task_id, 1, created_at="2000-01-01")
+    with pytest.raises(ValueError):
+        manager.update_task(task_id, 1, expected_version=0, escalation=5)
+
+
+def test_concurrent_compare_and_set_loses_no_updates(manager):
+    task_id = manager.add_task(1, "0")
+    threads_count, increments = 8, 50
+
+    def worker():
+        for _ in range(increments):
+            while True:
+                task = manager.get_task(task_id, 1, with_version=True)
+                if manager.update_task(task_id, 1, expected_version=task[7], text=str(int(task[2]) + 1)):
+                    break
+
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    task = manager.get_task(task_id, 1, with_version=True)
+    assert task[2] == str(threads_count * increments)
+    assert task[7] == threads_count * increments
+
+
+def test_snooze_retries_after_concurrent_edit(manager):
+    due_date = int(time.time()) + 3600
+    task_id = manager.add_task(1, "Задача", due_date=due_date)
+    original = manager.get_task
+    calls = []
+
+    def get_task_then_edit(*args, **kwargs):
+        task = original(*args, **kwargs)
+        if not calls:
+            # Между чтением и записью срок поменяли с другого устройства
+            manager.update_task(task_id, 1, due_date=due_date + 7200)
+        calls.append(task)
+        return task
+
+    manager.get_task = get_task_then_edit
+    assert manager.snooze_task(task_id, 1, 3600) == due_date + 7200 + 3600
+    assert len(calls) == 2
+    assert original(task_id, 1)[3] == due_date + 7200 + 3600
+
+
+def test_snooze_skips_completed_task(manager):
+    task_id = manager.add_task(1, "Задача", due_date=int(time.time()) + 60)
+    manager.complete_task(task_id, 1)
+    assert manager.snooze_task(task_id, 1, 3600) is None
+
+
+def traced_statements(manager, user_id, action):
+    statements = []
+    conn = manager._shard_for(user_id).conn
+    conn.set_trace_callback(statements.append)
+    try:
+        action()
+    finally:
+        conn.set_trace_callback(None)
+    return [statement.split()[0] for statement in statements if statement.split()[0] in ("SELECT", "UPDATE")]
+
+
+def test_update_without_stats_change_is_one_statement(manager):
+    task_id = manager.add_task(1, "Задача")
+    assert traced_statements(
+        manager, 1, lambda: manager.update_task(task_id, 1, expected_version=0, text="Новый текст", due_date=10)
+    ) == ["UPDATE"]
+    # Для агрегатов /stats нужны старые статус и приоритет
+    assert traced_statements(
+        manager, 1, lambda: manager.update_task(task_id, 1, expected_version=1, priority=3)
+    ) == ["SELECT", "UPDATE"]
+
+    task = manager.get_task(task_id, 1, with_version=True)
+    assert (task[2], task[3], task[4], task[7]) == ("Новый текст", 10, 3, 2)
+    assert manager.update_task(task_id, 1, expected_version=1, text="Устаревшая правка") is None
+    assert manager.update_task(999, 1, text="Нет такой задачи") is None
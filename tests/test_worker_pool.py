@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+
+import bot
+
+
+def slow_export(db_path, user_id, fmt, path):
+    time.sleep(0.3)
+    return bot.export_tasks_file(db_path, user_id, fmt, path)
+
+
+def make_path():
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    return path
+
+
+def test_export_writes_into_callers_file(manager):
+    manager.add_task(1, "Задача")
+    path = make_path()
+    try:
+        with open(path, 'w') as stale:
+            stale.write("старое содержимое, которое длиннее экспорта\n" * 10)
+        assert bot.export_tasks_file(manager.user_db_path(1), 1, 'csv', path) == 1
+        with open(path, encoding='utf-8') as exported:
+            assert exported.read().splitlines()[1].split(",")[1] == "Задача"
+    finally:
+        os.remove(path)
+
+
+def test_export_does_not_recreate_removed_file(manager):
+    path = make_path()
+    os.remove(path)
+    with pytest.raises(FileNotFoundError):
+        bot.export_tasks_file(manager.user_db_path(1), 1, 'csv', path)
+    assert not os.path.exists(path)
+
+
+def test_timed_out_export_leaves_no_file(manager):
+    manager.add_task(1, "Задача")
+    pool = bot.WorkerPool(processes=1, timeout=0.05)
+    pool.start()
+
+    async def scenario():
+        path = make_path()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.run(slow_export, manager.user_db_path(1), 1, 'csv', path, user_id=1)
+        finally:
+            os.remove(path)
+        # Процесс доделывает задание уже после удаления файла
+        await asyncio.sleep(0.5)
+        assert pool._pending == 0
+        return path
+
+    try:
+        path = asyncio.run(scenario())
+    finally:
+        pool.stop()
+    assert not os.path.exists(path)
+
+
+def test_queue_limits_per_user_and_total():
+    pool = bot.WorkerPool(processes=1, queue_size=3, user_jobs=2, timeout=5)
+    pool.start()
+
+    async def scenario():
+        jobs = [asyncio.create_task(pool.run(time.sleep, 0.2, user_id=1)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(bot.WorkerPoolBusy):
+            await pool.run(time.sleep, 0.2, user_id=1)
+        jobs.append(asyncio.create_task(pool.run(time.sleep, 0.2, user_id=2)))
+        await asyncio.sleep(0)
+        with pytest.raises(bot.WorkerPoolBusy):
+            await pool.run(time.sleep, 0.2, user_id=3)
+        await asyncio.gather(*jobs)
+        await asyncio.sleep(0.05)
+        assert pool._pending == 0 and not pool._user_pending
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.stop()
+
+
+def test_blocking_job_runs_in_thread_without_pool(manager):
+    manager.add_task(1, "Задача")
+    pool = bot.WorkerPool(processes=0)
+    pool.start()
+
+    def export(db_path, user_id, fmt, path):
+        return bot.threading.current_thread(), bot.export_tasks_file(db_path, user_id, fmt, path)
+
+    async def scenario():
+        path = make_path()
+        try:
+            thread, count = await pool.run(export, manager.user_db_path(1), 1, 'csv', path, user_id=1, blocking=True)
+            inline_thread, _ = await pool.run(export, manager.user_db_path(1), 1, 'csv', path, user_id=1)
+        finally:
+            os.remove(path)
+        return thread, count, inline_thread
+
+    thread, count, inline_thread = asyncio.run(scenario())
+    assert count == 1
+    assert thread is not bot.threading.main_thread()
+    assert inline_thread is bot.threading.main_thread()